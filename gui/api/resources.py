@@ -390,8 +390,7 @@ class ZVolResource(DojoResource):
             bundle.request.body,
             format=bundle.request.META.get('CONTENT_TYPE', 'application/json'),
         )
-        _n = notifier()
-        error, errors = False, {}
+        props = {}
         for attr in (
             'compression',
             'dedup',
@@ -400,14 +399,9 @@ class ZVolResource(DojoResource):
             value = deserialized.get(attr)
             if value is None:
                 continue
-            if value == "inherit":
-                success, err = _n.zfs_inherit_option(name, attr)
-            else:
-                success, err = _n.zfs_set_option(name, attr, value)
-            if not success:
-                error = True
-                errors[attr] = err
-        if error:
+            props[attr] = value
+        success, errors = notifier().zfs_set_options(name, props)
+        if not success:
             raise ImmediateHttpResponse(
                 response=self.error_response(bundle.request, errors)
             )
@@ -2204,6 +2198,7 @@ class SnapshotResource(DojoResource):
     fullname = fields.CharField(attribute='fullname')
     refer = fields.IntegerField(attribute='refer')
     used = fields.IntegerField(attribute='used')
+    creation = fields.IntegerField(attribute='creation', null=True)
     mostrecent = fields.BooleanField(attribute='mostrecent')
     parent_type = fields.CharField(attribute='parent_type')
     replication = fields.CharField(attribute='replication', null=True)
@@ -2276,26 +2271,15 @@ class SnapshotResource(DojoResource):
             if found is False:
                 repli[repl] = set(notifier().repl_remote_snapshots(repl))
 
-        snapshots = notifier().zfs_snapshot_list(replications=repli)
-
-        results = []
-        for snaps in snapshots.values():
-            results.extend(snaps)
         FIELD_MAP = {
             'extra': 'mostrecent',
         }
-
+        sort = []
         for sfield in self._apply_sorting(request.GET):
             if sfield.startswith('-'):
-                field = sfield[1:]
-                reverse = True
+                sort.append('-' + FIELD_MAP.get(sfield[1:], sfield[1:]))
             else:
-                field = sfield
-                reverse = False
-            field = FIELD_MAP.get(field, field)
-            results.sort(
-                key=lambda item: getattr(item, field),
-                reverse=reverse)
+                sort.append(FIELD_MAP.get(sfield, sfield))
 
         limit = self._meta.limit
         if 'HTTP_X_RANGE' in request.META:
@@ -2305,31 +2289,58 @@ class SnapshotResource(DojoResource):
 
         paginator = self._meta.paginator_class(
             request,
-            results,
+            [],
             resource_uri=self.get_resource_uri(),
             limit=limit,
             max_limit=self._meta.max_limit,
             collection_name=self._meta.collection_name,
         )
-        to_be_serialized = paginator.page()
+        offset = paginator.get_offset()
+
+        # Only the requested page is built, filtering and sorting included
+        try:
+            creation = {}
+            for key in ('creation__gte', 'creation__lte'):
+                value = request.GET.get(key)
+                if value:
+                    try:
+                        creation[key] = int(value)
+                    except ValueError:
+                        raise ValueError("Invalid %s: %s" % (key, value))
+            total, results = notifier().zfs_snapshot_query(
+                dataset=request.GET.get('dataset'),
+                name=request.GET.get('name'),
+                creation_from=creation.get('creation__gte'),
+                creation_to=creation.get('creation__lte'),
+                sort=sort or ['-creation'],
+                offset=offset,
+                limit=paginator.get_limit(),
+                replications=repli,
+            )
+        except ValueError, e:
+            raise ImmediateHttpResponse(
+                response=self.error_response(request, {
+                    'error': str(e),
+                })
+            )
+
         # Dehydrate the bundles in preparation for serialization.
         bundles = []
 
-        for obj in to_be_serialized[self._meta.collection_name]:
+        for obj in results:
             bundle = self.build_bundle(obj=obj, request=request)
             bundles.append(self.full_dehydrate(bundle))
 
         length = len(bundles)
-        to_be_serialized[self._meta.collection_name] = bundles
         to_be_serialized = self.alter_list_data_to_serialize(
             request,
-            to_be_serialized
+            {self._meta.collection_name: bundles},
         )
         response = self.create_response(request, to_be_serialized)
         response['Content-Range'] = 'items %d-%d/%d' % (
-            paginator.offset,
-            paginator.offset + length - 1,
-            len(results)
+            offset,
+            offset + length - 1,
+            total
         )
         return response
 
@@ -42,6 +42,7 @@ import oauth2 as oauth
 
 from freenasUI import settings as mysettings
 from freenasUI.freeadmin.views import JsonResp
+from freenasUI.middleware import zfs
 from freenasUI.middleware.exceptions import MiddlewareError
 from freenasUI.services.exceptions import ServiceFailed
 from freenasUI.services.models import RPCToken
@@ -275,3 +276,21 @@ class ProfileMiddleware(object):
                 len(comment)
 
         return response
+
+
+class PoolStatsMiddleware(object):
+    """
+    Share the statistics of the pools, gathered by a single zpool list,
+    between every volume accessed within a GET request.
+    Other methods may change pools so they get fresh statistics.
+    """
+
+    def process_request(self, request):
+        if request.method == 'GET':
+            zfs.set_pool_stats(zfs.PoolStats())
+        else:
+            zfs.set_pool_stats(None)
+
+    def process_response(self, request, response):
+        zfs.set_pool_stats(None)
+        return response
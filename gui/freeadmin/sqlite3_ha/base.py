@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 import logging
 import os
+import re
 import socket
 import threading
 import xmlrpclib
@@ -30,6 +31,74 @@ NO_SYNC_MAP = {
     },
 }
 
+"""
+Callables notified with the set of tables modified by every transaction
+committed by this process, None meaning the tables could not be told.
+Used e.g. by middlewared to invalidate its datastore cache.
+"""
+WRITE_LISTENERS = []
+
+RE_WRITE_TABLE = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM|REPLACE\s+INTO)\s+[`"\[]?(\w+)',
+    re.I,
+)
+
+
+def add_write_listener(callback):
+    WRITE_LISTENERS.append(callback)
+
+
+# Tables written by the transaction of the thread connection, not yet committed
+_pending_writes = threading.local()
+
+
+def notify_listeners(tables):
+    for callback in WRITE_LISTENERS:
+        try:
+            callback(tables)
+        except Exception:
+            log.error('Failed to notify write listener', exc_info=True)
+
+
+def notify_write(connection, query):
+    """
+    Notify listeners in case the query modifies the database, once the
+    transaction is committed unless running in autocommit mode.
+    """
+    if not WRITE_LISTENERS:
+        return
+    keyword = query.lstrip()[:7].upper()
+    if keyword.startswith(('INSERT', 'UPDATE', 'DELETE', 'REPLACE')):
+        reg = RE_WRITE_TABLE.search(query)
+        tables = set([reg.group(1)]) if reg else None
+    elif keyword.startswith(('CREATE', 'DROP', 'ALTER')):
+        # Committed right away by sqlite3 along with the pending writes
+        tables = None
+    else:
+        return
+    pending = getattr(_pending_writes, 'tables', None)
+    if connection.isolation_level is not None and tables is not None:
+        if pending is None:
+            _pending_writes.tables = tables
+        else:
+            pending |= tables
+        return
+    if pending and tables is not None:
+        tables |= pending
+    _pending_writes.tables = None
+    notify_listeners(tables)
+
+
+def notify_commit():
+    tables = getattr(_pending_writes, 'tables', None)
+    if tables:
+        _pending_writes.tables = None
+        notify_listeners(tables)
+
+
+def discard_writes():
+    _pending_writes.tables = None
+
 
 class Journal(object):
     """
@@ -86,13 +155,17 @@ class RunSQLRemote(threading.Thread):
     """
     This is a thread responsible for running the queries on the remote side.
 
-    The query will be appended to the Journal in case the Journal is not empty
-    or if it fails (e.g. remote side offline)
+    Either a single query (sql and params) or a list of (sql, params) queries
+    can be given, the latter are run in order.
+
+    The queries will be appended to the Journal in case the Journal is not
+    empty or if it fails (e.g. remote side offline)
     """
 
     def __init__(self, *args, **kwargs):
-        self._sql = kwargs.pop('sql')
-        self._params = kwargs.pop('params')
+        self._queries = kwargs.pop('queries', None)
+        if self._queries is None:
+            self._queries = [(kwargs.pop('sql'), kwargs.pop('params'))]
         super(RunSQLRemote, self).__init__(*args, **kwargs)
 
     def run(self):
@@ -100,23 +173,63 @@ class RunSQLRemote(threading.Thread):
         from freenasUI.common.log import log_traceback
         # FIXME: cache IP value
         s = notifier().failover_rpc()
+        pending = list(self._queries)
         try:
             with Journal() as f:
                 if f.queries:
-                    f.queries.append((self._sql, self._params))
+                    f.queries.extend(pending)
+                    pending = []
                 else:
-                    s.run_sql(self._sql, self._params)
+                    while pending:
+                        sql, params = pending[0]
+                        s.run_sql(sql, params)
+                        pending.pop(0)
         except socket.error as err:
             with Journal() as f:
-                f.queries.append((self._sql, self._params))
+                f.queries.extend(pending)
             return False
         except Exception as err:
             log_traceback(log=log)
-            log.error('Failed to run SQL remotely %s: %s', self._sql, err)
+            log.error('Failed to run SQL remotely %s: %s', pending[0][0] if pending else None, err)
             return False
         return True
 
 
+_remote_batch = threading.local()
+
+
+class RemoteBatch(object):
+    """
+    Context manager gathering the queries to run on the remote side within
+    the block so they are sent in order by a single RunSQLRemote at exit.
+    Nothing is sent if the block raises, e.g. transaction rolled back.
+    """
+
+    def __enter__(self):
+        self._nested = getattr(_remote_batch, 'queries', None) is not None
+        if not self._nested:
+            _remote_batch.queries = []
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        if self._nested:
+            return
+        queries = _remote_batch.queries
+        _remote_batch.queries = None
+        if typ is None and queries:
+            RunSQLRemote(queries=queries).start()
+
+
+def run_sql_remote(sql, params):
+    queries = getattr(_remote_batch, 'queries', None)
+    if queries is not None:
+        queries.append((sql, params))
+    else:
+        # Actually try to run the query on the remote side within a thread
+        rsr = RunSQLRemote(sql=sql, params=params)
+        rsr.start()
+
+
 class DatabaseFeatures(sqlite3base.DatabaseFeatures):
     pass
 
@@ -130,6 +243,17 @@ class DatabaseWrapper(sqlite3base.DatabaseWrapper):
     def create_cursor(self):
         return self.connection.cursor(factory=HASQLiteCursorWrapper)
 
+    def _commit(self):
+        rv = super(DatabaseWrapper, self)._commit()
+        notify_commit()
+        return rv
+
+    def _rollback(self):
+        try:
+            return super(DatabaseWrapper, self)._rollback()
+        finally:
+            discard_writes()
+
     def dump_send(self):
         """
         Method responsible for dumping the database into SQL,
@@ -234,6 +358,8 @@ class DatabaseWrapper(sqlite3base.DatabaseWrapper):
                 'COMMIT;'
             ]
         ))
+        # Whole database has been replaced
+        notify_listeners(None)
 
         with Journal() as j:
             j.queries = []
@@ -364,16 +490,17 @@ class HASQLiteCursorWrapper(Database.Cursor):
                 sql = self.convert_query(str(p))
             else:
                 sql = str(p)
-            # Actually try to run the query on the remote side within a thread
-            rsr = RunSQLRemote(sql=sql, params=cparams)
-            rsr.start()
+            run_sql_remote(sql, cparams)
 
     def execute(self, query, params=None):
 
         if params is None:
-            return Database.Cursor.execute(self, query)
+            execute = Database.Cursor.execute(self, query)
+            notify_write(self.connection, query)
+            return execute
         query = self.convert_query(query)
         execute = Database.Cursor.execute(self, query, params)
+        notify_write(self.connection, query)
 
         # Allow sync to be bypassed just to be extra safe on things like
         # database migration.
@@ -393,13 +520,18 @@ class HASQLiteCursorWrapper(Database.Cursor):
 
     def executelocal(self, query, params=None):
         if params is None:
-            return Database.Cursor.execute(self, query)
-        query = self.convert_query(query)
-        return Database.Cursor.execute(self, query, params)
+            execute = Database.Cursor.execute(self, query)
+        else:
+            query = self.convert_query(query)
+            execute = Database.Cursor.execute(self, query, params)
+        notify_write(self.connection, query)
+        return execute
 
     def executemany(self, query, param_list):
         query = self.convert_query(query)
-        return Database.Cursor.executemany(self, query, param_list)
+        execute = Database.Cursor.executemany(self, query, param_list)
+        notify_write(self.connection, query)
+        return execute
 
     def convert_query(self, query):
         return sqlite3base.FORMAT_QMARK_REGEX.sub('?', query).replace(
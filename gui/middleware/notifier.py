@@ -40,10 +40,12 @@ import base64
 from Crypto.Cipher import AES
 import ctypes
 import errno
+import fnmatch
 import glob
 import grp
 import json
 import logging
+import operator
 import os
 import pipes
 import platform
@@ -3361,9 +3363,9 @@ class notifier:
     def get_volume_status(self, name, fs):
         status = 'UNKNOWN'
         if fs == 'ZFS':
-            p1 = self._pipeopen('zpool list -H -o health %s' % str(name), logger=None)
-            if p1.wait() == 0:
-                status = p1.communicate()[0].strip('\n')
+            stats = zfs.pool_stats(str(name))
+            if stats is not None:
+                status = stats['health']
         elif fs == 'UFS':
 
             provider = self.get_label_consumer('ufs', name)
@@ -3789,80 +3791,168 @@ class notifier:
             raise MiddlewareError('Unable to scrub %s: %s' % (name, stderr))
         return True
 
-    def zfs_snapshot_list(self, path=None, replications=None, sort=None, system=False):
+    def _zfs_snapshot_rows(self, path=None, system=False):
+        """
+        zfs.snapshot_list of the data pools, most recent first,
+        skipping the system dataset unless `system` is set
+        """
         from freenasUI.storage.models import Volume
-        fsinfo = dict()
-
-        if sort is None:
-            sort = ''
-        else:
-            sort = '-s %s' % sort
 
+        basename = None
         if system is False:
             systemdataset, basename = self.system_dataset_settings()
 
-        if replications is None:
-            replications  = {}
-
-        zfsproc = self._pipeopen("/sbin/zfs list -t volume -o name %s -H" % sort)
-        zvols = set(filter(lambda y: y != '', zfsproc.communicate()[0].split('\n')))
         volnames = set([o.vol_name for o in Volume.objects.filter(vol_fstype='ZFS')])
 
-        fieldsflag = '-o name,used,available,referenced,mountpoint,freenas:vmsynced'
-        if path:
-            zfsproc = self._pipeopen("/sbin/zfs list -p -r -t snapshot %s -H -S creation '%s'" % (fieldsflag, path))
-        else:
-            zfsproc = self._pipeopen("/sbin/zfs list -p -t snapshot -H -S creation %s" % (fieldsflag))
-        lines = zfsproc.communicate()[0].split('\n')
-        for line in lines:
-            if line != '':
-                _list = line.split('\t')
-                snapname = _list[0]
-                used = int(_list[1])
-                refer = int(_list[3])
-                vmsynced = _list[5]
-                fs, name = snapname.split('@')
-
-                if system is False and basename:
-                    if fs == basename or fs.startswith(basename + '/'):
-                        continue
+        rv = []
+        for snapshot in zfs.snapshot_list(path):
+            fs = snapshot['name'].split('@', 1)[0]
 
-                # Do not list snapshots from the root pool
-                if fs.split('/')[0] not in volnames:
+            if basename:
+                if fs == basename or fs.startswith(basename + '/'):
                     continue
-                try:
-                    snaplist = fsinfo[fs]
-                    mostrecent = False
-                except:
-                    snaplist = []
-                    mostrecent = True
-                replication = None
-                for repl in replications:
-                    if not (
-                        fs == repl.repl_filesystem or (
-                            repl.repl_userepl and fs.startswith(repl.repl_filesystem + '/')
-                        )
-                    ):
-                        continue
-                    snaps = replications[repl]
-                    remotename = '%s@%s' % (fs.replace(repl.repl_filesystem, repl.repl_zfs), name)
-                    if remotename in snaps:
-                        replication = 'OK'
-                        # TODO: Multiple replication tasks
-
-                snaplist.insert(0, zfs.Snapshot(
-                    name=name,
-                    filesystem=fs,
-                    used=used,
-                    refer=refer,
-                    mostrecent=mostrecent,
-                    parent_type='filesystem' if fs not in zvols else 'volume',
-                    replication=replication,
-                    vmsynced=(vmsynced == 'Y')
-                ))
-                fsinfo[fs] = snaplist
+
+            # Do not list snapshots from the root pool
+            if fs.split('/')[0] not in volnames:
+                continue
+
+            rv.append(snapshot)
+        return rv
+
+    def _zfs_snapshot(self, snapshot, mostrecent):
+        """zfs.Snapshot of a zfs.snapshot_list entry"""
+        fs, name = snapshot['name'].split('@', 1)
+        return zfs.Snapshot(
+            name=name,
+            filesystem=fs,
+            used=snapshot['used'],
+            refer=snapshot['refer'],
+            creation=snapshot['creation'],
+            mostrecent=mostrecent,
+            parent_type=snapshot['parent_type'],
+            vmsynced=(snapshot['vmsynced'] == 'Y')
+        )
+
+    def _zfs_snapshots(self, path=None, system=False):
+        """
+        zfs.Snapshot of the data pools, most recent first,
+        skipping the system dataset unless `system` is set
+        """
+        rv = []
+        seen = set()
+        for snapshot in self._zfs_snapshot_rows(path, system):
+            fs = snapshot['name'].split('@', 1)[0]
+            rv.append(self._zfs_snapshot(snapshot, fs not in seen))
+            seen.add(fs)
+        return rv
+
+    def _zfs_snapshots_replication(self, snapshots, replications):
+        """
+        Flag the snapshots already on the remote side of a replication,
+        `replications` maps Replication objects to their remote snapshots
+        """
+        if not replications:
+            return
+        index = zfs.DatasetIndex()
+        for repl, snaps in replications.items():
+            index.add(repl.repl_filesystem, (repl, snaps), recursive=repl.repl_userepl)
+        for snapshot in snapshots:
+            for repl, snaps in index.match(snapshot.filesystem):
+                remotename = '%s@%s' % (
+                    snapshot.filesystem.replace(repl.repl_filesystem, repl.repl_zfs),
+                    snapshot.name,
+                )
+                if remotename in snaps:
+                    snapshot.replication = 'OK'
+                    # TODO: Multiple replication tasks
+                    break
+
+    def zfs_snapshot_list(self, path=None, replications=None, sort=None, system=False):
+        snapshots = self._zfs_snapshots(path, system)
+        self._zfs_snapshots_replication(snapshots, replications)
+
+        fsinfo = dict()
+        for snapshot in snapshots:
+            fsinfo.setdefault(snapshot.filesystem, []).append(snapshot)
+        # Oldest first
+        for snaplist in fsinfo.values():
+            snaplist.reverse()
         return fsinfo
 
+    def zfs_snapshot_query(
+        self, dataset=None, name=None, creation_from=None, creation_to=None,
+        sort=None, offset=0, limit=None, replications=None, system=False
+    ):
+        """
+        Paginated list of the snapshots of `dataset` and its children
+        (every dataset if not given) whose name matches the shell pattern
+        `name` and created between the `creation_from` and `creation_to`
+        timestamps.
+
+        `sort` is a list of zfs.Snapshot.SORT_FIELDS, prefixed by "-" for
+        descending order, most recent first by default.
+
+        Returns a tuple of the number of matching snapshots and the
+        snapshots of the page. Replication status is only looked up for
+        the snapshots of the page unless sorting by it.
+        """
+        sort = sort or []
+        fields = [field.lstrip('-') for field in sort]
+        for field in fields:
+            if field not in zfs.Snapshot.SORT_FIELDS:
+                raise ValueError("Invalid sort field: %s" % field)
+
+        # Filtered and sorted as returned by zfs.snapshot_list, only the
+        # snapshots of the page are built.
+        rows = self._zfs_snapshot_rows(dataset, system)
+
+        # Rows are most recent first
+        latest = {}
+        for row in rows:
+            latest.setdefault(row['name'].split('@', 1)[0], row['name'])
+
+        def mostrecent(row):
+            return latest[row['name'].split('@', 1)[0]] == row['name']
+
+        if name:
+            pattern = re.compile(fnmatch.translate(name))
+            rows = [i for i in rows if pattern.match(i['name'].split('@', 1)[1])]
+        if creation_from is not None:
+            rows = [i for i in rows if i['creation'] >= creation_from]
+        if creation_to is not None:
+            rows = [i for i in rows if i['creation'] <= creation_to]
+
+        if 'replication' in fields:
+            # Replication status is required to sort every snapshot
+            snapshots = [self._zfs_snapshot(i, mostrecent(i)) for i in rows]
+            self._zfs_snapshots_replication(snapshots, replications)
+            getters = dict((field, operator.attrgetter(field)) for field in fields)
+        else:
+            snapshots = rows
+            getters = {
+                'name': lambda i: i['name'].split('@', 1)[1],
+                'filesystem': lambda i: i['name'].split('@', 1)[0],
+                'fullname': operator.itemgetter('name'),
+                'mostrecent': mostrecent,
+                'vmsynced': lambda i: i['vmsynced'] == 'Y',
+            }
+        # Stable sorts, the first field is the primary key
+        for field in reversed(sort):
+            snapshots.sort(
+                key=getters.get(field.lstrip('-')) or operator.itemgetter(field.lstrip('-')),
+                reverse=field.startswith('-'),
+            )
+
+        total = len(snapshots)
+        if limit:
+            snapshots = snapshots[offset:offset + limit]
+        else:
+            snapshots = snapshots[offset:]
+        if 'replication' not in fields:
+            snapshots = [self._zfs_snapshot(i, mostrecent(i)) for i in snapshots]
+            self._zfs_snapshots_replication(snapshots, replications)
+        return total, snapshots
+
     def zfs_mksnap(self, dataset, name, recursive=False, vmsnaps_count=0):
         if vmsnaps_count > 0:
             vmflag = '-o freenas:vmsynced=Y '
@@ -3936,6 +4026,32 @@ class notifier:
         return True, None
 
     def zfs_get_options(self, name=None, recursive=False, props=None, zfstype=None):
+        return self.__zfs_get(
+            ["'%s'" % str(name)] if name else [],
+            recursive,
+            props,
+            zfstype,
+            per_dataset=recursive,
+        )
+
+    def zfs_get_options_many(self, names, props=None, zfstype=None):
+        """
+        Get ZFS properties of many datasets using a single zfs get
+
+        Returns:
+            dict(name) = dict(property) as in zfs_get_options
+        """
+        if not names:
+            return {}
+        return self.__zfs_get(
+            [pipes.quote(str(name)) for name in names],
+            False,
+            props,
+            zfstype,
+            per_dataset=True,
+        )
+
+    def __zfs_get(self, names, recursive, props, zfstype, per_dataset):
         noinherit_fields = ['quota', 'refquota', 'reservation', 'refreservation']
 
         if props is None:
@@ -3950,7 +4066,7 @@ class notifier:
             '-r' if recursive else '',
             zfstype,
             props,
-            "'%s'" % str(name) if name else '',
+            ' '.join(names),
         ))
         zfs_output = zfsproc.communicate()[0]
         retval = {}
@@ -3958,7 +4074,7 @@ class notifier:
             if not line:
                 continue
             data = line.split('\t')
-            if recursive:
+            if per_dataset:
                 if data[0] not in retval:
                     dval = retval[data[0]] = {}
                 else:
@@ -4015,6 +4131,92 @@ class notifier:
             return True, None
         return False, err
 
+    def zfs_set_options(self, name, props):
+        """
+        Set many ZFS attributes of a dataset using a single zfs set,
+        `props` maps attribute names to values, "inherit" or None to
+        inherit it (one zfs inherit each as it takes a single attribute)
+
+        If zfs set fails attributes are set one by one to find out which
+        ones failed, the others are still set.
+
+        Returns:
+            tuple(bool, dict)
+                bool -> Success of every attribute?
+                dict -> Error message by attribute that failed
+        """
+        success, errors = self.zfs_set_options_many([name], props)
+        return success, errors.get(str(name), {})
+
+    def zfs_set_options_many(self, names, props):
+        """
+        Set many ZFS attributes of many datasets, as zfs_set_options,
+        using a single zfs set for all of them
+
+        If it fails datasets are retried one at a time to find out which
+        attributes of which datasets failed.
+
+        Returns:
+            tuple(bool, dict)
+                bool -> Success of every attribute of every dataset?
+                dict -> dict(name) = dict(attribute) = error message
+        """
+        names = [str(name) for name in names]
+        toset, toinherit = [], []
+        for item, value in props.items():
+            if value is None or value == 'inherit':
+                toinherit.append(str(item))
+            else:
+                toset.append((str(item), str(value)))
+
+        errors = {}
+
+        def failed(name, item, err):
+            errors.setdefault(name, {})[item] = err
+
+        if toset and names:
+            zfsproc = self._pipeopen("zfs set %s %s" % (
+                ' '.join(pipes.quote('%s=%s' % i) for i in toset),
+                ' '.join(pipes.quote(name) for name in names),
+            ))
+            err = zfsproc.communicate()[1]
+            if zfsproc.returncode != 0:
+                if len(names) > 1:
+                    for name in names:
+                        success, errs = self.zfs_set_options(
+                            name, dict(toset)
+                        )
+                        for item, err in errs.items():
+                            failed(name, item, err)
+                elif len(toset) > 1:
+                    for item, value in toset:
+                        success, err = self.zfs_set_option(names[0], item, value)
+                        if not success:
+                            failed(names[0], item, err)
+                else:
+                    failed(names[0], toset[0][0], err)
+
+        # zfs inherit takes a single attribute but many datasets
+        for item in toinherit:
+            if not names:
+                break
+            zfsproc = self._pipeopen("zfs inherit %s %s" % (
+                pipes.quote(item),
+                ' '.join(pipes.quote(name) for name in names),
+            ))
+            err = zfsproc.communicate()[1]
+            if zfsproc.returncode == 0:
+                continue
+            if len(names) > 1:
+                for name in names:
+                    success, err = self.zfs_inherit_option(name, item)
+                    if not success:
+                        failed(name, item, err)
+            else:
+                failed(names[0], item, err)
+
+        return not errors, errors
+
     def zfs_dataset_release_snapshots(self, name, recursive=False):
         name = str(name)
         retval = None
@@ -4611,11 +4813,7 @@ class notifier:
         return disks
 
     def zpool_parse(self, name):
-        doc = self._geom_confxml()
-        p1 = self._pipeopen("zpool status %s" % name)
-        res = p1.communicate()[0]
-        parse = zfs.parse_status(name, doc, res)
-        return parse
+        return zfs.zpool_parse(name, self._geom_confxml())
 
     def zpool_scrubbing(self):
         p1 = self._pipeopen("zpool status")
@@ -5860,35 +6058,7 @@ class notifier:
         It takes the name of the zpool (as a string) as the
         argument. It returns with a tuple of (state, status)
         """
-        status = ''
-        state = ''
-        p1 = self._pipeopen("/sbin/zpool status -x %s" % pool_name, logger=None)
-        zpool_result = p1.communicate()[0]
-        if zpool_result.find("pool '%s' is healthy" % pool_name) != -1:
-            state = 'HEALTHY'
-        else:
-            reg1 = re.search('^\s*state: (\w+)', zpool_result, re.M)
-            if reg1:
-                state = reg1.group(1)
-            else:
-                # The default case doesn't print out anything helpful,
-                # but instead coredumps ;).
-                state = 'UNKNOWN'
-            reg1 = re.search(r'^\s*status: (.+)\n\s*action+:',
-                             zpool_result, re.S | re.M)
-            if reg1:
-                msg = reg1.group(1)
-                status = re.sub(r'\s+', ' ', msg)
-            # Ignoring the action for now.
-            # Deal with it when we can parse it, interpret it and
-            # come up a gui link to carry out that specific repair.
-            # action = ""
-            # reg2 = re.search(r'^\s*action: ([^:]+)\n\s*\w+:',
-            #                  zpool_result, re.S | re.M)
-            # if reg2:
-            #    msg = reg2.group(1)
-            #    action = re.sub(r'\s+', ' ', msg)
-        return (state, status)
+        return zfs.zpool_status(pool_name)
 
     def get_train(self):
         from freenasUI.system.models import Update
@@ -26,16 +26,49 @@
 from decimal import Decimal
 import bisect
 import logging
+import os
 import re
 import subprocess
+import threading
+import time
 
 from django.utils.datastructures import SortedDict
 from django.utils.translation import ugettext_lazy as _
 
+try:
+    import libzfs
+except ImportError:
+    libzfs = None
+
 log = logging.getLogger('middleware.zfs')
 
 ZPOOL_NAME_RE = r'[a-z][a-z0-9_\-\.]*'
 
+# Backend used to gather the ZFS state, either "libzfs" (in-process
+# bindings) or "subprocess" (parsing zfs/zpool output).
+# libzfs is opt-in, e.g. FREENAS_ZFS_BACKEND=libzfs, until it is shown to
+# give the same results. It is only used if the bindings are available
+# and falls back to subprocess whenever it fails.
+ZFS_BACKENDS = ('libzfs', 'subprocess')
+ZFS_BACKEND = os.environ.get('FREENAS_ZFS_BACKEND', 'subprocess')
+
+# Properties of `zfs list -o space,refer,mountpoint,type,volsize`
+ZFS_LIST_PROPERTIES = (
+    'available',
+    'used',
+    'usedbysnapshots',
+    'usedbydataset',
+    'usedbyrefreservation',
+    'usedbychildren',
+    'referenced',
+    'mountpoint',
+    'type',
+    'volsize',
+)
+
+# PoolStats of the current thread, see set_pool_stats
+_pool_stats = threading.local()
+
 
 def _is_vdev(name):
     """
@@ -59,6 +92,69 @@ def _vdev_type(name):
     return False
 
 
+def set_backend(name):
+    """
+    Select the backend used from now on, either "libzfs" or "subprocess"
+    """
+    global ZFS_BACKEND
+    if name not in ZFS_BACKENDS:
+        raise ValueError("Unknown ZFS backend: %s" % name)
+    ZFS_BACKEND = name
+
+
+def get_backend():
+    """
+    Backend actually in use, libzfs requires the bindings to be installed
+    """
+    if ZFS_BACKEND == 'libzfs' and libzfs is not None:
+        return 'libzfs'
+    return 'subprocess'
+
+
+def _dispatch(libzfs_impl, subprocess_impl, *args, **kwargs):
+    """
+    Call the implementation of the backend in use, falling back to
+    the subprocess one if libzfs fails unexpectedly.
+
+    libzfs implementations handle missing pools and datasets themselves,
+    SystemError is what the subprocess ones raise as well and is not
+    retried.
+    """
+    if get_backend() == 'libzfs':
+        try:
+            return libzfs_impl(*args, **kwargs)
+        except SystemError:
+            raise
+        except Exception:
+            log.warn(
+                "libzfs backend failed in %s, falling back to subprocess",
+                libzfs_impl.__name__,
+                exc_info=True,
+            )
+    return subprocess_impl(*args, **kwargs)
+
+
+def _nicenum(num):
+    """
+    Human readable size as printed by the zfs/zpool commands, e.g. 1.20G
+    """
+    index = 0
+    value = num
+    while value >= 1024 and index < 6:
+        value /= 1024
+        index += 1
+    if index == 0:
+        return '%d' % num
+    unit = ' KMGTPE'[index]
+    if num % (1 << (10 * index)) == 0:
+        return '%d%s' % (value, unit)
+    for precision in (2, 1, 0):
+        rv = '%.*f%s' % (precision, float(num) / (1 << (10 * index)), unit)
+        if len(rv) <= 5:
+            break
+    return rv
+
+
 class Pool(object):
     """
     Class representing a Zpool
@@ -597,10 +693,25 @@ class ZFSVol(object):
 
 class Snapshot(object):
 
+    # Attributes snapshots can be sorted by
+    SORT_FIELDS = (
+        'name',
+        'filesystem',
+        'fullname',
+        'used',
+        'refer',
+        'creation',
+        'mostrecent',
+        'parent_type',
+        'replication',
+        'vmsynced',
+    )
+
     name = None
     filesystem = None
     used = None
     refer = None
+    creation = None
     mostrecent = False
     parent_type = None
     replication = None
@@ -615,12 +726,14 @@ class Snapshot(object):
         mostrecent=False,
         parent_type=None,
         replication=None,
-        vmsynced=False
+        vmsynced=False,
+        creation=None
     ):
         self.name = name
         self.filesystem = filesystem
         self.used = used
         self.refer = refer
+        self.creation = creation
         self.mostrecent = mostrecent
         self.parent_type = parent_type
         self.replication = replication
@@ -634,6 +747,37 @@ class Snapshot(object):
         return "%s@%s" % (self.filesystem, self.name)
 
 
+class DatasetIndex(object):
+    """
+    Prefix trie of dataset names, finds the values added for a dataset
+    and, if added as recursive, for its parents in O(depth)
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, name, value, recursive=False):
+        node = self._root
+        for component in name.split('/'):
+            node = node.setdefault(component, {})
+        # Values are kept under None, never a component
+        node.setdefault(None, []).append((value, recursive))
+
+    def match(self, name):
+        rv = []
+        node = self._root
+        components = name.split('/')
+        for i, component in enumerate(components):
+            node = node.get(component)
+            if node is None:
+                break
+            last = i == len(components) - 1
+            for value, recursive in node.get(None, ()):
+                if last or recursive:
+                    rv.append(value)
+        return rv
+
+
 def parse_status(name, doc, data):
 
     """
@@ -869,12 +1013,285 @@ def parse_status(name, doc, data):
     return pool
 
 
-def zfs_list(path="", recursive=False, hierarchical=False, include_root=False,
-             types=None):
+def _scan_libzfs(scan):
     """
-    Return a dictionary that contains all ZFS dataset list and their
-    mountpoints
+    Build the scrub and resilver statistics of parse_status
+    from the scan statistics of the pool
+    """
+    scrub = {
+        'status': 'NONE',
+        'status_verbose': _('None requested'),
+    }
+    resilver = {
+        'status': 'NONE',
+        'status_verbose': _('None requested'),
+    }
+    if scan.function == libzfs.ScanFunction.SCRUB:
+        stats = scrub
+    elif scan.function == libzfs.ScanFunction.RESILVER:
+        stats = resilver
+    else:
+        return scrub, resilver
+
+    if scan.state == libzfs.ScanState.SCANNING:
+        examined = scan.bytes_scanned
+        total = scan.bytes_to_scan
+        stats.update({
+            'progress': Decimal('%.2f' % scan.percentage),
+            'scanned': _nicenum(examined),
+            'total': _nicenum(total),
+            'togo': None,
+            'status': 'IN_PROGRESS',
+            'status_verbose': _('In Progress'),
+        })
+        if stats is scrub:
+            # Not exposed by libzfs
+            stats['repaired'] = None
+        elapsed = max(time.time() - time.mktime(scan.start_time.timetuple()), 1)
+        rate = examined / elapsed
+        if rate:
+            minutes = int((total - examined) / rate / 60)
+            stats['togo'] = '%dh%dm' % (minutes / 60, minutes % 60)
+    elif scan.state == libzfs.ScanState.FINISHED:
+        stats.update({
+            'errors': str(scan.errors),
+            'date': time.ctime(time.mktime(scan.end_time.timetuple())),
+            'status': 'COMPLETED',
+            'status_verbose': _('Completed'),
+        })
+        if stats is scrub:
+            stats['repaired'] = None
+    elif scan.state == libzfs.ScanState.CANCELED:
+        stats['status'] = 'CANCELED'
+        stats['status_verbose'] = _('Canceled')
+    elif scan.state != libzfs.ScanState.NONE:
+        stats['status'] = 'UNKNOWN'
+        stats['status_verbose'] = _('Unknown')
+    return scrub, resilver
+
+
+def _vdev_errors(vdev):
+    stats = vdev.stats
+    return {
+        'read': stats.read_errors,
+        'write': stats.write_errors,
+        'cksum': stats.checksum_errors,
+    }
+
+
+def _devs_libzfs(vdevs, config, doc, replacing=False):
+    """
+    Devs of the leaves in `vdevs`, children of a device being replaced
+    or of a spare in use are flattened the same way parse_status does
     """
+    for vdev in vdevs:
+        if vdev.type in ('replacing', 'spare'):
+            for dev in _devs_libzfs(vdev.children, config, doc, replacing=True):
+                yield dev
+            continue
+        # zpool shows the guid of missing devices rather than their path
+        if config.get(vdev.guid, {}).get('not_present'):
+            name = str(vdev.guid)
+        else:
+            name = vdev.path
+            if name.startswith('/dev/'):
+                name = name[5:]
+        yield Dev(
+            name,
+            doc,
+            status=vdev.status,
+            replacing=replacing,
+            **_vdev_errors(vdev)
+        )
+
+
+def _zpool_parse_libzfs(name, doc):
+    try:
+        zpool = libzfs.ZFS().get(name)
+    except libzfs.ZFSException:
+        # zpool status does not print anything on stdout either
+        return parse_status(name, doc, '')
+
+    # Vdev ids and raidz parity are only available from the pool config
+    config = {}
+    nvlists = [zpool.config['vdev_tree']]
+    nvlists.extend(zpool.config.get('l2cache', []))
+    nvlists.extend(zpool.config.get('spares', []))
+    while nvlists:
+        nvlist = nvlists.pop()
+        config[nvlist.get('guid')] = nvlist
+        nvlists.extend(nvlist.get('children', []))
+
+    scrub, resilver = _scan_libzfs(zpool.scrub)
+    pool = Pool(pid=None, name=name, scrub=scrub, resilver=resilver)
+    for group, rootname in (
+        ('data', name),
+        ('log', 'logs'),
+        ('cache', 'cache'),
+        ('spare', 'spares'),
+    ):
+        vdevs = zpool.groups.get(group)
+        if not vdevs:
+            continue
+        if group == 'data':
+            root = Root(
+                rootname,
+                doc,
+                status=zpool.status,
+                **_vdev_errors(zpool.root_vdev)
+            )
+        else:
+            root = Root(rootname, doc)
+        pool.add_root(root)
+
+        stripe = None
+        for vdev in vdevs:
+            if vdev.type in ('disk', 'file', 'replacing', 'spare'):
+                # Consecutive devices not part of a vdev share a stripe
+                if stripe is None:
+                    stripe = Vdev(
+                        'stripe',
+                        doc,
+                        status=vdev.status,
+                        **_vdev_errors(vdev)
+                    )
+                    root.append(stripe)
+                for dev in _devs_libzfs([vdev], config, doc):
+                    stripe.append(dev)
+                continue
+
+            stripe = None
+            vconfig = config.get(vdev.guid, {})
+            vname = vdev.type
+            if vname == 'raidz':
+                vname += str(vconfig.get('nparity', 1))
+            if 'id' in vconfig:
+                vname = '%s-%d' % (vname, vconfig['id'])
+            node = Vdev(vname, doc, status=vdev.status, **_vdev_errors(vdev))
+            root.append(node)
+            for dev in _devs_libzfs(vdev.children, config, doc):
+                node.append(dev)
+
+    pool.validate()
+    return pool
+
+
+def _zpool_parse_subprocess(name, doc):
+    zpoolproc = subprocess.Popen(
+        ['/sbin/zpool', 'status', name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    return parse_status(name, doc, zpoolproc.communicate()[0])
+
+
+def zpool_parse(name, doc):
+    """
+    Return the Pool tree of an imported zpool
+    """
+    return _dispatch(_zpool_parse_libzfs, _zpool_parse_subprocess, name, doc)
+
+
+def _zpool_status_libzfs(name):
+    try:
+        zpool = libzfs.ZFS().get(name)
+    except libzfs.ZFSException:
+        return ('UNKNOWN', '')
+    if zpool.status_code == libzfs.PoolStatus.OK:
+        return ('HEALTHY', '')
+    # The explanation of the problem is only printed by zpool
+    return _zpool_status_subprocess(name)
+
+
+def _zpool_status_subprocess(name):
+    status = ''
+    state = ''
+    zpoolproc = subprocess.Popen(
+        ['/sbin/zpool', 'status', '-x', name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    zpool_result = zpoolproc.communicate()[0]
+    if zpool_result.find("pool '%s' is healthy" % name) != -1:
+        state = 'HEALTHY'
+    else:
+        reg1 = re.search(r'^\s*state: (\w+)', zpool_result, re.M)
+        if reg1:
+            state = reg1.group(1)
+        else:
+            # The default case doesn't print out anything helpful,
+            # but instead coredumps ;).
+            state = 'UNKNOWN'
+        reg1 = re.search(r'^\s*status: (.+)\n\s*action+:',
+                         zpool_result, re.S | re.M)
+        if reg1:
+            msg = reg1.group(1)
+            status = re.sub(r'\s+', ' ', msg)
+        # Ignoring the action for now.
+        # Deal with it when we can parse it, interpret it and
+        # come up a gui link to carry out that specific repair.
+        # action = ""
+        # reg2 = re.search(r'^\s*action: ([^:]+)\n\s*\w+:',
+        #                  zpool_result, re.S | re.M)
+        # if reg2:
+        #    msg = reg2.group(1)
+        #    action = re.sub(r'\s+', ' ', msg)
+    return (state, status)
+
+
+def zpool_status(name):
+    """
+    Function to find out the status of the zpool
+    It takes the name of the zpool (as a string) as the
+    argument. It returns with a tuple of (state, status)
+    """
+    return _dispatch(_zpool_status_libzfs, _zpool_status_subprocess, name)
+
+
+def _zfs_datasets_libzfs(zfs, path):
+    """
+    Dataset `path` or the root dataset of every pool, None if `path`
+    does not exist
+    """
+    if not path:
+        return [pool.root_dataset for pool in zfs.pools]
+    try:
+        return [zfs.get_dataset(path)]
+    except libzfs.ZFSException:
+        return None
+
+
+def _zfs_list_libzfs(path, recursive, types):
+    zfs = libzfs.ZFS()
+    datasets = _zfs_datasets_libzfs(zfs, path)
+    if datasets is None:
+        # zfs list does not print anything either
+        return []
+    if not path:
+        recursive = True
+    if not types:
+        types = ('filesystem', 'volume')
+
+    rows = []
+    while datasets:
+        dataset = datasets.pop()
+        properties = dataset.properties
+        data = [dataset.name]
+        for name in ZFS_LIST_PROPERTIES:
+            prop = properties.get(name)
+            if prop is None:
+                data.append('-')
+            elif name in ('mountpoint', 'type'):
+                data.append(prop.value)
+            else:
+                data.append(prop.rawvalue)
+        if data[9] in types:
+            rows.append(data)
+        if recursive:
+            datasets.extend(dataset.children)
+    rows.sort(key=lambda data: data[0])
+    return rows
+
+
+def _zfs_list_subprocess(path, recursive, types):
     args = [
         "/sbin/zfs",
         "list",
@@ -899,12 +1316,20 @@ def zfs_list(path="", recursive=False, hierarchical=False, include_root=False,
         stderr=subprocess.PIPE)
 
     zfs_output, zfs_err = zfsproc.communicate()
-    zfs_output = zfs_output.split('\n')
+    return [line.split('\t') for line in zfs_output.split('\n') if line]
+
+
+def zfs_list(path="", recursive=False, hierarchical=False, include_root=False,
+             types=None):
+    """
+    Return a dictionary that contains all ZFS dataset list and their
+    mountpoints
+    """
+    rows = _dispatch(
+        _zfs_list_libzfs, _zfs_list_subprocess, path, recursive, types
+    )
     zfslist = ZFSList()
-    for line in zfs_output:
-        if not line:
-            continue
-        data = line.split('\t')
+    for data in rows:
         names = data[0].split('/')
         depth = len(names)
         # root filesystem is not treated as dataset by us
@@ -962,11 +1387,131 @@ def list_datasets(path="", recursive=False, hierarchical=False,
     )
 
 
-def zpool_list(name=None):
+def _snapshot_libzfs(snapshot, parent_type):
+    properties = snapshot.properties
+    vmsynced = properties.get('freenas:vmsynced')
+    return {
+        'name': snapshot.name,
+        'used': int(properties['used'].rawvalue),
+        'refer': int(properties['referenced'].rawvalue),
+        'creation': int(properties['creation'].rawvalue),
+        'vmsynced': vmsynced.value if vmsynced is not None else '-',
+        'parent_type': parent_type,
+    }
+
+
+def _snapshot_list_libzfs(path):
+    zfs = libzfs.ZFS()
+    if path and '@' in path:
+        try:
+            dataset = zfs.get_dataset(path.split('@', 1)[0])
+            snapshot = zfs.get_snapshot(path)
+        except libzfs.ZFSException:
+            return []
+        return [_snapshot_libzfs(snapshot, dataset.properties['type'].value)]
+
+    datasets = _zfs_datasets_libzfs(zfs, path)
+    if datasets is None:
+        return []
+
+    rv = []
+    while datasets:
+        dataset = datasets.pop()
+        parent_type = dataset.properties['type'].value
+        for snapshot in dataset.snapshots:
+            rv.append(_snapshot_libzfs(snapshot, parent_type))
+        datasets.extend(dataset.children)
+    rv.sort(key=lambda snapshot: snapshot['name'])
+    rv.sort(key=lambda snapshot: snapshot['creation'], reverse=True)
+    return rv
+
+
+def _snapshot_list_subprocess(path):
+    # Datasets are listed along with the snapshots for their type
+    args = [
+        '/sbin/zfs',
+        'list',
+        '-p',
+        '-H',
+        '-t', 'filesystem,volume,snapshot',
+        '-o', 'name,type,used,referenced,creation,freenas:vmsynced',
+    ]
+    if path and '@' in path:
+        args.extend([path.split('@', 1)[0], path])
+    elif path:
+        args.extend(['-r', path])
+    zfsproc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+
+    types = {}
+    rv = []
+    for line in zfsproc.communicate()[0].split('\n'):
+        if not line:
+            continue
+        data = line.split('\t')
+        if data[1] != 'snapshot':
+            types[data[0]] = data[1]
+            continue
+        rv.append({
+            'name': data[0],
+            'used': int(data[2]),
+            'refer': int(data[3]),
+            'creation': int(data[4]),
+            'vmsynced': data[5],
+        })
+    for snapshot in rv:
+        snapshot['parent_type'] = types.get(snapshot['name'].split('@', 1)[0])
+    rv.sort(key=lambda snapshot: snapshot['name'])
+    rv.sort(key=lambda snapshot: snapshot['creation'], reverse=True)
+    return rv
+
+
+def snapshot_list(path=None):
+    """
+    Return the snapshots of `path` and its children (every pool if not
+    given) or the snapshot `path`, most recent first, in a single pass.
+    Snapshots are dicts of name, used, refer, creation, vmsynced and
+    parent_type (filesystem or volume)
+    """
+    return _dispatch(
+        _snapshot_list_libzfs, _snapshot_list_subprocess, path
+    )
+
+
+def _zpool_list_libzfs(name):
+    zfs = libzfs.ZFS()
+    if name:
+        try:
+            pools = [zfs.get(name)]
+        except libzfs.ZFSException:
+            raise SystemError('zpool list failed')
+    else:
+        pools = zfs.pools
+    rv = {}
+    for pool in pools:
+        properties = pool.properties
+        data = [
+            properties[prop].rawvalue
+            for prop in ('size', 'allocated', 'free', 'capacity')
+        ]
+        rv[pool.name] = {
+            'name': pool.name,
+            'size': int(data[0]) if data[0].isdigit() else None,
+            'alloc': int(data[1]) if data[1].isdigit() else None,
+            'free': int(data[2]) if data[2].isdigit() else None,
+            'capacity': int(data[3]) if data[3].isdigit() else None,
+            'health': properties['health'].value,
+        }
+    return rv
+
+
+def _zpool_list_subprocess(name):
     zfsproc = subprocess.Popen([
         'zpool',
         'list',
-        '-o', 'name,size,alloc,free,cap',
+        '-o', 'name,size,alloc,free,cap,health',
         '-p',
         '-H',
     ] + ([name] if name else []), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -977,6 +1522,9 @@ def zpool_list(name=None):
 
     rv = {}
     for line in output.split('\n'):
+        # Nothing is printed if there is no pool
+        if not line:
+            continue
         data = line.split('\t')
         attrs = {
             'name': data[0],
@@ -984,9 +1532,67 @@ def zpool_list(name=None):
             'alloc': int(data[2]) if data[2].isdigit() else None,
             'free': int(data[3]) if data[3].isdigit() else None,
             'capacity': int(data[4]) if data[4].isdigit() else None,
+            'health': data[5],
         }
         rv[attrs['name']] = attrs
+    return rv
 
+
+def zpool_list(name=None):
+    rv = _dispatch(_zpool_list_libzfs, _zpool_list_subprocess, name)
     if name:
         return rv[name]
     return rv
+
+
+class PoolStats(object):
+    """
+    Size, alloc, free, capacity and health of every imported pool,
+    gathered by a single zpool_list the first time they are needed.
+
+    Once made the current one of the thread, e.g. for the duration of a
+    request or within a with block, it is shared by every pool_stats call
+    """
+
+    def __init__(self):
+        self.pools = None
+        self._previous = None
+
+    def get(self, name=None):
+        if self.pools is None:
+            try:
+                self.pools = zpool_list()
+            except SystemError:
+                log.warn("Failed to list pools", exc_info=True)
+                self.pools = {}
+        if name:
+            return self.pools.get(name)
+        return self.pools
+
+    def __enter__(self):
+        self._previous = getattr(_pool_stats, 'current', None)
+        set_pool_stats(self)
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        set_pool_stats(self._previous)
+        self._previous = None
+
+
+def set_pool_stats(stats):
+    """
+    Make `stats` the PoolStats of the current thread, None to stop sharing
+    """
+    _pool_stats.current = stats
+
+
+def pool_stats(name=None):
+    """
+    Return the stats of pool `name` as in zpool_list, None if it is not
+    imported, or of every pool. Pools are listed every time unless a
+    PoolStats is current.
+    """
+    stats = getattr(_pool_stats, 'current', None)
+    if stats is None:
+        stats = PoolStats()
+    return stats.get(name)
@@ -147,6 +147,7 @@ MIDDLEWARE_CLASSES = (
     'freenasUI.freeadmin.middleware.CatchError',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'freenasUI.freeadmin.middleware.RequireLoginMiddleware',
+    'freenasUI.freeadmin.middleware.PoolStatsMiddleware',
 )
 
 DOJANGO_DOJO_PROFILE = 'local_release'
@@ -1281,7 +1281,8 @@ class ZFSDataset(Form):
             del self.fields['dataset_name']
             del self.fields['dataset_recordsize']
             del self.fields['dataset_case_sensitivity']
-            data = _n.zfs_get_options(self._fs)
+            # Properties of the dataset itself when editing
+            data = parentdata
 
             if data['compression'][2] == 'inherit':
                 self.fields['dataset_compression'].initial = 'inherit'
@@ -1444,7 +1445,8 @@ class ZVol_EditForm(CommonZVol, Form):
         _n = notifier()
         if '/' in self.name:
             parentds = self.name.rsplit('/', 1)[0]
-            parentdata = _n.zfs_get_options(parentds)
+            zdata = _n.zfs_get_options_many([parentds, self.name])
+            parentdata = zdata[parentds]
 
             self.fields['zvol_compression'].choices = _inherit_choices(
                 choices.ZFS_CompressionChoices,
@@ -1455,7 +1457,9 @@ class ZVol_EditForm(CommonZVol, Form):
                 parentdata['dedup'][0]
             )
 
-        self.zdata = _n.zfs_get_options(self.name)
+            self.zdata = zdata[self.name]
+        else:
+            self.zdata = _n.zfs_get_options(self.name)
         self.fields['zvol_compression'].initial = self.zdata['compression'][2]
         self.fields['zvol_volsize'].initial = self.zdata['volsize'][0]
 
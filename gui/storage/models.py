@@ -174,9 +174,10 @@ class Volume(Model):
         return "%s/%s.key" % (GELI_KEYPATH, self.vol_encryptkey, )
 
     def is_decrypted(self):
-        __is_decrypted = getattr(self, '__is_decrypted', None)
-        if __is_decrypted is not None:
-            return __is_decrypted
+        try:
+            return self.__is_decrypted
+        except AttributeError:
+            pass
 
         self.__is_decrypted = True
         # If the status is not UNKNOWN means the pool is already imported
@@ -448,18 +449,20 @@ class Volume(Model):
         return "%s (%s)" % (self.vol_name, self.vol_fstype)
 
     def _get__zplist(self):
-        if not hasattr(self, '__zplist'):
-            try:
-                self.__zplist = zfs.zpool_list().get(self.vol_name)
-            except SystemError:
-                self.__zplist = None
+        # hasattr() would need the mangled name, __zplist never matches
+        try:
+            return self.__zplist
+        except AttributeError:
+            self.__zplist = zfs.pool_stats(self.vol_name)
         return self.__zplist
 
     def _set__zplist(self, value):
         self.__zplist = value
 
     def _get__vfs(self):
-        if not hasattr(self, '__vfs'):
+        try:
+            return self.__vfs
+        except AttributeError:
             try:
                 self.__vfs = os.statvfs(self.vol_path)
             except:
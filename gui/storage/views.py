@@ -492,9 +492,7 @@ def dataset_edit(request, dataset_name):
             if dataset_form.cleaned_data["dataset_refquota"] == "0":
                 dataset_form.cleaned_data["dataset_refquota"] = "none"
 
-            error = False
-            errors = {}
-
+            props = {}
             for attr in (
                 'compression',
                 'atime',
@@ -503,29 +501,22 @@ def dataset_edit(request, dataset_name):
                 'refreservation',
                 'quota',
                 'refquota',
-                'share_type'
             ):
-                formfield = 'dataset_%s' % attr
-                val = dataset_form.cleaned_data[formfield]
+                props[attr] = dataset_form.cleaned_data['dataset_%s' % attr]
 
-                if val == "inherit":
-                    success, err = notifier().zfs_inherit_option(
-                        dataset_name,
-                        attr)
-                else:
-                    if attr == "share_type":
-                        notifier().change_dataset_share_type(
-                            dataset_name, val)
-                    else:
-                        success, err = notifier().zfs_set_option(
-                            dataset_name,
-                            attr,
-                            val)
-                error |= not success
-                if not success:
-                    errors[formfield] = err
-
-            if not error:
+            _n = notifier()
+            share_type = dataset_form.cleaned_data['dataset_share_type']
+            if share_type == "inherit":
+                props['share_type'] = share_type
+            else:
+                _n.change_dataset_share_type(dataset_name, share_type)
+
+            success, errs = _n.zfs_set_options(dataset_name, props)
+            errors = dict(
+                ('dataset_%s' % attr, err) for attr, err in errs.items()
+            )
+
+            if success:
                 return JsonResp(
                     request,
                     message=_("Dataset successfully edited."))
@@ -613,27 +604,19 @@ def zvol_edit(request, name):
         if form.is_valid():
 
             _n = notifier()
-            error, errors = False, {}
+            props = {}
             for attr in (
                 'compression',
                 'dedup',
                 'volsize',
             ):
-                formfield = 'zvol_%s' % attr
-                if form.cleaned_data[formfield] == "inherit":
-                    success, err = _n.zfs_inherit_option(
-                        name,
-                        attr)
-                else:
-                    success, err = _n.zfs_set_option(
-                        name,
-                        attr,
-                        form.cleaned_data[formfield])
-                if not success:
-                    error = True
-                    errors[formfield] = err
-
-            if not error:
+                props[attr] = form.cleaned_data['zvol_%s' % attr]
+            success, errs = _n.zfs_set_options(name, props)
+            errors = dict(
+                ('zvol_%s' % attr, err) for attr, err in errs.items()
+            )
+
+            if success:
                 extents = iSCSITargetExtent.objects.filter(
                     iscsi_target_extent_type='ZVOL',
                     iscsi_target_extent_path='zvol/' + name)
@@ -2,6 +2,7 @@ from django.utils.translation import ugettext as _
 from freenasUI.freeadmin.hook import HookMetaclass
 from freenasUI.storage.models import Volume
 from freenasUI.system.alert import alertPlugins, Alert, BaseAlert
+from freenasUI.middleware import zfs
 from freenasUI.middleware.notifier import notifier
 
 
@@ -27,16 +28,17 @@ class VolumeStatusAlert(BaseAlert):
         if not self.volumes_status_enabled():
             return
         alerts = []
-        for vol in Volume.objects.filter(vol_fstype='ZFS'):
-            if not vol.is_decrypted():
-                continue
-            state, status = notifier().zpool_status(vol.vol_name)
-            if state == 'HEALTHY':
-                pass
-            else:
-                alerts.append(
-                    self.on_volume_status_not_healthy(vol, state, status)
-                )
+        with zfs.PoolStats():
+            for vol in Volume.objects.filter(vol_fstype='ZFS'):
+                if not vol.is_decrypted():
+                    continue
+                state, status = notifier().zpool_status(vol.vol_name)
+                if state == 'HEALTHY':
+                    pass
+                else:
+                    alerts.append(
+                        self.on_volume_status_not_healthy(vol, state, status)
+                    )
         return alerts
 
 alertPlugins.register(VolumeStatusAlert)
@@ -0,0 +1,174 @@
+#!/usr/local/bin/python
+# Copyright (c) 2016 iXsystems, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+"""
+Compare the libzfs and subprocess backends of freenasUI.middleware.zfs.
+
+A file backed pool with a synthetic tree of datasets, zvols and snapshots
+is created to run the benchmark against:
+
+    zfs_benchmark.py create -d 2000 -s 10
+    zfs_benchmark.py run -n 5
+    zfs_benchmark.py destroy
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.extend([
+    '/usr/local/www',
+    '/usr/local/www/freenasUI'
+])
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'freenasUI.settings')
+
+# Make sure to load all modules
+from django.db.models.loading import cache
+cache.get_apps()
+
+from freenasUI.middleware import zfs
+from freenasUI.middleware.notifier import notifier
+
+POOL = 'zfsbench'
+IMAGE = '/var/tmp/zfsbench.img'
+
+
+def run_cmd(*args):
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err = proc.communicate()[1]
+    if proc.returncode != 0:
+        raise SystemError('%s failed: %s' % (' '.join(args), err))
+
+
+def create(args):
+    with open(IMAGE, 'w') as f:
+        f.truncate(args.size * 1024 ** 3)
+    run_cmd('/sbin/zpool', 'create', '-m', '/mnt/%s' % POOL, POOL, IMAGE)
+
+    # Breadth first so every level has `fanout` children
+    parents = [POOL]
+    created = 0
+    while created < args.datasets:
+        children = []
+        for parent in parents:
+            for i in range(args.fanout):
+                if created == args.datasets:
+                    break
+                name = '%s/ds%d' % (parent, created)
+                run_cmd('/sbin/zfs', 'create', name)
+                children.append(name)
+                created += 1
+        parents = children
+    for i in range(args.zvols):
+        run_cmd('/sbin/zfs', 'create', '-s', '-V', '1G', '%s/zvol%d' % (POOL, i))
+    for i in range(args.snapshots):
+        run_cmd('/sbin/zfs', 'snapshot', '-r', '%s@snap%d' % (POOL, i))
+    print "Created %d datasets, %d zvols and %d snapshots of each in %s" % (
+        args.datasets, args.zvols, args.snapshots, POOL,
+    )
+
+
+def destroy(args):
+    run_cmd('/sbin/zpool', 'destroy', POOL)
+    os.unlink(IMAGE)
+
+
+def calls():
+    """
+    Backend implementations are called directly, the public functions
+    would silently fall back to subprocess if libzfs fails.
+    """
+    doc = notifier()._geom_confxml()
+    return (
+        ('zfs_list', zfs._zfs_list_libzfs, zfs._zfs_list_subprocess,
+         (POOL, True, None), sorted),
+        ('snapshot_list', zfs._snapshot_list_libzfs, zfs._snapshot_list_subprocess,
+         (POOL, ), lambda rv: [i['name'] for i in rv]),
+        ('zpool_list', zfs._zpool_list_libzfs, zfs._zpool_list_subprocess,
+         (POOL, ), lambda rv: sorted(rv.items())),
+        ('zpool_status', zfs._zpool_status_libzfs, zfs._zpool_status_subprocess,
+         (POOL, ), None),
+        ('zpool_parse', zfs._zpool_parse_libzfs, zfs._zpool_parse_subprocess,
+         (POOL, doc), lambda rv: rv.dump()),
+    )
+
+
+def run(args):
+    if zfs.libzfs is None:
+        print >> sys.stderr, "libzfs bindings are not available"
+        sys.exit(1)
+
+    print '%-24s %14s %14s %8s' % ('call', 'libzfs (ms)', 'subprocess (ms)', 'speedup')
+    for name, libzfs_impl, subprocess_impl, call_args, normalize in calls():
+        results = []
+        for impl in (libzfs_impl, subprocess_impl):
+            rv = impl(*call_args)
+            timings = []
+            for i in range(args.repeat):
+                start = time.time()
+                impl(*call_args)
+                timings.append(time.time() - start)
+            results.append((min(timings), normalize(rv) if normalize else rv))
+
+        (libzfs_time, libzfs_rv), (subprocess_time, subprocess_rv) = results
+        print '%-24s %14.2f %14.2f %7.1fx%s' % (
+            name,
+            libzfs_time * 1000,
+            subprocess_time * 1000,
+            subprocess_time / libzfs_time if libzfs_time else 0,
+            '' if libzfs_rv == subprocess_rv else '  (results differ)',
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='name')
+
+    iparser = subparsers.add_parser('create', help='Create the synthetic pool')
+    iparser.add_argument('-d', '--datasets', type=int, default=1000)
+    iparser.add_argument('-f', '--fanout', type=int, default=10, help='Children per dataset')
+    iparser.add_argument('-v', '--zvols', type=int, default=10)
+    iparser.add_argument('-s', '--snapshots', type=int, default=5, help='Snapshots per dataset')
+    iparser.add_argument('--size', type=int, default=64, help='Size of the pool in GiB')
+
+    iparser = subparsers.add_parser('run', help='Run the benchmark')
+    iparser.add_argument('-n', '--repeat', type=int, default=5)
+
+    subparsers.add_parser('destroy', help='Destroy the synthetic pool')
+
+    args = parser.parse_args()
+    if args.name == 'create':
+        create(args)
+    elif args.name == 'run':
+        run(args)
+    elif args.name == 'destroy':
+        destroy(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 
@@ -11,7 +11,7 @@ def main():
     map_acls_mode = False
     afp_config = "/usr/local/etc/afp.conf"
     cf_contents = []
-    client = Client()
+    client = get_client()
 
     afp = Struct(client.call('datastore.query', 'services.afp', None, {'get': True}))
 
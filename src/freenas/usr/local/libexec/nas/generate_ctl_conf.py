@@ -1,5 +1,6 @@
 #!/usr/local/bin/python2
-from middlewared.client import Client
+from collections import defaultdict
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 import os
 
@@ -37,6 +38,15 @@ def addline(line, plaintextonly=False, shadowonly=False):
         cf_contents_shadow.append(line)
 
 
+def group_by_target(rows, field):
+    # Rows of a table queried once for all targets, keyed by target id
+    groups = defaultdict(list)
+    for row in rows:
+        if row[field] is not None:
+            groups[row[field]['id']].append(Struct(row))
+    return groups
+
+
 def auth_group_config(auth_tag=None, auth_list=None, auth_type=None, initiator=None):
     # First prepare all the lists, filtering out garpage.
     if auth_list is None:
@@ -102,7 +112,7 @@ def main():
     config file as a series of lines, and once that is done write it
     out in one go"""
 
-    client = Client()
+    client = get_client()
 
     gconf = Struct(client.call('datastore.query', 'services.iSCSITargetGlobalConfiguration', None, {'get': True}))
 
@@ -112,14 +122,20 @@ def main():
 
     # Generate the portal-group section
     addline('portal-group default {\n}\n\n')
-    for portal in client.call('datastore.query', 'services.iSCSITargetPortal'):
-        portal = Struct(portal)
+    portals = [Struct(i) for i in client.call('datastore.query', 'services.iSCSITargetPortal')]
+    # Fetch listen addresses of every portal, and auth credentials of the
+    # ones using a discovery auth group, in a single round-trip
+    portal_calls = []
+    for portal in portals:
+        portal_calls.append(('datastore.query', ('services.iSCSITargetPortalIP', [('iscsi_target_portalip_portal', '=', portal.id)])))
+        if portal.iscsi_target_portal_discoveryauthgroup:
+            portal_calls.append(('datastore.query', ('services.iSCSITargetAuthCredential', [('iscsi_target_auth_tag', '=', portal.iscsi_target_portal_discoveryauthgroup)])))
+    portal_results = iter(client.batch(portal_calls) if portal_calls else [])
+    for portal in portals:
+        portal_ips = next(portal_results)
         # Prepare auth group for the portal group
         if portal.iscsi_target_portal_discoveryauthgroup:
-            auth_list = [
-                Struct(i)
-                for i in client.call('datastore.query', 'services.iSCSITargetAuthCredential', [('iscsi_target_auth_tag', '=', portal.iscsi_target_portal_discoveryauthgroup)])
-            ]
+            auth_list = [Struct(i) for i in next(portal_results)]
         else:
             auth_list = []
         agname = '4pg%d' % portal.iscsi_target_portal_tag
@@ -133,10 +149,7 @@ def main():
             addline("\tdiscovery-auth-group ag%s\n" % agname)
         else:
             addline("\tdiscovery-auth-group no-authentication\n")
-        listen = [
-            Struct(i)
-            for i in client.call('datastore.query', 'services.iSCSITargetPortalIP', [('iscsi_target_portalip_portal', '=', portal.id)])
-        ]
+        listen = [Struct(i) for i in portal_ips]
         for obj in listen:
             if ':' in obj.iscsi_target_portalip_ip:
                 address = '[%s]' % obj.iscsi_target_portalip_ip
@@ -148,23 +161,39 @@ def main():
 
     # Cache zpool threshold
     poolthreshold = {}
-    zpoollist = client.call('notifier.zpool_list')
+    zpoollist = client.call('zfs.pool_list')
+
+    extents = [Struct(i) for i in client.call('datastore.query', 'services.iSCSITargetExtent')]
+    # Disks backing extents and their device names, fetched once for all
+    disks = {}
+    if any(extent.iscsi_target_extent_type == 'Disk' for extent in extents):
+        for disk in client.call('datastore.query', 'storage.Disk', None, {'order_by': ['disk_enabled']}):
+            disks.setdefault(disk['disk_identifier'], Struct(disk))
+    identifiers = set()
+    for extent in extents:
+        disk = disks.get(extent.iscsi_target_extent_path)
+        if extent.iscsi_target_extent_type == 'Disk' and disk and not disk.disk_multipath_name:
+            identifiers.add(disk.disk_identifier)
+    devices = dict(zip(identifiers, client.batch([
+        ('notifier.identifier_to_device', (identifier, )) for identifier in identifiers
+    ]))) if identifiers else {}
+    # zvols, listed at once on first use
+    zvols = None
+    is_freenas = client.call('notifier.is_freenas')
 
     # Generate the LUN section
-    for extent in client.call('datastore.query', 'services.iSCSITargetExtent'):
-        extent = Struct(extent)
+    for extent in extents:
         path = extent.iscsi_target_extent_path
         poolname = None
         lunthreshold = None
         if extent.iscsi_target_extent_type == 'Disk':
-            disk = client.call('datastore.query', 'storage.Disk', [('disk_identifier', '=', path)], {'order_by': ['disk_enabled']})
-            if not disk:
+            disk = disks.get(path)
+            if disk is None:
                 continue
-            disk = Struct(disk[0])
             if disk.disk_multipath_name:
                 path = "/dev/multipath/%s" % disk.disk_multipath_name
             else:
-                path = "/dev/%s" % client.call('notifier.identifier_to_device', disk.disk_identifier)
+                path = "/dev/%s" % devices[disk.disk_identifier]
         else:
             if not path.startswith("/mnt"):
                 poolname = path.split('/', 2)[1]
@@ -177,9 +206,14 @@ def main():
                         )
                 if extent.iscsi_target_extent_avail_threshold:
                     zvolname = path.split('/', 1)[1]
-                    zfslist = client.call('notifier.zfs_list', [zvolname, False, False, False, ['volume']])
-                    if zfslist:
-                        lunthreshold = int(zfslist[zvolname]['volsize'] *
+                    if zvols is None:
+                        zvols = client.call('zfs.volume_list')
+                    if zvolname not in zvols:
+                        # Cached before the zvol was created, e.g. by the GUI
+                        client.call('zfs.invalidate', zvolname)
+                        zvols = client.call('zfs.volume_list')
+                    if zvolname in zvols:
+                        lunthreshold = int(zvols[zvolname]['volsize'] *
                                            (extent.iscsi_target_extent_avail_threshold / 100.0))
                 path = "/dev/" + path
             else:
@@ -213,7 +247,7 @@ def main():
         if extent.iscsi_target_extent_legacy is True:
             addline('\toption vendor "FreeBSD"\n')
         else:
-            if client.call('notifier.is_freenas'):
+            if is_freenas:
                 addline('\toption vendor "FreeNAS"\n')
             else:
                 addline('\toption vendor "TrueNAS"\n')
@@ -240,17 +274,28 @@ def main():
 
     # Generate the target section
     target_basename = gconf.iscsi_basename
-    for target in client.call('datastore.query', 'services.iSCSITarget'):
+    # Groups, credentials, ports and LUNs of all targets in a single
+    # round-trip, grouped by target instead of queried for each of them
+    targets, targetgroups, credentials, fcports, targetextents = client.batch([
+        ('datastore.query', ('services.iSCSITarget', )),
+        ('datastore.query', ('services.iscsitargetgroups', )),
+        ('datastore.query', ('services.iSCSITargetAuthCredential', )),
+        ('datastore.query', ('services.fibrechanneltotarget', )),
+        ('datastore.query', ('services.iscsitargettoextent', None, {'extra': {'select': {'null_first': 'iscsi_lunid IS NULL'}}, 'order_by': ['null_first', 'iscsi_lunid']})),
+    ])
+    targetgroups = group_by_target(targetgroups, 'iscsi_target')
+    fcports = group_by_target(fcports, 'fc_target')
+    targetextents = group_by_target(targetextents, 'iscsi_target')
+    auth_lists = defaultdict(list)
+    for cred in credentials:
+        auth_lists[cred['iscsi_target_auth_tag']].append(Struct(cred))
+    for target in targets:
         target = Struct(target)
 
         authgroups = {}
-        for grp in client.call('datastore.query', 'services.iscsitargetgroups', [('iscsi_target', '=', target.id)]):
-            grp = Struct(grp)
+        for grp in targetgroups[target.id]:
             if grp.iscsi_target_authgroup:
-                auth_list = [
-                    Struct(i)
-                    for i in client.call('datastore.query', 'services.iSCSITargetAuthCredential', [('iscsi_target_auth_tag', '=', grp.iscsi_target_authgroup)])
-                ]
+                auth_list = auth_lists[grp.iscsi_target_authgroup]
             else:
                 auth_list = []
             agname = '4tg%d_%d' % (target.id, grp.id)
@@ -270,12 +315,10 @@ def main():
         elif target.iscsi_target_name:
             addline("\talias \"%s\"\n" % target.iscsi_target_name)
 
-        for fctt in client.call('datastore.query', 'services.fibrechanneltotarget', [('fc_target', '=', target.id)]):
-            fctt = Struct(fctt)
+        for fctt in fcports[target.id]:
             addline("\tport %s\n" % fctt.fc_port)
 
-        for grp in client.call('datastore.query', 'services.iscsitargetgroups', [('iscsi_target', '=', target.id)]):
-            grp = Struct(grp)
+        for grp in targetgroups[target.id]:
             agname = authgroups.get(grp.id) or None
             addline("\tportal-group pg%d %s\n" % (
                 grp.iscsi_target_portalgroup.iscsi_target_portal_tag,
@@ -283,13 +326,11 @@ def main():
             ))
         addline("\n")
         used_lunids = [
-            o['iscsi_lunid']
-            for o in client.call('datastore.query', 'services.iscsitargettoextent', [('iscsi_target', '=', target.id), ('iscsi_lunid', '!=', None)])
+            t2e.iscsi_lunid
+            for t2e in targetextents[target.id] if t2e.iscsi_lunid is not None
         ]
         cur_lunid = 0
-        for t2e in client.call('datastore.query', 'services.iscsitargettoextent', [('iscsi_target', '=', target.id)], {'extra': {'select': {'null_first': 'iscsi_lunid IS NULL'}}, 'order_by': ['null_first', 'iscsi_lunid']}):
-            t2e = Struct(t2e)
-
+        for t2e in targetextents[target.id]:
             if t2e.iscsi_lunid is None:
                 while cur_lunid in used_lunids:
                     cur_lunid += 1
@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import re
@@ -440,7 +440,7 @@ def get_kerberos_servers(kr, ad=None, ldap=None):
     return krb_kdc, krb_admin_server, krb_kpasswd_server
 
 def main():
-    client = Client()
+    client = get_client()
     realms = client.call('datastore.query', 'directoryservice.KerberosRealm')
 
     try:
@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import os
@@ -78,7 +78,7 @@ def ldap_conf_activedirectory(client, ldap_conf):
 
 
 def main():
-    client = Client()
+    client = get_client()
     ldap_conf = "/usr/local/etc/openldap/ldap.conf"
 
     if client.call('notifier.common', 'system', 'ldap_enabled'):
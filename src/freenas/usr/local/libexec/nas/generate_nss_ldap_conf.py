@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import os
@@ -43,7 +43,7 @@ def ldap_conf_ldap(client, ldap_conf):
 
 
 def main():
-    client = Client()
+    client = get_client()
     ldap_conf = "/usr/local/etc/nss_ldap.conf"
 
     if client.call('notifier.common', 'system', 'ldap_enabled'):
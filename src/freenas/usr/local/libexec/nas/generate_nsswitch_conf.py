@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 
 import os
 import string
@@ -26,7 +26,7 @@ def main():
     if len(sys.argv) > 1:
         verb = sys.argv[1].lower()
 
-    client = Client()
+    client = get_client()
     activedirectory_enabled = client.call('notifier.common', 'system', 'activedirectory_enabled')
     domaincontroller_enabled = client.call('notifier.common', 'system', 'domaincontroller_enabled')
     ldap_enabled = client.call('notifier.common', 'system', 'ldap_enabled')
@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import os
@@ -11,7 +11,7 @@ RESOLV_CONF_PATH = "/etc/resolv.conf"
 
 def main():
 
-    client = Client()
+    client = get_client()
     domain = None
     nameservers = []
 
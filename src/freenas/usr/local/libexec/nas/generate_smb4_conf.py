@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import os
@@ -1556,7 +1556,7 @@ def restore_secrets_database():
 
 
 def main():
-    client = Client()
+    client = get_client()
     smb_conf_path = "/usr/local/etc/smb4.conf"
 
     smb4_tdb = []
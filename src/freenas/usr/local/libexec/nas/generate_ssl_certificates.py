@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 
 import os
 
@@ -25,7 +25,7 @@ def write_certificates(certs):
 
 
 def main():
-    client = Client()
+    client = get_client()
 
     certs = client.call('certificate.query')
     write_certificates(certs)
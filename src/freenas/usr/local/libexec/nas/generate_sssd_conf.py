@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import os
@@ -862,7 +862,7 @@ def get_directoryservice_cookie(client):
 
 
 def main():
-    client = Client()
+    client = get_client()
     sssd_conf = None
 
     if client.call('notifier.common', 'system', 'ldap_enabled') and client.call('notifier.common', 'system', 'ldap_anonymous_bind'):
@@ -1,5 +1,5 @@
 #!/usr/local/bin/python
-from middlewared.client import Client
+from middlewared.client import get_client
 from middlewared.client.utils import Struct
 
 import os
@@ -67,7 +67,7 @@ def dav_passwd_change(passwd, auth_type):
 
 def main():
     """Use middleware client to generate a config file."""
-    client = Client()
+    client = get_client()
     # Obtain the various webdav configuration details from services object
     webby = Struct(client.call('datastore.query', 'services.WebDAV', None, {'get': True}))
     dav_tcpport = webby.webdav_tcpport
@@ -3,11 +3,14 @@ import markdown
 from markdown.extensions.codehilite import CodeHiliteExtension
 
 from .proxy import ReverseProxied
-from flask import Flask, render_template
+from flask import Flask, make_response, render_template, request
 
 app = Flask(__name__)
 app.wsgi_app = ReverseProxied(app.wsgi_app)
 
+# Rendered page along with the methods metadata tag it was rendered for
+_rendered = {'etag': None, 'page': None}
+
 
 @app.template_filter()
 def json_filter(value):
@@ -25,15 +28,22 @@ app.jinja_env.filters['markdown'] = markdown_filter
 
 @app.route('/')
 def main():
-    services = []
-    for name in app.middleware.call('core.get_services'):
-        services.append({
-           'name': name,
-           'methods': app.middleware.call('core.get_methods', name)
+    etag = app.middleware.call('core.get_methods_etag')
+    if _rendered['etag'] != etag:
+        services = []
+        for name in app.middleware.call('core.get_services'):
+            services.append({
+               'name': name,
+               'methods': app.middleware.call('core.get_methods', name)
+            })
+
+        protocol = render_template('websocket/protocol.md')
+        _rendered['page'] = render_template('websocket.html', **{
+            'services': services,
+            'protocol': protocol,
         })
+        _rendered['etag'] = etag
 
-    protocol = render_template('websocket/protocol.md')
-    return render_template('websocket.html', **{
-        'services': services,
-        'protocol': protocol,
-    })
+    response = make_response(_rendered['page'])
+    response.set_etag(etag)
+    return response.make_conditional(request)
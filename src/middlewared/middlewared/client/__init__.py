@@ -1 +1 @@
-from .client import Client, ClientException
+from .client import Client, ClientException, ClientPool, get_client  # noqa: F401
@@ -1,12 +1,15 @@
-from protocol import DDPProtocol
-from threading import Event
+from protocol import DDPProtocol, ENCODINGS, encode
+from threading import Event, Lock, RLock
 from ws4py.client.threadedclient import WebSocketClient
 
 import argparse
 import json
+import os
 import sys
 import uuid
 
+UNIX_SOCKET_PATH = '/var/run/middlewared.sock'
+
 
 class WSClient(WebSocketClient):
     def __init__(self, *args, **kwargs):
@@ -27,28 +30,34 @@ class WSClient(WebSocketClient):
         self.protocol.on_close(code, reason)
 
     def received_message(self, message):
-        self.protocol.on_message(message.data.decode('utf8'))
+        if message.is_binary:
+            self.protocol.on_message(message.data)
+        else:
+            self.protocol.on_message(message.data.decode('utf8'))
 
     def on_open(self):
-        self.client.on_open()
+        self.client.on_open(self)
 
     def on_message(self, message):
         self.client._recv(message)
 
     def on_close(self, code, reason=None):
-        self.client.on_close(code, reason)
+        self.client.on_close(self, code, reason)
 
 
 class Call(object):
 
-    def __init__(self, method, params):
+    def __init__(self, method, params, callback=None):
         self.id = str(uuid.uuid4())
         self.method = method
         self.params = params
+        self.callback = callback
+        self.chunks = None
         self.returned = Event()
         self.result = None
         self.error = None
         self.stacktrace = None
+        self.done_callbacks = []
 
 
 class ClientException(Exception):
@@ -60,18 +69,76 @@ class ClientException(Exception):
         return self.error
 
 
-class Client(object):
+class Future(object):
+    """
+    Pending result of a call made with `Client.call_async`, with the
+    interface of concurrent.futures.Future.
+    """
+
+    def __init__(self, client, call):
+        self._client = client
+        self._call = call
+
+    def done(self):
+        return self._call.returned.is_set()
+
+    def result(self, timeout=None):
+        if not self._call.returned.wait(timeout):
+            raise ClientException('Call timeout')
+        if self._call.error:
+            raise ClientException(self._call.error, self._call.stacktrace)
+        return self._call.result
+
+    def exception(self, timeout=None):
+        try:
+            self.result(timeout)
+        except ClientException as e:
+            return e
 
-    def __init__(self, uri=None):
+    def add_done_callback(self, fn):
+        """`fn(future)` is called from the client thread once the call returns."""
+        with self._client._lock:
+            if not self.done():
+                self._call.done_callbacks.append(lambda: fn(self))
+                return
+        fn(self)
+
+
+class Client(object):
+    """
+    Connection to middlewared, safe to be shared by many threads: calls
+    are multiplexed over the same connection and may be in flight
+    concurrently.
+
+    A ping is sent every `keepalive` seconds and, if `reconnect` is set,
+    the next call after the connection drops reconnects, logging in again
+    and renewing the subscriptions. Calls in flight when the connection
+    drops fail.
+    """
+
+    def __init__(self, uri=None, keepalive=30, reconnect=True, handshake_timeout=5):
         self._calls = {}
+        self._subscriptions = {}
+        # auth.login/auth.token call to repeat when reconnecting
+        self._login = None
+        self._lock = Lock()
+        # Reentrant as reconnecting logs in again while holding it
+        self._send_lock = RLock()
+        self._closed = False
+        self._pooled = False
         if uri is None:
-            uri = 'ws://127.0.0.1:6000/websocket'
-        self._ws = WSClient(uri, client=self)
-        self._ws.connect()
-        self._connected = Event()
-        self._connected.wait(5)
-        if not self._connected.is_set():
-            raise ClientException('Failed connection handshake')
+            # Prefer the unix socket, authentication is then done using
+            # the peer credentials which is much cheaper than over TCP.
+            if os.path.exists(UNIX_SOCKET_PATH):
+                uri = 'ws+unix://{0}'.format(UNIX_SOCKET_PATH)
+            else:
+                uri = 'ws://127.0.0.1:6000/websocket'
+        self._uri = uri
+        self._keepalive = keepalive
+        self._reconnect = reconnect
+        self._handshake_timeout = handshake_timeout
+        self._ws = None
+        self._connect()
 
     def __enter__(self):
         return self
@@ -81,69 +148,264 @@ class Client(object):
         if typ is not None:
             raise
 
+    def _connect(self):
+        self._connected = Event()
+        # on_close resets self._ws if the server drops the handshake
+        ws = self._ws = WSClient(self._uri, client=self, heartbeat_freq=self._keepalive)
+        try:
+            ws.connect()
+            self._connected.wait(self._handshake_timeout)
+            if not self._connected.is_set():
+                ws.close()
+                raise ClientException('Failed connection handshake')
+        except Exception:
+            self._ws = None
+            raise
+
+    def _reconnect_session(self):
+        self._connect()
+        if self._login is not None:
+            self.call(*self._login)
+        for _id, (name, callback) in list(self._subscriptions.items()):
+            self._write({
+                'msg': 'sub',
+                'id': _id,
+                'name': name,
+            })
+
+    def _write(self, data, ws=None):
+        ws = ws or self._ws
+        encoding = ws.protocol.encoding
+        ws.send(encode(data, encoding), binary=encoding != 'json')
+
     def _send(self, data):
-        self._ws.send(json.dumps(data))
+        with self._send_lock:
+            if self._ws is None:
+                if self._closed or not self._reconnect:
+                    raise ClientException('Not connected')
+                self._reconnect_session()
+            self._write(data)
+
+    def _returned(self, call):
+        with self._lock:
+            self._calls.pop(call.id, None)
+            call.returned.set()
+            callbacks = call.done_callbacks
+            call.done_callbacks = []
+        for callback in callbacks:
+            callback()
 
     def _recv(self, message):
         _id = message.get('id')
         msg = message.get('msg')
         if msg == 'connected':
+            self._ws.protocol.encoding = message.get('encoding') or 'json'
             self._connected.set()
         elif msg == 'failed':
             raise ClientException('Unsupported protocol version')
+        elif msg in ('added', 'changed', 'removed'):
+            for name, callback in list(self._subscriptions.values()):
+                if name in (message.get('collection'), '*'):
+                    callback(msg.upper(), **message)
+        elif _id is not None and msg == 'chunk':
+            call = self._calls.get(_id)
+            if call:
+                if call.callback:
+                    call.callback(message.get('chunk'))
+                else:
+                    if call.chunks is None:
+                        call.chunks = []
+                    call.chunks.extend(message.get('chunk'))
         elif _id is not None and msg == 'result':
             call = self._calls.get(_id)
             if call:
                 call.result = message.get('result')
+                if call.chunks is not None:
+                    call.result = call.chunks
                 if 'error' in message:
                     call.error = message['error'].get('error')
                     call.stacktrace = message['error'].get('stacktrace')
-                call.returned.set()
-                self.unregister_call(call)
+                self._returned(call)
 
-    def on_open(self):
-        self._send({
+    def on_open(self, ws):
+        # Called from the client thread while _connect waits for the
+        # handshake holding the send lock, hence written directly.
+        self._write({
             'msg': 'connect',
             'version': '1',
             'support': ['1'],
-        })
-
-    def on_close(self, code, reason=None):
-        pass
+            'encodings': ENCODINGS,
+        }, ws=ws)
+
+    def on_close(self, ws, code, reason=None):
+        if ws is not self._ws:
+            return
+        self._ws = None
+        self._fail_calls()
+
+    def _fail_calls(self):
+        with self._lock:
+            calls = list(self._calls.values())
+        for call in calls:
+            call.error = 'Connection closed'
+            self._returned(call)
 
     def register_call(self, call):
-        self._calls[call.id] = call
+        with self._lock:
+            self._calls[call.id] = call
 
     def unregister_call(self, call):
-        self._calls.pop(call.id, None)
+        with self._lock:
+            self._calls.pop(call.id, None)
+
+    def call_async(self, method, *params, **kwargs):
+        """
+        Call `method` without waiting for its result, returns a `Future`.
+
+        For streamed results `callback` is called for every chunk received,
+        otherwise all chunks are gathered into the result.
+        """
+        c = Call(method, params, callback=kwargs.pop('callback', None))
+        self.register_call(c)
+        try:
+            self._send({
+                'msg': 'method',
+                'method': c.method,
+                'id': c.id,
+                'params': c.params,
+            })
+        except Exception:
+            self.unregister_call(c)
+            raise
+        return Future(self, c)
 
     def call(self, method, *params, **kwargs):
+        """
+        Call `method` and wait for its result.
+
+        For streamed results (e.g. `datastore.query` with `stream` option)
+        `callback` is called for every chunk received, otherwise all chunks
+        are gathered into the returned list.
+        """
         timeout = kwargs.pop('timeout', 30)
-        c = Call(method, params)
-        self.register_call(c)
+        future = self.call_async(method, *params, **kwargs)
+        try:
+            rv = future.result(timeout)
+        except ClientException:
+            self.unregister_call(future._call)
+            raise
+        if method in ('auth.login', 'auth.token') and rv:
+            self._login = (method, ) + params
+        return rv
+
+    def batch(self, calls, parallel=False, **kwargs):
+        """
+        Execute a list of `(method, params)` calls in a single round-trip.
+        Returns the list of results in the same order, raising ClientException
+        for the first call that failed.
+        """
+        rv = self.call('core.batch', [[m, list(p)] for m, p in calls], parallel, **kwargs)
+        results = []
+        for i in rv:
+            if 'error' in i:
+                raise ClientException(i['error'].get('error'), i['error'].get('stacktrace'))
+            results.append(i['result'])
+        return results
+
+    def subscribe(self, name, callback):
+        """
+        Subscribe to events of the `name` collection ('*' for every event).
+        `callback` is called from the client thread as
+        callback(event_type, **message), event_type being ADDED, CHANGED or REMOVED.
+        Returns the subscription id.
+        """
+        _id = str(uuid.uuid4())
+        self._subscriptions[_id] = (name, callback)
         self._send({
-            'msg': 'method',
-            'method': c.method,
-            'id': c.id,
-            'params': c.params,
+            'msg': 'sub',
+            'id': _id,
+            'name': name,
         })
+        return _id
 
-        if not c.returned.wait(timeout):
-            self.unregister_call(c)
-            raise Exception("Call timeout")
-
-        if c.error:
-            raise ClientException(c.error, c.stacktrace)
-
-        return c.result
+    def unsubscribe(self, _id):
+        self._subscriptions.pop(_id, None)
+        self._send({
+            'msg': 'unsub',
+            'id': _id,
+        })
 
     def close(self):
-        self._ws.close()
+        # Pooled clients are shared, they are closed along with the pool
+        if self._pooled:
+            return
+        self._close()
+
+    def _close(self):
+        self._closed = True
+        ws = self._ws
+        self._ws = None
+        if ws is not None:
+            ws.close()
+            self._fail_calls()
 
     def __del__(self):
         self.close()
 
 
+class ClientPool(object):
+    """
+    Process wide pool of up to `size` connections to `uri` shared by every
+    thread, handed out round-robin. As calls are multiplexed a single
+    connection is usually enough.
+    """
+
+    def __init__(self, uri=None, size=1, **kwargs):
+        self.uri = uri
+        self.size = size
+        self.kwargs = kwargs
+        self._clients = []
+        self._next = 0
+        self._pid = os.getpid()
+        self._lock = Lock()
+
+    def get(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections of the parent cannot be used after a fork
+                self._clients = []
+                self._pid = os.getpid()
+            if len(self._clients) < self.size:
+                client = Client(self.uri, **self.kwargs)
+                client._pooled = True
+                self._clients.append(client)
+                return client
+            self._next = (self._next + 1) % len(self._clients)
+            return self._clients[self._next]
+
+    def close(self):
+        with self._lock:
+            for client in self._clients:
+                client._close()
+            self._clients = []
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def get_client(uri=None):
+    """
+    Return a connected client from the process wide pool of `uri`.
+    It must not be closed, using it within a `with` statement is fine.
+    """
+    with _pools_lock:
+        pool = _pools.get(uri)
+        if pool is None:
+            pool = _pools[uri] = ClientPool(uri)
+    return pool.get()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-q', '--quiet', action='store_true')
@@ -1,5 +1,30 @@
 import json
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Encodings supported for messages after the connect handshake, by preference
+ENCODINGS = ['msgpack', 'json'] if msgpack is not None else ['json']
+
+
+def encode(data, encoding='json'):
+    if encoding == 'msgpack':
+        # Pack str as text, like json does, so the other end gets unicode back
+        return msgpack.packb(data, use_bin_type=False)
+    return json.dumps(data)
+
+
+def decode(data, encoding='json'):
+    if encoding == 'msgpack':
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except TypeError:
+            # msgpack < 0.5.2
+            return msgpack.unpackb(data, encoding='utf-8')
+    return json.loads(data)
+
 
 class DDPProtocol(object):
 
@@ -7,6 +32,8 @@ class DDPProtocol(object):
 
     def __init__(self, app):
         self._app = app
+        # Negotiated during the connect handshake, which is always json
+        self.encoding = 'json'
 
     def on_open(self):
         self.app.on_open()
@@ -15,10 +42,12 @@ class DDPProtocol(object):
         if message is None:
             return
 
+        # Text frames are always json
+        encoding = 'json' if isinstance(message, unicode) else self.encoding
         try:
-            message = json.loads(message)
-        except ValueError:
-            raise Exception("Invalid JSON message")
+            message = decode(message, encoding)
+        except Exception:
+            raise Exception("Invalid {0} message".format(encoding))
 
         if 'msg' not in message:
             raise Exception("msg property not found")
@@ -0,0 +1,122 @@
+from collections import deque
+
+import gevent
+import logging
+
+logger = logging.getLogger('middleware.event')
+
+
+class EventSource(object):
+    """
+    Server side producer of events for a collection.
+
+    It is only started while at least one client is subscribed to it,
+    directly or to every event with "*", so
+    whatever it polls is polled once regardless of the number of clients.
+    `run` is supposed to loop sending events with `send_event`.
+    """
+
+    def __init__(self, middleware, name):
+        self.middleware = middleware
+        self.name = name
+
+    def send_event(self, event_type, **kwargs):
+        self.middleware.send_event(self.name, event_type, **kwargs)
+
+    def run(self):
+        raise NotImplementedError('run must be implemented')
+
+
+class EventsDispatcher(object):
+    """
+    Keeps track of subscriptions and delivers events to the subscribed
+    websocket clients.
+
+    Events can be sent from worker threads so they are queued and delivered
+    from the hub, woken up by an async watcher.
+    """
+
+    def __init__(self, middleware):
+        self.middleware = middleware
+        self.apps = {}
+        self.sources = {}
+        self.running = {}
+        self.subscribers = {}
+        self._queue = deque()
+        self._delivering = False
+        self._async = getattr(gevent.get_hub().loop, 'async')()
+        self._async.start(self._wakeup)
+
+    def register_source(self, name, klass):
+        if name in self.sources:
+            raise ValueError('Event source "{0}" is already registered'.format(name))
+        self.sources[name] = klass
+        if '*' in self.subscribers:
+            self._start_source(name)
+
+    def add_app(self, app):
+        self.apps[app.sessionid] = app
+
+    def remove_app(self, app):
+        self.apps.pop(app.sessionid, None)
+
+    def subscribe(self, name):
+        self.subscribers[name] = self.subscribers.get(name, 0) + 1
+        # Subscribers of every event need every source running
+        for i in (list(self.sources) if name == '*' else [name]):
+            self._start_source(i)
+
+    def unsubscribe(self, name):
+        self.subscribers[name] = self.subscribers.get(name, 1) - 1
+        if self.subscribers[name] <= 0:
+            self.subscribers.pop(name)
+            if '*' in self.subscribers:
+                return
+            for i in (list(self.running) if name == '*' else [name]):
+                if i in self.subscribers:
+                    continue
+                greenlet = self.running.pop(i, None)
+                if greenlet is not None:
+                    greenlet.kill(block=False)
+
+    def _start_source(self, name):
+        if name in self.sources and name not in self.running:
+            source = self.sources[name](self.middleware, name)
+            self.running[name] = gevent.spawn(self._run_source, source)
+
+    def _run_source(self, source):
+        try:
+            source.run()
+        except gevent.GreenletExit:
+            pass
+        except Exception:
+            logger.error('Event source {0} failed'.format(source.name), exc_info=True)
+        finally:
+            if self.running.get(source.name) is gevent.getcurrent():
+                self.running.pop(source.name)
+
+    def send(self, name, event_type, **kwargs):
+        # Nobody listening, do not bother
+        if name not in self.subscribers and '*' not in self.subscribers:
+            return
+        self._queue.append((name, event_type, kwargs))
+        self._async.send()
+
+    def _wakeup(self):
+        # Watcher callbacks run in the hub itself which must not block,
+        # sending is done from a greenlet.
+        if not self._delivering:
+            self._delivering = True
+            gevent.spawn(self._deliver)
+
+    def _deliver(self):
+        try:
+            while self._queue:
+                name, event_type, kwargs = self._queue.popleft()
+                for app in list(self.apps.values()):
+                    try:
+                        app.send_event(name, event_type, **kwargs)
+                    except Exception:
+                        logger.warn('Failed to send event to {0}'.format(app.sessionid), exc_info=True)
+        finally:
+            self._delivering = False
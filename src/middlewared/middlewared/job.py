@@ -0,0 +1,197 @@
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import gevent
+import gevent.event
+import itertools
+import sys
+import traceback
+
+# Number of finished jobs kept around for their result to be retrieved
+JOBS_RETENTION = 100
+
+
+class JobState(object):
+    WAITING = 'WAITING'
+    RUNNING = 'RUNNING'
+    SUCCESS = 'SUCCESS'
+    FAILED = 'FAILED'
+    ABORTED = 'ABORTED'
+
+    FINISHED = (SUCCESS, FAILED, ABORTED)
+
+
+class Job(object):
+    """
+    Represents a long running call of a method flagged with @job.
+
+    The method receives the job as its first argument and may use it
+    to report progress and check whether it has been aborted.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, method, args, lock, limit, pool=None):
+        self.id = next(self._ids)
+        self.name = name
+        self.method = method
+        self.args = list(args)
+        self.lock = lock or name
+        self.limit = limit
+        self.pool = pool
+        self.state = JobState.WAITING
+        self.progress = {
+            'percent': None,
+            'description': None,
+        }
+        self.result = None
+        self.error = None
+        self.stacktrace = None
+        self.time_started = datetime.now()
+        self.time_finished = None
+        self.aborted = False
+        self.finished = gevent.event.Event()
+        self.middleware = None
+        self._greenlet = None
+
+    def notify(self, event_type='CHANGED'):
+        """Send the job state to clients subscribed to core.get_jobs."""
+        if self.middleware is not None:
+            self.middleware.send_event('core.get_jobs', event_type, id=self.id, fields=self.to_dict())
+
+    def set_progress(self, percent, description=None):
+        self.progress['percent'] = percent
+        if description is not None:
+            self.progress['description'] = description
+        self.notify()
+
+    def set_result(self, result):
+        self.result = result
+        self.set_state(JobState.SUCCESS)
+
+    def set_exception(self, exc_info):
+        self.error = str(exc_info[1])
+        self.stacktrace = ''.join(traceback.format_exception(*exc_info))
+        self.set_state(JobState.FAILED)
+
+    def set_state(self, state):
+        self.state = state
+        if state in JobState.FINISHED:
+            self.time_finished = datetime.now()
+            self.finished.set()
+        self.notify()
+
+    def abort(self):
+        """
+        Abort the job. Waiting jobs are simply not run, running jobs are
+        flagged as aborted and killed. Jobs running in a worker thread cannot
+        be interrupted, they should check `aborted` to stop early. They keep
+        their lock slot and only become ABORTED once the thread returns.
+        """
+        self.aborted = True
+        if self.state == JobState.RUNNING:
+            if self.pool:
+                return
+            if self._greenlet is not None:
+                self._greenlet.kill(block=False)
+        self.set_state(JobState.ABORTED)
+
+    def wait(self, timeout=None):
+        self.finished.wait(timeout)
+        return self.result
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'method': self.name,
+            'arguments': self.args,
+            'lock': self.lock,
+            'state': self.state,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'exception': self.stacktrace,
+            'time_started': str(self.time_started),
+            'time_finished': str(self.time_finished) if self.time_finished else None,
+        }
+
+
+class JobsQueue(object):
+    """
+    Runs jobs honoring the concurrency limit of each lock, jobs exceeding
+    the limit wait in a FIFO queue. Finished jobs are retained so their
+    result can be retrieved later.
+    """
+
+    def __init__(self, middleware):
+        self.middleware = middleware
+        self.jobs = OrderedDict()
+        self.running = {}
+        self.queues = {}
+
+    def add(self, job):
+        job.middleware = self.middleware
+        self.jobs[job.id] = job
+        job.notify('ADDED')
+        self.queues.setdefault(job.lock, deque()).append(job)
+        self._schedule(job.lock)
+        self._cleanup()
+        return job
+
+    def get(self, id):
+        return self.jobs[id]
+
+    def all(self):
+        return self.jobs.values()
+
+    def abort(self, id):
+        job = self.jobs[id]
+        if job.state in JobState.FINISHED:
+            return False
+        job.abort()
+        if job in self.queues.get(job.lock, ()):
+            self.queues[job.lock].remove(job)
+        return True
+
+    def _schedule(self, lock):
+        queue = self.queues[lock]
+        while queue:
+            job = queue[0]
+            if job.limit is not None and self.running.get(lock, 0) >= job.limit:
+                break
+            queue.popleft()
+            self.running[lock] = self.running.get(lock, 0) + 1
+            job.set_state(JobState.RUNNING)
+            job._greenlet = gevent.spawn(self._run, job)
+            # Linked rather than released at the end of _run, a job aborted
+            # before its greenlet started would never get there.
+            job._greenlet.link(lambda g, job=job: self._release(job))
+
+    def _run(self, job):
+        try:
+            args = [job] + job.args
+            if job.pool:
+                result = self.middleware.get_pool(job.pool).apply(job.method, args)
+            else:
+                result = job.method(*args)
+            if not job.aborted:
+                job.set_result(result)
+        except gevent.GreenletExit:
+            # Already ABORTED when killed by Job.abort
+            if job.state not in JobState.FINISHED:
+                job.set_state(JobState.ABORTED)
+        except Exception:
+            if not job.aborted:
+                job.set_exception(sys.exc_info())
+        if job.aborted and job.state not in JobState.FINISHED:
+            job.set_state(JobState.ABORTED)
+
+    def _release(self, job):
+        self.running[job.lock] -= 1
+        self._schedule(job.lock)
+
+    def _cleanup(self):
+        finished = [i for i in self.jobs.values() if i.state in JobState.FINISHED]
+        for job in finished[:max(len(finished) - JOBS_RETENTION, 0)]:
+            self.jobs.pop(job.id)
+            job.notify('REMOVED')
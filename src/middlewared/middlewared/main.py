@@ -2,41 +2,101 @@ from gevent import monkey
 monkey.patch_all()
 
 from collections import OrderedDict
-from client.protocol import DDPProtocol
+from client.client import UNIX_SOCKET_PATH
+from client.protocol import DDPProtocol, ENCODINGS, encode
+from event import EventsDispatcher
 from daemon import DaemonContext
 from daemon.pidfile import TimeoutPIDLockFile
+from gevent.lock import Semaphore
+from gevent.pool import Pool
 from gevent.wsgi import WSGIServer
 from geventwebsocket import WebSocketServer, WebSocketApplication, Resource
+from geventwebsocket.handler import WebSocketHandler
+from job import Job, JobsQueue
+from metrics import CallStats, ImportProfiler, Profiler
 from restful import RESTfulAPI
 from apidocs import app as apidocs_app
+from worker import WorkerPool
 
 import argparse
+import functools
 import gevent
 import imp
 import inspect
-import json
+import itertools
 import logging
 import logging.config
 import os
 import setproctitle
+import socket
+import struct
 import subprocess
 import sys
+import time
 import traceback
+import types
 import uuid
 
+# Not exposed by the socket module of Python 2
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+
+def get_peer_uid(sock):
+    """Get the effective uid of the process connected to an unix socket."""
+    if sys.platform.startswith('freebsd'):
+        # getsockopt(SOL_LOCAL, LOCAL_PEERCRED) returns a struct xucred:
+        #   u_int cr_version; uid_t cr_uid; short cr_ngroups; gid_t cr_groups[16];
+        data = sock.getsockopt(0, 1, 128)
+        return struct.unpack('2I', data[:8])[1]
+    # Linux SO_PEERCRED returns a struct ucred: pid_t pid; uid_t uid; gid_t gid;
+    data = sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', data)[1]
+
+
+class PeerCredHandler(WebSocketHandler):
+    """
+    Handler for the unix socket server which exposes the peer credentials
+    to the application as PEER_UID in the environ.
+    """
+
+    # Unix socket peers have no address, the server keeps track of its
+    # clients by address so each connection is given an unique one.
+    _unix_ids = itertools.count(1)
+
+    def __init__(self, sock, address, server, *args, **kwargs):
+        if sock.family == socket.AF_UNIX:
+            address = ('unix', next(self._unix_ids))
+        super(PeerCredHandler, self).__init__(sock, address, server, *args, **kwargs)
+
+    def get_environ(self):
+        environ = super(PeerCredHandler, self).get_environ()
+        if self.socket.family == socket.AF_UNIX:
+            environ['PEER_UID'] = get_peer_uid(self.socket)
+        return environ
+
 
 class Application(WebSocketApplication):
 
     protocol_class = DDPProtocol
+    # Maximum number of method calls running at the same time per connection
+    concurrent_calls = 20
 
     def __init__(self, *args, **kwargs):
         super(Application, self).__init__(*args, **kwargs)
         self.authenticated = self._check_permission()
         self.sessionid = str(uuid.uuid4())
         self.handshake = False
+        # Every method call runs in its own greenlet so a slow call does not
+        # hold back the others, results are sent back as they are ready.
+        self._calls = Pool(self.concurrent_calls)
+        self._send_lock = Semaphore()
+        # Subscription id -> collection name
+        self._subscriptions = {}
 
     def _send(self, data):
-        self.ws.send(json.dumps(data))
+        encoding = self.protocol.encoding
+        with self._send_lock:
+            self.ws.send(encode(data, encoding), binary=encoding != 'json')
 
     def send_error(self, message, error, stacktrace=None):
         self._send({
@@ -49,6 +109,11 @@ class Application(WebSocketApplication):
         })
 
     def _check_permission(self):
+        # Connections over the unix socket are authenticated by the kernel
+        # provided credentials, no need to look up the peer with sockstat.
+        if 'PEER_UID' in self.ws.environ:
+            return self.ws.environ['PEER_UID'] == 0
+
         if 'HTTP_X_REAL_REMOTE_ADDR' in self.ws.environ:
             remote_addr = self.ws.environ['HTTP_X_REAL_REMOTE_ADDR']
         else:
@@ -76,19 +141,52 @@ class Application(WebSocketApplication):
     def call_method(self, message):
 
         try:
+            result = self.middleware.call_method(self, message)
+            if isinstance(result, types.GeneratorType):
+                # Streamed results are sent as a sequence of chunks
+                # followed by an empty result to flag the end.
+                for chunk in result:
+                    self._send({
+                        'id': message['id'],
+                        'msg': 'chunk',
+                        'chunk': chunk,
+                    })
+                result = None
             self._send({
                 'id': message['id'],
                 'msg': 'result',
-                'result': self.middleware.call_method(self, message),
+                'result': result,
             })
         except Exception as e:
             self.send_error(message, str(e), ''.join(traceback.format_exception(sys.exc_type, sys.exc_value, sys.exc_traceback)))
 
+    def subscribe(self, id, name):
+        self._subscriptions[id] = name
+        self.middleware.get_events().subscribe(name)
+
+    def unsubscribe(self, id):
+        name = self._subscriptions.pop(id, None)
+        if name is not None:
+            self.middleware.get_events().unsubscribe(name)
+
+    def send_event(self, name, event_type, **kwargs):
+        if not any(i in (name, '*') for i in self._subscriptions.values()):
+            return
+        event = {
+            'msg': event_type.lower(),
+            'collection': name,
+        }
+        event.update(kwargs)
+        self._send(event)
+
     def on_open(self):
-        pass
+        self.middleware.get_events().add_app(self)
 
     def on_close(self, *args, **kwargs):
-        pass
+        self._calls.kill(block=False)
+        self.middleware.get_events().remove_app(self)
+        for id in list(self._subscriptions):
+            self.unsubscribe(id)
 
     def on_message(self, message):
 
@@ -99,10 +197,18 @@ class Application(WebSocketApplication):
                     'version': '1',
                 })
             else:
+                # Use the first encoding of the client we also support
+                encoding = 'json'
+                for i in message.get('encodings') or []:
+                    if i in ENCODINGS:
+                        encoding = i
+                        break
                 self._send({
                     'msg': 'connected',
                     'session': self.sessionid,
+                    'encoding': encoding,
                 })
+                self.protocol.encoding = encoding
                 self.handshake = True
             return
 
@@ -113,8 +219,33 @@ class Application(WebSocketApplication):
             })
             return
 
+        if message['msg'] == 'sub':
+            if not self.authenticated:
+                self._send({
+                    'msg': 'nosub',
+                    'id': message['id'],
+                    'error': {'error': 'Not authenticated'},
+                })
+                return
+            self.subscribe(message['id'], message['name'])
+            self._send({
+                'msg': 'ready',
+                'subs': [message['id']],
+            })
+            return
+
+        if message['msg'] == 'unsub':
+            self.unsubscribe(message['id'])
+            self._send({
+                'msg': 'nosub',
+                'id': message['id'],
+            })
+            return
+
         if message['msg'] == 'method':
-            self.call_method(message)
+            # Blocks once the concurrency limit has been reached, which
+            # stops reading new messages from this client meanwhile.
+            self._calls.spawn(self.call_method, message)
 
         if not self.authenticated:
             self.send_error(message, 'Not authenticated')
@@ -123,10 +254,23 @@ class Application(WebSocketApplication):
 
 class Middleware(object):
 
-    def __init__(self):
+    def __init__(self, thread_pool_size=10, concurrent_calls=20, plugins_dirs=None):
         self.logger = logging.getLogger('middleware')
+        self.concurrent_calls = concurrent_calls
+        # Plugins of later directories replace the ones of the same name
+        self.plugins_dirs = plugins_dirs or [
+            os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plugins'),
+        ]
+        self.__pools = {}
         self.__schemas = {}
         self.__services = {}
+        self.__stats = {}
+        self.__call_stats = CallStats()
+        self.__profiler = Profiler()
+        self.__jobs = JobsQueue(self)
+        self.__events = EventsDispatcher(self)
+        self.add_stats('methods', self.__call_stats.stats)
+        self.add_pool('default', thread_pool_size)
         self.__init_services()
         self.__plugins_load()
 
@@ -136,18 +280,19 @@ class Middleware(object):
 
     def __plugins_load(self):
         from middlewared.service import Service, CRUDService, ConfigService
-        plugins_dir = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)),
-            'plugins',
-        )
-        self.logger.debug('Loading plugins from {0}'.format(plugins_dir))
-        if not os.path.exists(plugins_dir):
-            raise ValueError('plugins dir not found')
-
-        for f in os.listdir(plugins_dir):
-            if not f.endswith('.py'):
-                continue
-            f = f[:-3]
+        plugins = {}
+        for plugins_dir in self.plugins_dirs:
+            self.logger.debug('Loading plugins from {0}'.format(plugins_dir))
+            if not os.path.exists(plugins_dir):
+                raise ValueError('plugins dir not found')
+            for f in os.listdir(plugins_dir):
+                if f.endswith('.py'):
+                    plugins[f[:-3]] = plugins_dir
+
+        timing = OrderedDict()
+        for f in sorted(plugins):
+            plugins_dir = plugins[f]
+            start = time.time()
             fp, pathname, description = imp.find_module(f, [plugins_dir])
             try:
                 mod = imp.load_module(f, fp, pathname, description)
@@ -155,37 +300,39 @@ class Middleware(object):
                 if fp:
                     fp.close()
 
-            for attr in dir(mod):
-                attr = getattr(mod, attr)
-                if not inspect.isclass(attr):
+            for name in dir(mod):
+                obj = getattr(mod, name)
+                if not inspect.isclass(obj):
                     continue
-                if attr in (Service, CRUDService, ConfigService):
+                if obj in (Service, CRUDService, ConfigService):
                     continue
-                if issubclass(attr, Service):
-                    self.add_service(attr(self))
+                if issubclass(obj, Service):
+                    self.add_service(obj(self))
 
             if hasattr(mod, 'setup'):
                 mod.setup(self)
+            timing[f] = time.time() - start
 
         # Now that all plugins have been loaded we can resolve all method params
         # to make sure every schema is patched and references match
-        from middlewared.schema import resolver  # Lazy import so namespace match
-        to_resolve = []
-        for service in self.__services.values():
-            for attr in dir(service):
-                to_resolve.append(getattr(service, attr))
-        resolved = 0
-        while len(to_resolve) > 0:
-            for method in list(to_resolve):
-                try:
-                    resolver(self, method)
-                except ValueError:
-                    pass
-                else:
-                    to_resolve.remove(method)
-                    resolved += 1
-            if resolved == 0:
-                raise ValueError("Not all could be resolved")
+        from middlewared.schema import resolve_methods  # Lazy import so namespace match
+        start = time.time()
+        resolve_methods(self, [
+            getattr(service, attr)
+            for service in self.__services.values()
+            for attr in dir(service)
+        ])
+        timing['__resolve__'] = time.time() - start
+
+        # Methods metadata only changes when plugins are loaded
+        start = time.time()
+        self.get_service('core').build_methods()
+        timing['__methods__'] = time.time() - start
+
+        for name, elapsed in timing.items():
+            self.logger.debug('Plugin {0} loaded in {1:.3f} seconds'.format(name, elapsed))
+        self.__startup_timing = timing
+        self.add_stats('startup', lambda: dict(self.__startup_timing))
 
         self.logger.debug('All plugins loaded')
 
@@ -208,32 +355,123 @@ class Middleware(object):
     def get_schema(self, name):
         return self.__schemas.get(name)
 
+    def add_pool(self, name, size):
+        if name in self.__pools:
+            raise ValueError('Pool "{0}" is already registered'.format(name))
+        self.__pools[name] = WorkerPool(name, size)
+
+    def get_pool(self, name):
+        return self.__pools[name]
+
+    def get_pools(self):
+        return self.__pools
+
+    def add_stats(self, name, callback):
+        """
+        Register `callback` as a source of statistics, its return value
+        is reported under `name` by core.get_stats.
+        """
+        self.__stats[name] = callback
+
+    def get_stats(self):
+        return {name: callback() for name, callback in self.__stats.items()}
+
+    def get_jobs(self):
+        return self.__jobs
+
+    def get_events(self):
+        return self.__events
+
+    def register_event_source(self, name, klass):
+        """Register an EventSource class producing events for `name` collection."""
+        self.__events.register_source(name, klass)
+
+    def send_event(self, name, event_type, **kwargs):
+        """
+        Send an event of `name` collection to every subscribed client.
+        `event_type` is one of ADDED, CHANGED and REMOVED.
+        It is safe to call from worker threads.
+        """
+        assert event_type in ('ADDED', 'CHANGED', 'REMOVED')
+        self.__events.send(name, event_type, **kwargs)
+
+    def get_profiler(self):
+        return self.__profiler
+
+    def _call(self, name, service, methodobj, params):
+        """
+        Run the method honoring its execution policy.
+        Blocking methods (flagged by @threaded or the service Config.thread_pool)
+        are run in a worker pool thread instead of the event loop.
+
+        Every call is accounted in the call statistics.
+        """
+        pool = getattr(methodobj, '_thread_pool', None) or service._config.thread_pool
+        if hasattr(methodobj, '_job'):
+            # Validate right away so an invalid call fails instead of
+            # returning the id of a job bound to fail.
+            if hasattr(methodobj, 'accepts'):
+                from middlewared.schema import clean_params  # Lazy import so namespace match
+                offset = 1 if hasattr(methodobj, '_pass_app') else 0
+                params = list(params[:offset]) + clean_params(methodobj, params[offset:])
+            job = self.__jobs.add(Job(name, methodobj, params, pool=pool, **methodobj._job))
+            return job.id
+        if self.__profiler.wants(name):
+            methodobj = functools.partial(self.__profiler.run, name, methodobj)
+        self.__call_stats.start(name)
+        start = time.time()
+        error = True
+        try:
+            if pool:
+                rv = self.get_pool(pool).apply(methodobj, params)
+            else:
+                rv = methodobj(*params)
+            error = False
+            return rv
+        finally:
+            self.__call_stats.finish(name, time.time() - start, error)
+
     def call_method(self, app, message):
         """Call method from websocket"""
         method = message['method']
         params = message.get('params') or []
         service, method = method.rsplit('.', 1)
-        methodobj = getattr(self.get_service(service), method)
+        serviceobj = self.get_service(service)
+        methodobj = getattr(serviceobj, method)
 
         if not app.authenticated and not hasattr(methodobj, '_no_auth_required'):
             app.send_error(message, 'Not authenticated')
             return
 
         if hasattr(methodobj, '_pass_app'):
-            return methodobj(app, *params)
-        else:
-            return methodobj(*params)
+            params = [app] + list(params)
+        return self._call(message['method'], serviceobj, methodobj, params)
 
-    def call(self, method, *params):
-        service, method = method.rsplit('.', 1)
-        return getattr(self.get_service(service), method)(*params)
+    def call(self, name, *params):
+        service, method = name.rsplit('.', 1)
+        serviceobj = self.get_service(service)
+        return self._call(name, serviceobj, getattr(serviceobj, method), params)
 
     def run(self):
         Application.middleware = self
+        Application.concurrent_calls = self.concurrent_calls
         wsserver = WebSocketServer(('127.0.0.1', 6000), Resource(OrderedDict([
             ('/websocket', Application),
         ])))
 
+        if os.path.exists(UNIX_SOCKET_PATH):
+            os.unlink(UNIX_SOCKET_PATH)
+        unix_listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix_listener.bind(UNIX_SOCKET_PATH)
+        # Anyone can connect, only root peers are authenticated
+        os.chmod(UNIX_SOCKET_PATH, 0o666)
+        unix_listener.listen(128)
+        # Every path is served by the application, clients do not
+        # necessarily send a resource over the unix socket.
+        unixserver = WebSocketServer(unix_listener, Resource(OrderedDict([
+            ('/', Application),
+        ])), handler_class=PeerCredHandler)
+
         restful_api = RESTfulAPI(self)
 
         apidocs_app.middleware = self
@@ -242,6 +480,7 @@ class Middleware(object):
 
         server_threads = [
             gevent.spawn(wsserver.serve_forever),
+            gevent.spawn(unixserver.serve_forever),
             gevent.spawn(apidocsserver.serve_forever),
             gevent.spawn(restserver.serve_forever),
         ]
@@ -249,6 +488,21 @@ class Middleware(object):
         gevent.joinall(server_threads)
 
 
+def profile_startup(args):
+    with ImportProfiler() as profiler:
+        middleware = Middleware(
+            thread_pool_size=args.threads,
+            concurrent_calls=args.concurrent_calls,
+        )
+    print 'Plugins (seconds):'
+    for name, elapsed in middleware.get_stats()['startup'].items():
+        print '  {0:<50} {1:>8.3f}'.format(name, elapsed)
+    print 'Imports (seconds):'
+    print '  {0:<50} {1:>8} {2:>8}'.format('module', 'total', 'self')
+    for name, cumulative, _self in profiler.report():
+        print '  {0:<50} {1:>8.3f} {2:>8.3f}'.format(name, cumulative, _self)
+
+
 def main():
     # Workaround for development
     modpath = os.path.realpath(os.path.join(
@@ -261,8 +515,16 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('restart', nargs='?')
     parser.add_argument('--foregound', '-f', action='store_true')
+    parser.add_argument('--threads', type=int, default=10, help='Size of the default worker pool')
+    parser.add_argument('--concurrent-calls', type=int, default=20, help='Maximum method calls in flight per connection')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report time spent loading every plugin and importing modules, then exit')
     args = parser.parse_args()
 
+    if args.profile_startup:
+        profile_startup(args)
+        return
+
     pidpath = '/var/run/middlewared.pid'
 
     if args.restart:
@@ -315,7 +577,10 @@ def main():
         # Workaround to tell django to not set up logging on its own
         os.environ['MIDDLEWARED'] = str(os.getpid())
 
-        Middleware().run()
+        Middleware(
+            thread_pool_size=args.threads,
+            concurrent_calls=args.concurrent_calls,
+        ).run()
     finally:
         if not args.foregound:
             daemonc.close()
@@ -0,0 +1,232 @@
+from gevent.monkey import get_original
+from StringIO import StringIO
+
+import __builtin__
+import cProfile
+import greenlet
+import pstats
+import sys
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1, 2.5, 5, 10, 30, 60, float('inf'),
+)
+
+
+class MethodStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_time = 0
+        self.max_time = 0
+        self.histogram = [0] * len(BUCKETS)
+
+    def add(self, elapsed, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        for index, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.histogram[index] += 1
+                break
+
+    def percentile(self, q):
+        """Upper bound of the bucket where the `q` percentile falls into."""
+        if not self.calls:
+            return None
+        threshold = q * self.calls
+        count = 0
+        for index, bound in enumerate(BUCKETS):
+            count += self.histogram[index]
+            if count >= threshold:
+                # Better to report the worst case seen than infinity
+                return min(bound, self.max_time)
+        return self.max_time
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'avg': self.total_time / self.calls if self.calls else None,
+            'max': self.max_time,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'histogram': [
+                [bound if bound != float('inf') else None, count]
+                for bound, count in zip(BUCKETS, self.histogram)
+            ],
+        }
+
+
+class CallStats(object):
+    """
+    Accounting of every method call: counts, errors, calls in flight and
+    latency histogram per method.
+
+    Calls are made from the hub and from worker threads so a real lock
+    (not the monkey patched one) is used.
+    """
+
+    def __init__(self):
+        self.methods = {}
+        self._lock = get_original('thread', 'allocate_lock')()
+
+    def start(self, name):
+        with self._lock:
+            stats = self.methods.get(name)
+            if stats is None:
+                stats = self.methods[name] = MethodStats()
+            stats.in_flight += 1
+
+    def finish(self, name, elapsed, error=False):
+        with self._lock:
+            stats = self.methods[name]
+            stats.in_flight -= 1
+            stats.add(elapsed, error)
+
+    def stats(self):
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self.methods.items()}
+
+
+class Profiler(object):
+    """
+    Captures a cProfile of the next invocations of the requested methods.
+
+    The profiler of a call is only enabled while its greenlet runs, other
+    greenlets scheduled meanwhile in the same thread are left out.
+    """
+
+    def __init__(self):
+        self.remaining = {}
+        self.results = {}
+        self._lock = get_original('thread', 'allocate_lock')()
+        self._get_ident = get_original('thread', 'get_ident')
+        # Greenlet -> profile of the call it is running
+        self._profiles = {}
+        # Thread -> [tracer replaced, number of calls being profiled]
+        self._tracers = {}
+
+    def start(self, name, count):
+        with self._lock:
+            self.remaining[name] = count
+            self.results.pop(name, None)
+
+    def wants(self, name):
+        """Check whether the next invocation of `name` has to be profiled."""
+        if name not in self.remaining:
+            return False
+        with self._lock:
+            if self.remaining.get(name, 0) <= 0:
+                return False
+            self.remaining[name] -= 1
+            return True
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            profile = self._profiles.get(origin)
+            if profile is not None:
+                profile.disable()
+            profile = self._profiles.get(target)
+            if profile is not None:
+                profile.enable()
+        previous = self._tracers[self._get_ident()][0]
+        if previous is not None:
+            previous(event, args)
+
+    def run(self, name, method, *args):
+        profile = cProfile.Profile()
+        current = greenlet.getcurrent()
+        ident = self._get_ident()
+        with self._lock:
+            # Profiled calls may be nested
+            outer = self._profiles.get(current)
+            self._profiles[current] = profile
+            tracer = self._tracers.get(ident)
+            if tracer is None:
+                tracer = self._tracers[ident] = [greenlet.settrace(self._trace), 0]
+            tracer[1] += 1
+        try:
+            return profile.runcall(method, *args)
+        finally:
+            with self._lock:
+                if outer is None:
+                    self._profiles.pop(current, None)
+                else:
+                    self._profiles[current] = outer
+                    outer.enable()
+                tracer[1] -= 1
+                if tracer[1] == 0:
+                    greenlet.settrace(tracer[0])
+                    self._tracers.pop(ident)
+                stats = self.results.get(name)
+                if stats is None:
+                    self.results[name] = {'calls': 1, 'stats': pstats.Stats(profile)}
+                else:
+                    stats['calls'] += 1
+                    stats['stats'].add(profile)
+
+    def report(self, name, limit=50):
+        with self._lock:
+            result = self.results.get(name)
+            remaining = self.remaining.get(name, 0)
+            if result is None:
+                return {'calls': 0, 'remaining': remaining, 'report': None}
+            output = StringIO()
+            stats = result['stats']
+            stats.stream = output
+            stats.sort_stats('cumulative').print_stats(limit)
+            return {'calls': result['calls'], 'remaining': remaining, 'report': output.getvalue()}
+
+
+class ImportProfiler(object):
+    """
+    Measures the time spent importing every module while active, both
+    cumulative and self (excluding the modules imported by it).
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self._stack = []
+        self._import = None
+
+    def __enter__(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        __builtin__.__import__ = self._import
+
+    def _timed_import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        self._stack.append(0)
+        start = time.time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            module = self.modules.setdefault(name, {'cumulative': 0, 'self': 0})
+            module['cumulative'] += elapsed
+            module['self'] += elapsed - nested
+
+    def report(self, limit=30):
+        """Returns the `limit` slowest imports as (name, cumulative, self) tuples."""
+        return sorted(
+            [(name, i['cumulative'], i['self']) for name, i in self.modules.items()],
+            key=lambda i: i[1],
+            reverse=True,
+        )[:limit]
@@ -0,0 +1,67 @@
+from middlewared.event import EventSource
+from middlewared.service import Service, threaded
+
+import cPickle
+import gevent
+import os
+
+ALERT_FILE = '/var/tmp/alert'
+
+
+class AlertService(Service):
+
+    @threaded()
+    def list(self):
+        """Returns the list of current alerts as last checked by the alert system."""
+        if not os.path.exists(ALERT_FILE):
+            return []
+        with open(ALERT_FILE, 'r') as f:
+            try:
+                # Alert objects are freenasUI.system.alert.Alert
+                obj = cPickle.load(f)
+            except Exception:
+                return []
+        return [
+            {
+                'id': alert.getId(),
+                'level': alert.getLevel(),
+                'message': alert.getMessage(),
+                'dismissed': alert.getDismiss(),
+                'timestamp': alert.getTimestamp(),
+            }
+            for alert in obj.get('alerts') or [] if alert
+        ]
+
+
+class AlertEventSource(EventSource):
+    """
+    Sends the alerts added, changed or removed whenever the alert file
+    is rewritten by the alert system.
+    """
+
+    interval = 5
+
+    def run(self):
+        mtime = None
+        alerts = {}
+        while True:
+            try:
+                current = os.stat(ALERT_FILE).st_mtime
+            except OSError:
+                current = None
+            if current != mtime:
+                mtime = current
+                new = {i['id']: i for i in self.middleware.call('alert.list')}
+                for id, alert in new.items():
+                    if id not in alerts:
+                        self.send_event('ADDED', id=id, fields=alert)
+                    elif alerts[id] != alert:
+                        self.send_event('CHANGED', id=id, fields=alert)
+                for id in set(alerts) - set(new):
+                    self.send_event('REMOVED', id=id)
+                alerts = new
+            gevent.sleep(self.interval)
+
+
+def setup(middleware):
+    middleware.register_event_source('alert.list', AlertEventSource)
@@ -1,11 +1,71 @@
+from collections import OrderedDict
+
+import binascii
 import crypt
+import hashlib
+import hmac
+import os
+import time
+
+from middlewared.schema import Int, Str, accepts
+from middlewared.service import Service, no_auth_required, pass_app, private
 
-from middlewared.schema import Str, accepts
-from middlewared.service import Service, no_auth_required, pass_app
+# Number of verified credentials kept in cache and for how long (seconds)
+CREDENTIALS_CACHE_SIZE = 64
+CREDENTIALS_CACHE_TTL = 60
+# Default and maximum lifetime (seconds) of session tokens
+TOKEN_TTL = 600
+TOKEN_MAX_TTL = 86400
+# Maximum number of live session tokens
+TOKENS_MAX = 1024
 
 
 class AuthService(Service):
 
+    def __init__(self, *args, **kwargs):
+        super(AuthService, self).__init__(*args, **kwargs)
+        # Credentials are never stored, only their digest keyed by a secret
+        # generated on every start.
+        self.__key = os.urandom(32)
+        self.__credentials = OrderedDict()
+        self.__tokens = OrderedDict()
+        # username -> (database signature, stored hash)
+        self.__hashes = {}
+        self.__stats = dict.fromkeys(['hits', 'misses', 'hash_hits', 'hash_misses'], 0)
+        self.middleware.add_stats('auth.cache', self.__cache_stats)
+
+    def __cache_stats(self):
+        stats = dict(self.__stats)
+        stats['entries'] = len(self.__credentials)
+        return stats
+
+    def __credentials_digest(self, username, password, unixhash):
+        # The hash is part of the digest so changing the password
+        # invalidates whatever has been cached for the old one.
+        msg = u'\0'.join([username, unixhash, password]).encode('utf8')
+        return hmac.new(self.__key, msg, hashlib.sha256).digest()
+
+    def __unixhash(self, username):
+        """
+        Stored hash of `username` password, None if there is no such user.
+        It is cached as long as the database file is not written.
+        """
+        signature = self.middleware.call('datastore.signature')
+        cached = self.__hashes.get(username)
+        if cached is not None and signature is not None and cached[0] == signature:
+            self.__stats['hash_hits'] += 1
+            return cached[1]
+        self.__stats['hash_misses'] += 1
+        try:
+            user = self.middleware.call('datastore.query', 'account.bsdusers', [('bsdusr_username', '=', username)], {'get': True})
+        except IndexError:
+            return None
+        # A write within the same timestamp as the database file would
+        # go unnoticed, do not cache meanwhile.
+        if signature is not None and time.time() - signature[0] >= 1:
+            self.__hashes[username] = (signature, user['bsdusr_unixhash'])
+        return user['bsdusr_unixhash']
+
     @accepts(Str('username'), Str('password'))
     def check_user(self, username, password):
         """Authenticate session using username and password.
@@ -13,13 +73,30 @@ class AuthService(Service):
         """
         if username != 'root':
             return False
-        try:
-            user = self.middleware.call('datastore.query', 'account.bsdusers', [('bsdusr_username', '=', username)], {'get': True})
-        except IndexError:
+        unixhash = self.__unixhash(username)
+        if unixhash is None or unixhash in ('x', '*'):
             return False
-        if user['bsdusr_unixhash'] in ('x', '*'):
+
+        # crypt of a SHA-512 hash takes milliseconds, avoid it for credentials
+        # verified recently. Failures are never cached.
+        digest = self.__credentials_digest(username, password, unixhash)
+        now = time.time()
+        expires = self.__credentials.get(digest)
+        if expires is not None:
+            if expires > now:
+                self.__stats['hits'] += 1
+                return True
+            self.__credentials.pop(digest)
+        self.__stats['misses'] += 1
+
+        # Run in a worker thread so it does not stall the event loop
+        if self.middleware.get_pool('default').apply(crypt.crypt, [password, unixhash]) != unixhash:
             return False
-        return crypt.crypt(password, user['bsdusr_unixhash']) == user['bsdusr_unixhash']
+
+        self.__credentials[digest] = now + CREDENTIALS_CACHE_TTL
+        while len(self.__credentials) > CREDENTIALS_CACHE_SIZE:
+            self.__credentials.popitem(last=False)
+        return True
 
     @no_auth_required
     @accepts(Str('username'), Str('password'))
@@ -29,3 +106,50 @@ class AuthService(Service):
         if valid:
             app.authenticated = True
         return valid
+
+    @accepts(Int('ttl'))
+    def generate_token(self, ttl=TOKEN_TTL):
+        """
+        Generate a session token valid for `ttl` seconds (at most a day).
+
+        The token can be used to authenticate REST requests using the
+        "Authorization: Token <token>" header or a websocket session
+        using `auth.token`.
+        """
+        if ttl is None:
+            ttl = TOKEN_TTL
+        ttl = max(min(ttl, TOKEN_MAX_TTL), 1)
+        now = time.time()
+        for token, expires in list(self.__tokens.items()):
+            if expires <= now:
+                self.__tokens.pop(token)
+        while len(self.__tokens) >= TOKENS_MAX:
+            self.__tokens.popitem(last=False)
+        token = binascii.hexlify(os.urandom(32)).decode('ascii')
+        self.__tokens[token] = now + ttl
+        return token
+
+    @private
+    def check_token(self, token):
+        expires = self.__tokens.get(token)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            self.__tokens.pop(token)
+            return False
+        return True
+
+    @accepts(Str('token'))
+    def revoke_token(self, token):
+        """Revoke a session token before it expires."""
+        return self.__tokens.pop(token, None) is not None
+
+    @no_auth_required
+    @accepts(Str('token'))
+    @pass_app
+    def token(self, app, token):
+        """Authenticate session using a token generated by `auth.generate_token`."""
+        valid = self.check_token(token)
+        if valid:
+            app.authenticated = True
+        return valid
@@ -1,12 +1,16 @@
+from collections import OrderedDict
+from gevent.monkey import get_original
 from middlewared.schema import Ref, accepts
 from middlewared.service import CRUDService, private
 from OpenSSL import crypto
 
+import copy
 import dateutil
 import dateutil.parser
 import logging
 import os
 import re
+import time
 
 CA_TYPE_EXISTING = 0x01
 CA_TYPE_INTERNAL = 0x02
@@ -18,11 +22,22 @@ CERT_TYPE_CSR = 0x20
 CERT_ROOT_PATH = '/etc/certificates'
 CERT_CA_ROOT_PATH = '/etc/certificates/CA'
 RE_CERTIFICATE = re.compile(r"(-{5}BEGIN[\s\w]+-{5}[^-]+-{5}END[\s\w]+-{5})+", re.M | re.S)
+# Number of certificates whose parsed attributes are kept in cache
+CERT_CACHE_SIZE = 256
 logger = logging.getLogger('plugins.crypto')
 
 
 class CertificateService(CRUDService):
 
+    def __init__(self, *args, **kwargs):
+        super(CertificateService, self).__init__(*args, **kwargs)
+        # Attributes parsed from the PEM material keyed by certificate and
+        # signature of the database file, the certificate and its chain of
+        # signing CAs only change along with the database.
+        self.__parsed = OrderedDict()
+        # cert_extend is called from worker threads
+        self.__lock = get_original('thread', 'allocate_lock')()
+
     @accepts(Ref('query-filters'), Ref('query-options'))
     def query(self, filters=None, options=None):
         if options is None:
@@ -30,6 +45,63 @@ class CertificateService(CRUDService):
         options['extend'] = 'certificate.cert_extend'
         return self.middleware.call('datastore.query', 'system.certificate', filters, options)
 
+    def __parse(self, cert, certs):
+        """Attributes of `cert` derived from its PEM material."""
+        parsed = {
+            'cert_chain_list': [],
+            'cert_privatekey': cert['cert_privatekey'],
+            'cert_CSR': cert['cert_CSR'],
+        }
+        try:
+            for c in certs:
+                # XXX Why load certificate if we are going to dump it right after?
+                # Maybe just to verify its integrity?
+                # Logic copied from freenasUI
+                cert_obj = crypto.load_certificate(crypto.FILETYPE_PEM, c)
+                parsed['cert_chain_list'].append(
+                    crypto.dump_certificate(crypto.FILETYPE_PEM, cert_obj)
+                )
+        except:
+            logger.debug('Failed to load certificate {0}'.format(cert['cert_name']), exc_info=True)
+
+        try:
+            if cert['cert_privatekey']:
+                key_obj = crypto.load_privatekey(crypto.FILETYPE_PEM, cert['cert_privatekey'])
+                parsed['cert_privatekey'] = crypto.dump_privatekey(crypto.FILETYPE_PEM, key_obj)
+        except:
+            logger.debug('Failed to load privatekey {0}'.format(cert['cert_name']), exc_info=True)
+
+        try:
+            if cert['cert_CSR']:
+                csr_obj = crypto.load_certificate_request(crypto.FILETYPE_PEM, cert['cert_CSR'])
+                parsed['cert_CSR'] = crypto.dump_certificate_request(crypto.FILETYPE_PEM, csr_obj)
+        except:
+            logger.debug('Failed to load csr {0}'.format(cert['cert_name']), exc_info=True)
+
+        if cert['cert_type'] == CERT_TYPE_CSR:
+            obj = csr_obj
+            # date not applicable for CSR
+            parsed['cert_from'] = None
+            parsed['cert_until'] = None
+        else:
+            obj = cert_obj
+            notBefore = obj.get_notBefore()
+            t1 = dateutil.parser.parse(notBefore)
+            t2 = t1.astimezone(dateutil.tz.tzutc())
+            parsed['cert_from'] = t2.ctime()
+
+            notAfter = obj.get_notAfter()
+            t1 = dateutil.parser.parse(notAfter)
+            t2 = t1.astimezone(dateutil.tz.tzutc())
+            parsed['cert_until'] = t2.ctime()
+
+        parsed['cert_DN'] = '/' + '/'.join([
+            '%s=%s' % (c[0], c[1])
+            for c in obj.get_subject().get_components()
+        ])
+
+        return parsed
+
     @private
     def cert_extend(self, cert):
         """Extend certificate with some useful attributes."""
@@ -63,7 +135,17 @@ class CertificateService(CRUDService):
             return issuer
         cert['cert_issuer'] = cert_issuer(cert)
 
-        cert['cert_chain_list'] = []
+        signature = self.middleware.call('datastore.signature')
+        # A write within the same timestamp as the database file would
+        # go unnoticed, do not cache meanwhile.
+        if signature is not None and time.time() - signature[0] < 1:
+            signature = None
+        key = (root_path, cert['id'], signature)
+        with self.__lock:
+            parsed = self.__parsed.pop(key, None) if signature is not None else None
+            if parsed is not None:
+                self.__parsed[key] = parsed
+
         if cert['cert_chain']:
             certs = RE_CERTIFICATE.findall(cert['cert_certificate'])
         else:
@@ -74,56 +156,19 @@ class CertificateService(CRUDService):
                 certs.append(signing_CA['cert_certificate'])
                 signing_CA['cert_issuer'] = cert_issuer(signing_CA)
                 signing_CA = signing_CA['cert_issuer']
-        try:
-            for c in certs:
-                # XXX Why load certificate if we are going to dump it right after?
-                # Maybe just to verify its integrity?
-                # Logic copied from freenasUI
-                cert_obj = crypto.load_certificate(crypto.FILETYPE_PEM, c)
-                cert['cert_chain_list'].append(
-                    crypto.dump_certificate(crypto.FILETYPE_PEM, cert_obj)
-                )
-        except:
-            logger.debug('Failed to load certificate {0}'.format(cert['cert_name']), exc_info=True)
-
-        try:
-            if cert['cert_privatekey']:
-                key_obj = crypto.load_privatekey(crypto.FILETYPE_PEM, cert['cert_privatekey'])
-                cert['cert_privatekey'] = crypto.dump_privatekey(crypto.FILETYPE_PEM, key_obj)
-        except:
-            logger.debug('Failed to load privatekey {0}'.format(cert['cert_name']), exc_info=True)
 
-        try:
-            if cert['cert_CSR']:
-                csr_obj = crypto.load_certificate_request(crypto.FILETYPE_PEM, cert['cert_CSR'])
-                cert['cert_CSR'] = crypto.dump_certificate_request(crypto.FILETYPE_PEM, csr_obj)
-        except:
-            logger.debug('Failed to load csr {0}'.format(cert['cert_name']), exc_info=True)
+        if parsed is None:
+            # Parsing with pyOpenSSL and dateutil is what makes it slow
+            parsed = self.__parse(cert, certs)
+            if signature is not None:
+                with self.__lock:
+                    self.__parsed[key] = parsed
+                    while len(self.__parsed) > CERT_CACHE_SIZE:
+                        self.__parsed.popitem(last=False)
+        cert.update(copy.deepcopy(parsed))
 
         cert['cert_internal'] = 'NO' if cert['cert_type'] in (CA_TYPE_EXISTING, CERT_TYPE_EXISTING) else 'YES'
 
-        if cert['cert_type'] == CERT_TYPE_CSR:
-            obj = csr_obj
-            # date not applicable for CSR
-            cert['cert_from'] = None
-            cert['cert_until'] = None
-        else:
-            obj = cert_obj
-            notBefore = obj.get_notBefore()
-            t1 = dateutil.parser.parse(notBefore)
-            t2 = t1.astimezone(dateutil.tz.tzutc())
-            cert['cert_from'] = t2.ctime()
-
-            notAfter = obj.get_notAfter()
-            t1 = dateutil.parser.parse(notAfter)
-            t2 = t1.astimezone(dateutil.tz.tzutc())
-            cert['cert_until'] = t2.ctime()
-
-        cert['cert_DN'] = '/' + '/'.join([
-            '%s=%s' % (c[0], c[1])
-            for c in obj.get_subject().get_components()
-        ])
-
         return cert
 
 
@@ -1,5 +1,5 @@
-from middlewared.service import Service, private
-from middlewared.schema import accepts, Bool, Dict, List, Ref, Str
+from middlewared.service import Service, private, threaded
+from middlewared.schema import accepts, Bool, Dict, Int, List, Ref, Str
 
 import os
 import sys
@@ -7,18 +7,150 @@ import sys
 sys.path.append('/usr/local/www')
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'freenasUI.settings')
 
-# Make sure to load all modules
+# Models are loaded by the first cache.get_model rather than right away
+# with cache.get_apps(), it takes a while.
 from django.db.models.loading import cache
-cache.get_apps()
 
-from django.db import connection
+from collections import OrderedDict, defaultdict
+from django.db import connection, transaction
 from django.db.models import Q
+from django.db.models.fields.related import ForeignKey
+from freenasUI.freeadmin.sqlite3_ha.base import RemoteBatch, add_write_listener
+from gevent.monkey import get_original
+
+import copy
+import json
+import struct
 
 from middlewared.utils import django_modelobj_serialize
 
+# Default levels of foreign keys followed by select_related
+RELATED_DEPTH = 3
+# Maximum number of query results kept in cache
+CACHE_SIZE = 512
+
+
+class QueryCache(object):
+    """
+    LRU cache of serialized query results.
+
+    Every entry is tagged with the generation of the tables it was read from.
+    Generations are bumped by the transactions committed within this process
+    (notified by sqlite3_ha). Transactions committed by another process (e.g.
+    the GUI) invalidate everything, they are told apart from ours by the
+    change counter of the database file which every commit increments.
+    """
+
+    def __init__(self, size, dbpath):
+        self.size = size
+        self.dbpath = dbpath
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache = OrderedDict()
+        self._generation = 0
+        self._generations = defaultdict(int)
+        self._writes = 0
+        # Change counter expected unless another process committed
+        self._counter = None
+        # Used from worker threads, a gevent lock would not do
+        self._lock = get_original('thread', 'allocate_lock')()
+
+    def db_signature(self):
+        try:
+            st = os.stat(self.dbpath)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def db_counter(self):
+        """File change counter of the database header, None if it cannot be read."""
+        try:
+            with open(self.dbpath, 'rb') as f:
+                header = f.read(28)
+        except (IOError, OSError):
+            return None
+        if len(header) < 28:
+            return None
+        return struct.unpack('>I', header[24:28])[0]
+
+    def _tag(self, tables):
+        if tables is None:
+            return self._generation, self._writes
+        return (self._generation, ) + tuple(
+            self._generations[i] for i in sorted(tables)
+        )
+
+    def invalidate(self, tables=None):
+        """Committed a transaction writing `tables`, None if not known."""
+        with self._lock:
+            if tables is None:
+                self._generation += 1
+                self._counter = self.db_counter()
+            else:
+                for table in tables:
+                    self._generations[table] += 1
+                if self._counter is not None:
+                    self._counter += 1
+            self._writes += 1
+
+    def get(self, key, tables):
+        """
+        Returns a tuple (hit, value, tag), `tag` being the generation
+        to store the value with in case of a miss.
+        """
+        with self._lock:
+            counter = self.db_counter()
+            if counter is None or counter != self._counter:
+                self._generation += 1
+            self._counter = counter
+
+            tag = self._tag(tables)
+            entry = self._cache.pop(key, None)
+            if entry is not None and entry[0] == tag:
+                self._cache[key] = entry
+                self.hits += 1
+                return True, entry[1], tag
+            self.misses += 1
+            return False, None, tag
+
+    def put(self, key, tag, value):
+        with self._lock:
+            # Changes of the database could not be told
+            if self._counter is None:
+                return
+            self._cache.pop(key, None)
+            self._cache[key] = (tag, value)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'entries': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
 
 class DatastoreService(Service):
 
+    def __init__(self, *args, **kwargs):
+        super(DatastoreService, self).__init__(*args, **kwargs)
+        self.__cache = QueryCache(CACHE_SIZE, connection.settings_dict['NAME'])
+        add_write_listener(self.__cache.invalidate)
+        self.middleware.add_stats('datastore.cache', self.__cache.stats)
+
+    @private
+    def signature(self):
+        """
+        Signature of the database file, changing whenever it is written
+        by any process. None if it cannot be read.
+        """
+        return self.__cache.db_signature()
+
     def _filters_to_queryset(self, filters):
         opmap = {
             '=': 'exact',
@@ -65,9 +197,76 @@ class DatastoreService(Service):
         app, model = name.split('.', 1)
         return cache.get_model(app, model)
 
-    def __queryset_serialize(self, qs, extend=None):
+    def __related_fields(self, model, depth, prefix=''):
+        """
+        Lookup paths of every foreign key reachable from `model` up to
+        `depth` levels, to be used with select_related so serializing a
+        row does not trigger one query per relationship.
+        """
+        rv = []
+        if depth <= 0:
+            return rv
+        for field in model._meta.fields:
+            if not isinstance(field, ForeignKey):
+                continue
+            path = prefix + field.name
+            rv.append(path)
+            rv.extend(self.__related_fields(field.rel.to, depth - 1, path + '__'))
+        return rv
+
+    def __related_tables(self, model, tables=None):
+        """
+        Tables of `model` and every model reachable through foreign keys,
+        which are the tables a serialized row is read from.
+        """
+        if tables is None:
+            tables = set()
+        if model._meta.db_table in tables:
+            return tables
+        tables.add(model._meta.db_table)
+        for field in model._meta.fields:
+            if isinstance(field, ForeignKey):
+                self.__related_tables(field.rel.to, tables)
+        return tables
+
+    def __filters_fields(self, filters):
+        for f in filters or []:
+            if len(f) == 3:
+                yield f[0]
+            elif len(f) == 2:
+                for i in self.__filters_fields(f[1]):
+                    yield i
+
+    def __queryset_serialize(self, qs, fields=None):
         for i in qs:
-            yield django_modelobj_serialize(self.middleware, i, extend=extend)
+            yield django_modelobj_serialize(self.middleware, i, fields=fields)
+
+    def __stream(self, name, filters, options):
+        """
+        Generator of result chunks, each chunk is fetched with its own
+        paginated query so neither the queryset nor the whole result
+        is kept in memory.
+        """
+        options = dict(options)
+        options.pop('stream')
+        chunk_size = options.pop('chunk_size', None) or 100
+        offset = options.get('offset') or 0
+        limit = options.get('limit')
+        # Pagination requires a stable order
+        if not options.get('order_by'):
+            options['order_by'] = ['pk']
+        while limit is None or limit > 0:
+            size = chunk_size if limit is None else min(chunk_size, limit)
+            options.update({'offset': offset, 'limit': size})
+            chunk = self.middleware.call('datastore.query', name, filters, options)
+            if not chunk:
+                break
+            yield chunk
+            if len(chunk) < size:
+                break
+            offset += len(chunk)
+            if limit is not None:
+                limit -= len(chunk)
 
     @accepts(
         Str('name'),
@@ -75,13 +274,21 @@ class DatastoreService(Service):
         Dict(
             'query-options',
             Str('extend'),
+            Str('extend_list'),
             Dict('extra', additional_attrs=True),
             List('order_by'),
+            List('select'),
+            Int('offset'),
+            Int('limit'),
             Bool('count'),
             Bool('get'),
+            Bool('stream'),
+            Int('chunk_size'),
+            Int('related_depth'),
             register=True,
         ),
     )
+    @threaded()
     def query(self, name, filters=None, options=None):
         """Query for items in a given collection `name`.
 
@@ -100,6 +307,20 @@ class DatastoreService(Service):
 
         `[ ['username', '=', 'root' ] ]`
 
+        `options` may use `offset` and `limit` to paginate the result and
+        `select` to only return the given list of fields.
+
+        `extend` is a method called for every row while `extend_list` is
+        called once with the list of all rows, which allows extending them
+        with batched lookups.
+
+        Foreign keys are fetched within the same query up to `related_depth`
+        levels of relationships (default 3).
+
+        Setting `stream` makes the result to be sent in chunks of `chunk_size`
+        rows (default 100) which are fetched one at a time, keeping memory
+        usage flat for large collections.
+
         .. examples(websocket)::
 
           Querying for username "root" and returning a single item:
@@ -116,6 +337,49 @@ class DatastoreService(Service):
         if options is None:
             options = {}
 
+        if options.get('stream') is True and not options.get('count') and not options.get('get'):
+            return self.__stream(name, filters, options)
+
+        extend = options.get('extend')
+        extend_list = options.get('extend_list')
+        select = options.get('select')
+
+        # Extend methods are not cached, they may depend on anything else.
+        # They run over a copy of the cached rows instead.
+        key = json.dumps([
+            name, filters,
+            {k: v for k, v in options.items() if k not in ('extend', 'extend_list')},
+            bool(extend),
+        ], sort_keys=True, default=str)
+        if options.get('extra') or any('__' in i for i in self.__filters_fields(filters)):
+            # Could be reading from any table
+            tables = None
+        else:
+            tables = self.__related_tables(model)
+        hit, result, tag = self.__cache.get(key, tables)
+        if not hit:
+            result = self.__query(model, filters, options)
+            self.__cache.put(key, tag, result)
+
+        if options.get('count') is True:
+            return result
+
+        result = copy.deepcopy(result)
+
+        if extend:
+            result = [self.middleware.call(extend, i) for i in result]
+            # Extend methods may need any field so only project afterwards
+            if select:
+                result = [{k: v for k, v in i.items() if k in select} for i in result]
+
+        if extend_list:
+            result = self.middleware.call(extend_list, result)
+
+        if options.get('get') is True:
+            return result[0]
+        return result
+
+    def __query(self, model, filters, options):
         qs = model.objects.all()
 
         extra = options.get('extra')
@@ -129,16 +393,31 @@ class DatastoreService(Service):
         if order_by:
             qs = qs.order_by(*order_by)
 
+        extend = options.get('extend')
+        select = options.get('select')
+        if options.get('count') is not True:
+            depth = options.get('related_depth')
+            related = self.__related_fields(model, RELATED_DEPTH if depth is None else depth)
+            if select and not extend:
+                qs = qs.only(*select)
+                related = [i for i in related if i.split('__', 1)[0] in select]
+            if related:
+                qs = qs.select_related(*related)
+
+        offset = options.get('offset') or 0
+        limit = options.get('limit')
+        if limit is not None:
+            qs = qs[offset:offset + limit]
+        elif offset:
+            qs = qs[offset:]
+
         if options.get('count') is True:
             return qs.count()
 
-        result = list(self.__queryset_serialize(qs, extend=options.get('extend')))
-
-        if options.get('get') is True:
-            return result[0]
-        return result
+        return list(self.__queryset_serialize(qs, fields=None if extend else select))
 
     @accepts(Str('name'), Ref('query-options'))
+    @threaded()
     def config(self, name, options=None):
         """
         Get configuration settings object for a given `name`.
@@ -151,6 +430,7 @@ class DatastoreService(Service):
         return self.query(name, None, options)
 
     @accepts(Str('name'), Dict('data', additional_attrs=True))
+    @threaded()
     def insert(self, name, data):
         """
         Insert a new entry to `name`.
@@ -160,7 +440,58 @@ class DatastoreService(Service):
         obj.save()
         return obj.pk
 
+    @accepts(Str('name'), List('data', items=[Dict('row', additional_attrs=True)]))
+    @threaded()
+    def bulk_insert(self, name, data):
+        """
+        Insert a list of entries to `name` within a single transaction.
+
+        Returns the list of primary keys of the new entries.
+        """
+        model = self.__get_model(name)
+        pks = []
+        with RemoteBatch(), transaction.atomic():
+            for row in data:
+                obj = model(**row)
+                obj.save()
+                pks.append(obj.pk)
+        return pks
+
+    @accepts(Str('name'), List('data'))
+    @threaded()
+    def bulk_update(self, name, data):
+        """
+        Update many entries of `name` within a single transaction.
+
+        `data` is a list of `[id, {field: value, ...}]` entries.
+
+        Returns the number of entries updated.
+        """
+        model = self.__get_model(name)
+        updated = 0
+        with RemoteBatch(), transaction.atomic():
+            for pk, row in data:
+                updated += model.objects.filter(pk=pk).update(**row)
+        return updated
+
+    @accepts(Str('name'), List('ids'))
+    @threaded()
+    def bulk_delete(self, name, ids):
+        """
+        Delete entries of `name` matching the list of primary keys `ids`
+        within a single transaction.
+
+        Returns the number of entries deleted.
+        """
+        model = self.__get_model(name)
+        with RemoteBatch(), transaction.atomic():
+            qs = model.objects.filter(pk__in=ids)
+            deleted = qs.count()
+            qs.delete()
+        return deleted
+
     @private
+    @threaded()
     def sql(self, query, params=None):
         cursor = connection.cursor()
         rv = None
@@ -1,5 +1,6 @@
-from middlewared.service import Service
+from middlewared.service import Service, job
 
+import functools
 import os
 import sys
 
@@ -7,36 +8,39 @@ if '/usr/local/www' not in sys.path:
     sys.path.append('/usr/local/www')
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'freenasUI.settings')
 
-# Make sure to load all modules
-from django.db.models.loading import cache
-cache.get_apps()
-
-from freenasUI import choices
-from freenasUI import common as fcommon
-from freenasUI.common.freenasldap import (
-    FreeNAS_ActiveDirectory,
-    FreeNAS_LDAP,
-    FLAGS_DBINIT,
-)
-from freenasUI.common.samba import Samba4
-from freenasUI.middleware import zfs
-from freenasUI.middleware.notifier import notifier
-from freenasUI.directoryservice.models import (
-    IDMAP_TYPE_AD,
-    IDMAP_TYPE_ADEX,
-    IDMAP_TYPE_AUTORID,
-    IDMAP_TYPE_HASH,
-    IDMAP_TYPE_LDAP,
-    IDMAP_TYPE_NSS,
-    IDMAP_TYPE_RFC2307,
-    IDMAP_TYPE_RID,
-    IDMAP_TYPE_TDB,
-    IDMAP_TYPE_TDB2,
-    DS_TYPE_CIFS,
-)
-from freenasUI.directoryservice.utils import get_idmap_object
-
-from middlewared.utils import django_modelobj_serialize
+from middlewared.utils import LazyImport, django_modelobj_serialize
+
+# freenasUI modules (notifier alone is thousands of lines, pulling in the
+# LDAP and Samba stacks) are imported on first use to start up faster.
+choices = LazyImport('freenasUI.choices')
+fcommon = LazyImport('freenasUI.common')
+freenasldap = LazyImport('freenasUI.common.freenasldap')
+Samba4 = LazyImport('freenasUI.common.samba', 'Samba4')
+zfs = LazyImport('freenasUI.middleware.zfs')
+notifier = LazyImport('freenasUI.middleware.notifier', 'notifier')
+dsmodels = LazyImport('freenasUI.directoryservice.models')
+get_idmap_object = LazyImport('freenasUI.directoryservice.utils', 'get_idmap_object')
+
+
+# Notifier methods changing ZFS state along with the position of the
+# argument naming what they change, to invalidate the ZFS state cache.
+ZFS_MUTATIONS = {
+    'create_zfs_dataset': 0,
+    'create_zfs_vol': 0,
+    'destroy_zfs_dataset': 0,
+    'destroy_zfs_vol': 0,
+    'rollback_zfs_snapshot': 0,
+    'zfs_clonesnap': 1,
+    'zfs_import': 0,
+    'zfs_inherit_option': 0,
+    'zfs_mksnap': 0,
+    'zfs_set_option': 0,
+    'zfs_set_options': 0,
+    'zfs_set_options_many': None,
+    'zfs_volume_attach_group': None,
+    'zpool_upgrade': 0,
+    'volume_detach': None,
+}
 
 
 class NotifierService(Service):
@@ -50,13 +54,64 @@ class NotifierService(Service):
 
     class Config:
         private = True
+        # Pretty much everything in notifier blocks (subprocesses, sqlite)
+        thread_pool = 'default'
 
     def __getattr__(self, attr):
         _n = notifier()
         try:
             return object.__getattribute__(self, attr)
         except AttributeError:
-            return getattr(_n, attr)
+            method = getattr(_n, attr)
+            if attr in ZFS_MUTATIONS:
+                return self.__zfs_mutation(method, ZFS_MUTATIONS[attr])
+            return method
+
+    def __zfs_mutation(self, method, index):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                # Whole cache when it is not known what changed
+                name = None
+                if index is not None and len(args) > index:
+                    name = args[index]
+                self.middleware.call('zfs.invalidate', name)
+        return wrapper
+
+    def _service_action(self, action, what):
+        """Run a service action and let subscribers know its new state."""
+        started = getattr(notifier(), action)(what)
+        self.middleware.send_event('service', 'CHANGED', id=what, fields={
+            'service': what,
+            'action': action,
+            'state': 'RUNNING' if started else 'STOPPED',
+        })
+        return started
+
+    def start(self, what):
+        return self._service_action('start', what)
+
+    def stop(self, what):
+        return self._service_action('stop', what)
+
+    def restart(self, what):
+        return self._service_action('restart', what)
+
+    def reload(self, what):
+        return self._service_action('reload', what)
+
+    @job(lock='volume_import', limit=1)
+    def volume_import(self, job, volume_name, volume_id):
+        """Import an unencrypted pool, which can take minutes, as a job."""
+        job.set_progress(0, 'Importing {0}'.format(volume_name))
+        try:
+            volume = notifier().volume_import(volume_name, volume_id)
+        finally:
+            self.middleware.call('zfs.invalidate', volume_name)
+        job.set_progress(100, 'Imported {0}'.format(volume_name))
+        return django_modelobj_serialize(self.middleware, volume)
 
     def system_dataset_create(self, mount=True):
         """Make sure return value is serializable"""
@@ -74,6 +129,10 @@ class NotifierService(Service):
         """Wrapper for zfs.zpool_list"""
         return zfs.zpool_list(name)
 
+    def snapshot_list(self, path=None):
+        """Wrapper for zfs.snapshot_list"""
+        return zfs.snapshot_list(path)
+
     def zfs_list(self, *args):
         """Wrapper to serialize zfs.zfs_list"""
         rv = zfs.zfs_list(*args)
@@ -93,9 +152,9 @@ class NotifierService(Service):
     def directoryservice(self, name):
         """Temporary rapper to serialize DS connectors"""
         if name == 'AD':
-            ds = FreeNAS_ActiveDirectory(flags=FLAGS_DBINIT)
+            ds = freenasldap.FreeNAS_ActiveDirectory(flags=freenasldap.FLAGS_DBINIT)
         elif name == 'LDAP':
-            ds = FreeNAS_LDAP(flags=FLAGS_DBINIT)
+            ds = freenasldap.FreeNAS_LDAP(flags=freenasldap.FLAGS_DBINIT)
         else:
             raise ValueError('Unknown ds name {0}'.format(name))
         data = {}
@@ -116,7 +175,7 @@ class NotifierService(Service):
         obj = get_idmap_object(ds_type, id, idmap_backend)
         data = django_modelobj_serialize(self.middleware, obj)
         # Only these types have SSL
-        if ds_type not in (IDMAP_TYPE_LDAP, IDMAP_TYPE_RFC2307):
+        if ds_type not in (dsmodels.IDMAP_TYPE_LDAP, dsmodels.IDMAP_TYPE_RFC2307):
             return data
         cert = obj.get_certificate()
         if cert:
@@ -130,16 +189,16 @@ class NotifierService(Service):
     def ds_idmap_type_code_to_string(self, code):
         """Temporary wrapper to convert idmap code to string"""
         mapping = {
-            IDMAP_TYPE_AD: 'IDMAP_TYPE_AD',
-            IDMAP_TYPE_ADEX: 'IDMAP_TYPE_ADEX',
-            IDMAP_TYPE_AUTORID: 'IDMAP_TYPE_AUTORID',
-            IDMAP_TYPE_HASH: 'IDMAP_TYPE_HASH',
-            IDMAP_TYPE_LDAP: 'IDMAP_TYPE_LDAP',
-            IDMAP_TYPE_NSS: 'IDMAP_TYPE_NSS',
-            IDMAP_TYPE_RFC2307: 'IDMAP_TYPE_RFC2307',
-            IDMAP_TYPE_RID: 'IDMAP_TYPE_RID',
-            IDMAP_TYPE_TDB: 'IDMAP_TYPE_TDB',
-            IDMAP_TYPE_TDB2: 'IDMAP_TYPE_TDB2',
+            dsmodels.IDMAP_TYPE_AD: 'IDMAP_TYPE_AD',
+            dsmodels.IDMAP_TYPE_ADEX: 'IDMAP_TYPE_ADEX',
+            dsmodels.IDMAP_TYPE_AUTORID: 'IDMAP_TYPE_AUTORID',
+            dsmodels.IDMAP_TYPE_HASH: 'IDMAP_TYPE_HASH',
+            dsmodels.IDMAP_TYPE_LDAP: 'IDMAP_TYPE_LDAP',
+            dsmodels.IDMAP_TYPE_NSS: 'IDMAP_TYPE_NSS',
+            dsmodels.IDMAP_TYPE_RFC2307: 'IDMAP_TYPE_RFC2307',
+            dsmodels.IDMAP_TYPE_RID: 'IDMAP_TYPE_RID',
+            dsmodels.IDMAP_TYPE_TDB: 'IDMAP_TYPE_TDB',
+            dsmodels.IDMAP_TYPE_TDB2: 'IDMAP_TYPE_TDB2',
         }
         if code not in mapping:
             raise ValueError('Unknown idmap code: {0}'.format(code))
@@ -0,0 +1,190 @@
+from collections import defaultdict
+from gevent.monkey import get_original
+from middlewared.event import EventSource
+from middlewared.schema import accepts, Bool, List, Str
+from middlewared.service import Service, private
+
+import gevent
+import subprocess
+import time
+
+# Seconds ZFS state is cached for, covering changes made outside middlewared
+ZFS_CACHE_TTL = 60
+
+
+def zfs_scope(name):
+    """Pool of a dataset, volume or snapshot name."""
+    return name.split('/', 1)[0].split('@', 1)[0]
+
+
+class ZFSStateCache(object):
+    """
+    Cache of ZFS state (pools, datasets, properties, snapshots) where
+    every entry belongs to a pool, or to no pool (None) for state spanning
+    all of them.
+
+    Entries expire after `ttl` seconds. Changing a pool through middlewared
+    drops its entries along with the ones spanning all pools, entries of
+    other pools are kept.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = {}
+        self._epoch = 0
+        self._generations = defaultdict(int)
+        # Invalidated from worker threads running notifier methods
+        self._lock = get_original('thread', 'allocate_lock')()
+
+    def get(self, scope, key):
+        """Returns (hit, value, tag), `tag` must be given back to `put`."""
+        with self._lock:
+            tag = (self._epoch, self._generations[scope])
+            entry = self._entries.get((scope, key))
+            if entry is not None and entry[0] == tag and entry[1] > time.time():
+                self.hits += 1
+                return True, entry[2], tag
+            self.misses += 1
+            return False, None, tag
+
+    def put(self, scope, key, tag, value):
+        with self._lock:
+            # Changed while being fetched, it could be outdated already
+            if tag != (self._epoch, self._generations[scope]):
+                return
+            self._entries[(scope, key)] = (tag, time.time() + self.ttl, value)
+
+    def invalidate(self, scope=None):
+        with self._lock:
+            self.invalidations += 1
+            if scope is None:
+                self._epoch += 1
+                self._entries.clear()
+                return
+            self._generations[scope] += 1
+            self._generations[None] += 1
+            for i in list(self._entries):
+                if i[0] in (scope, None):
+                    self._entries.pop(i)
+
+    def stats(self):
+        return {
+            'ttl': self.ttl,
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+class ZFSService(Service):
+    """
+    ZFS state served from a cache instead of running zfs(8)/zpool(8) on
+    every call. Returned values are shared with the cache, do not modify.
+
+    Changes made through the notifier service are seen right away, the
+    ones made outside middlewared (GUI, zfs(8)) after ZFS_CACHE_TTL seconds
+    at most. Callers needing them sooner should `zfs.invalidate` first.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ZFSService, self).__init__(*args, **kwargs)
+        self.__cache = ZFSStateCache(ZFS_CACHE_TTL)
+        self.middleware.add_stats('zfs.cache', self.__cache.stats)
+
+    def __cached(self, scope, key, fetch):
+        hit, value, tag = self.__cache.get(scope, key)
+        if not hit:
+            value = fetch()
+            self.__cache.put(scope, key, tag, value)
+        return value
+
+    @accepts()
+    def pool_list(self):
+        """Returns size, alloc, free and capacity of every pool."""
+        return self.__cached(None, 'pools', lambda: self.middleware.call('notifier.zpool_list'))
+
+    @accepts(Str('pool'))
+    def dataset_list(self, pool=None):
+        """Returns the tree of datasets and volumes of `pool`, or of every pool."""
+        if pool is None:
+            datasets = {}
+            for name in self.pool_list():
+                datasets.update(self.dataset_list(name))
+            return datasets
+        return self.__cached(pool, 'datasets', lambda: self.middleware.call(
+            'notifier.zfs_list', pool, True, True, True,
+        ))
+
+    @accepts()
+    def volume_list(self):
+        """Returns every volume (zvol) keyed by name, with its volsize."""
+        return self.__cached(None, 'volumes', lambda: self.middleware.call(
+            'notifier.zfs_list', '', True, False, False, ['volume'],
+        ))
+
+    @accepts(Str('name'), Bool('recursive'), List('props'))
+    def get_properties(self, name, recursive=False, props=None):
+        """Returns properties of dataset `name` in the format of notifier.zfs_get_options."""
+        key = ('properties', name, recursive, tuple(props) if props else None)
+        return self.__cached(zfs_scope(name), key, lambda: self.middleware.call(
+            'notifier.zfs_get_options', name, recursive, props,
+        ))
+
+    @accepts(Str('pool'))
+    def snapshot_list(self, pool=None):
+        """Returns snapshots of `pool`, or of every pool, most recent first,
+        in the format of freenasUI.middleware.zfs.snapshot_list."""
+        return self.__cached(pool, 'snapshots', lambda: self.middleware.call(
+            'notifier.snapshot_list', pool,
+        ))
+
+    @private
+    def invalidate(self, name=None):
+        """Drop cached state of the pool of `name` (dataset, volume or
+        snapshot), of every pool if not given."""
+        self.__cache.invalidate(zfs_scope(name) if name else None)
+
+
+class PoolStateEventSource(EventSource):
+    """
+    Sends pools imported (ADDED), exported (REMOVED) or having their
+    health changed (CHANGED), polled once for every subscriber.
+    """
+
+    interval = 10
+
+    def get_pools(self):
+        # subprocess is cooperative under gevent monkey patching
+        proc = subprocess.Popen(
+            ['/sbin/zpool', 'list', '-H', '-o', 'name,health'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        output = proc.communicate()[0]
+        pools = {}
+        for line in output.strip().splitlines():
+            name, health = line.split('\t')
+            pools[name] = {'name': name, 'health': health}
+        return pools
+
+    def run(self):
+        pools = {}
+        while True:
+            new = self.get_pools()
+            for name, pool in new.items():
+                if name not in pools:
+                    self.send_event('ADDED', id=name, fields=pool)
+                elif pools[name] != pool:
+                    self.send_event('CHANGED', id=name, fields=pool)
+            for name in set(pools) - set(new):
+                self.send_event('REMOVED', id=name)
+            pools = new
+            gevent.sleep(self.interval)
+
+
+def setup(middleware):
+    middleware.register_event_source('zfs.pool', PoolStateEventSource)
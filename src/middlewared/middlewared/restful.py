@@ -3,7 +3,22 @@ from datetime import datetime
 import base64
 import binascii
 import falcon
+import hashlib
 import json
+import types
+import zlib
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+# Lists with more items than this are streamed using chunked encoding
+STREAM_MIN_ITEMS = 1000
+# Approximate size of the streamed chunks
+STREAM_CHUNK_SIZE = 65536
+# zlib window bits of each supported content coding
+CONTENT_ENCODINGS = (
+    ('gzip', 16 + zlib.MAX_WBITS),
+    ('deflate', zlib.MAX_WBITS),
+)
 
 
 class JsonEncoder(json.JSONEncoder):
@@ -37,8 +52,147 @@ class JSONTranslator(object):
             )
 
     def process_response(self, req, resp, resource):
-        if 'result' in req.context:
-            resp.body = JsonEncoder(indent=True).encode(req.context['result'])
+        if 'result' not in req.context:
+            return
+        result = req.context['result']
+
+        # Compact unless asked otherwise, e.g. ?pretty=true
+        if req.get_param_as_bool('pretty'):
+            encoder = JsonEncoder(indent=True)
+        else:
+            encoder = JsonEncoder(separators=(',', ':'))
+
+        encoding = self.content_encoding(req)
+        resp.append_header('Vary', 'Accept-Encoding')
+
+        if isinstance(result, types.GeneratorType):
+            # Sent as it gets produced, without Content-Length so chunked.
+            # Neither ETag nor error status can be known before, a failure
+            # closes the connection without the last chunk so clients see
+            # an incomplete response.
+            if encoding:
+                resp.set_header('Content-Encoding', encoding[0])
+            resp.stream = self.stream(encoder, result, encoding)
+            return
+
+        if isinstance(result, list) and len(result) > STREAM_MIN_ITEMS:
+            # Compressed as it gets encoded so the whole encoded body is
+            # never held in memory, the ETag is computed along the way.
+            digest = hashlib.sha1()
+            body = ''.join(self.stream(encoder, result, encoding, digest))
+            if self.not_modified(req, resp, digest):
+                return
+            if encoding:
+                resp.set_header('Content-Encoding', encoding[0])
+            resp.body = body
+            return
+
+        body = encoder.encode(result)
+
+        if self.not_modified(req, resp, hashlib.sha1(body)):
+            return
+
+        if encoding and len(body) >= COMPRESS_MIN_SIZE:
+            compress = zlib.compressobj(6, zlib.DEFLATED, encoding[1])
+            body = compress.compress(body) + compress.flush()
+            resp.set_header('Content-Encoding', encoding[0])
+        resp.body = body
+
+    def content_encoding(self, req):
+        """Pick the content coding (name, wbits) to use from Accept-Encoding."""
+        accepted = {}
+        for i in (req.get_header('Accept-Encoding') or '').split(','):
+            coding, _, params = i.strip().partition(';')
+            qvalue = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    qvalue = float(params[2:])
+                except ValueError:
+                    continue
+            accepted[coding.strip().lower()] = qvalue
+        for name, wbits in CONTENT_ENCODINGS:
+            if accepted.get(name, 0) > 0:
+                return name, wbits
+        return None
+
+    def not_modified(self, req, resp, digest):
+        """
+        Set the ETag of GET responses from the `digest` of the body,
+        answering 304 if it matches If-None-Match.
+        """
+        if req.method != 'GET':
+            return False
+        # Weak as it is the same regardless of the content coding
+        etag = 'W/"{0}"'.format(digest.hexdigest())
+        resp.set_header('ETag', etag)
+        if self.etag_matches(req, etag):
+            resp.status = falcon.HTTP_304
+            return True
+        return False
+
+    def etag_matches(self, req, etag):
+        header = req.get_header('If-None-Match')
+        if not header:
+            return False
+        if header.strip() == '*':
+            return True
+
+        # If-None-Match uses the weak comparison
+        def strip(tag):
+            tag = tag.strip()
+            return tag[2:] if tag.startswith('W/') else tag
+        return strip(etag) in [strip(i) for i in header.split(',')]
+
+    def stream(self, encoder, result, encoding, digest=None):
+        """
+        Encode `result` in chunks of about STREAM_CHUNK_SIZE, compressed
+        with `encoding`. `digest` is updated with the uncompressed body.
+        """
+        if encoding:
+            compress = zlib.compressobj(6, zlib.DEFLATED, encoding[1])
+        else:
+            compress = None
+
+        def fragments():
+            if isinstance(result, types.GeneratorType):
+                # Streamed methods yield chunks (lists) of items
+                yield '['
+                first = True
+                for chunk in result:
+                    for item in chunk:
+                        if not first:
+                            yield ','
+                        first = False
+                        for i in encoder.iterencode(item):
+                            yield i
+                yield ']'
+            else:
+                for i in encoder.iterencode(result):
+                    yield i
+
+        buf = []
+        size = 0
+        for fragment in fragments():
+            buf.append(fragment)
+            size += len(fragment)
+            if size >= STREAM_CHUNK_SIZE:
+                data = ''.join(buf)
+                buf = []
+                size = 0
+                if digest is not None:
+                    digest.update(data)
+                if compress:
+                    data = compress.compress(data)
+                if data:
+                    yield data
+        data = ''.join(buf)
+        if digest is not None:
+            digest.update(data)
+        if compress:
+            data = compress.compress(data) + compress.flush()
+        if data:
+            yield data
 
 
 class AuthMiddleware(object):
@@ -52,11 +206,21 @@ class AuthMiddleware(object):
             return
 
         auth = req.get_header("Authorization")
+        if auth is not None and auth.startswith('Token '):
+            # Session token generated by auth.generate_token
+            if not self.middleware.call('auth.check_token', auth[6:].strip()):
+                raise falcon.HTTPUnauthorized(
+                    'Invalid token',
+                    'Token is invalid, expired or has been revoked.',
+                    ['Token', 'Basic realm="FreeNAS"'],
+                )
+            return
+
         if auth is None or not auth.startswith('Basic '):
             raise falcon.HTTPUnauthorized(
                 'Authorization token required',
-                'Provide a Basic Authentication header',
-                ['Basic realm="FreeNAS"'],
+                'Provide a Basic Authentication or Token header',
+                ['Token', 'Basic realm="FreeNAS"'],
             )
         try:
             username, password = base64.b64decode(auth[6:]).decode('utf8').split(':', 1)
@@ -202,6 +366,8 @@ class Resource(object):
 
         method = getattr(self, http_method)
         if http_method in ('delete', 'get'):
-            req.context['result'] = self.middleware.call(method)
+            result = self.middleware.call(method)
         else:
-            req.context['result'] = self.middleware.call(method, *req.context['doc'])
+            result = self.middleware.call(method, *req.context['doc'])
+        # Generators (streamed results) are consumed as the response is sent
+        req.context['result'] = result
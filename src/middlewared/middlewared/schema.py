@@ -43,6 +43,15 @@ class Attribute(object):
     def clean(self, value):
         return value
 
+    def compile(self):
+        """
+        Return a callable validating and cleaning a value, equivalent to
+        `clean`. Container attributes override it to precompute everything
+        that does not depend on the value, so it must be called once the
+        schema is resolved.
+        """
+        return self.clean
+
     def to_json_schema(self):
         """This method should return the json-schema v4 equivalent for the
         given attribute.
@@ -114,6 +123,8 @@ class Bool(Attribute):
 class Int(Attribute):
 
     def clean(self, value):
+        if value is None and not self.required:
+            return self.default
         if not isinstance(value, int):
             if isinstance(value, str) and value.isdigit():
                 return int(value)
@@ -162,6 +173,33 @@ class List(EnumMixin, Attribute):
             schema['enum'] = self.enum
         return schema
 
+    def compile(self):
+        enum_clean = super(List, self).clean
+        items = [i.compile() for i in self.items]
+        name = self.name
+        required = self.required
+        default = self.default
+
+        def clean(value):
+            value = enum_clean(value)
+            if value is None and not required:
+                return default
+            if not isinstance(value, list):
+                raise Error(name, 'Not a list')
+            if items:
+                for index, v in enumerate(value):
+                    for i in items:
+                        try:
+                            value[index] = i(v)
+                            found = True
+                        except Error as e:
+                            found = e
+                            break
+                    if found is not True:
+                        raise Error(name, 'Item#{0} is not valid per list types: {1}'.format(index, found))
+            return value
+        return clean
+
     def resolve(self, middleware):
         for index, i in enumerate(self.items):
             self.items[index] = i.resolve(middleware)
@@ -213,6 +251,42 @@ class Dict(Attribute):
 
         return data
 
+    def compile(self):
+        attrs = {name: attr.compile() for name, attr in self.attrs.items()}
+        required_attrs = [name for name, attr in self.attrs.items() if attr.required]
+        defaults = [(name, attr.default) for name, attr in self.attrs.items()]
+        additional_attrs = self.additional_attrs
+        update = self.update
+        required = self.required
+        name = self.name
+
+        def clean(data):
+            if data is None and not required:
+                return {}
+
+            if not isinstance(data, dict):
+                raise Error(name, 'A dict was expected')
+
+            for key, value in data.items():
+                attr = attrs.get(key)
+                if attr is None:
+                    if not additional_attrs:
+                        raise Error(key, 'Field was not expected')
+                    continue
+                data[key] = attr(value)
+
+            # Do not make any field and required and not populate default values
+            if not update:
+                for i in required_attrs:
+                    if i not in data:
+                        raise Error(i, 'This field is required')
+                for i, default in defaults:
+                    if i not in data:
+                        data[i] = default
+
+            return data
+        return clean
+
     def to_json_schema(self):
         schema = {
             'type': 'object',
@@ -246,10 +320,11 @@ class Ref(object):
 
 class Patch(object):
 
-    def __init__(self, name, newname, *patches):
+    def __init__(self, name, newname, *patches, **kwargs):
         self.name = name
         self.newname = newname
         self.patches = patches
+        self.register = kwargs.pop('register', False)
 
     def convert(self, spec):
         t = spec.pop('type')
@@ -303,29 +378,126 @@ def resolver(middleware, f):
     f.accepts.extend(new_params)
 
 
+def compile_validators(f):
+    """Compile the validators of an already resolved method."""
+    del f.validators[:]
+    f.validators.extend([p.compile() for p in f.accepts])
+
+
+def clean_params(f, params):
+    """
+    Validate positional `params` of a method decorated with accepts,
+    returns the cleaned values.
+    """
+    validators = f.validators or [i.clean for i in f.accepts]
+    return [validators[i](param) for i, param in enumerate(params)]
+
+
+def schema_dependencies(p, provides, requires):
+    """
+    Gather names of the schemas registered (`provides`) and referenced
+    (`requires`) by a parameter definition.
+    """
+    if isinstance(p, Ref):
+        requires.add(p.name)
+    elif isinstance(p, Patch):
+        requires.add(p.name)
+        if p.register:
+            provides.add(p.newname)
+    elif isinstance(p, Attribute):
+        if isinstance(p, Dict):
+            for attr in p.attrs.values():
+                schema_dependencies(attr, provides, requires)
+        elif isinstance(p, List):
+            for attr in p.items:
+                schema_dependencies(attr, provides, requires)
+        if p.register:
+            provides.add(p.name)
+    else:
+        raise ValueError('Invalid parameter definition {0}'.format(p))
+
+
+def resolve_methods(middleware, methods):
+    """
+    Resolve params of every method in a single pass, ordered so that
+    methods registering a schema are resolved before the ones referencing it.
+    Validators are compiled as soon as a method is resolved.
+    """
+    pending = []
+    providers = {}
+    seen = set()
+    for method in methods:
+        if not callable(method) or not hasattr(method, 'accepts'):
+            continue
+        # Same function may be reached from more than one service
+        if id(method.accepts) in seen:
+            continue
+        seen.add(id(method.accepts))
+        provides, requires = set(), set()
+        for p in method.accepts:
+            schema_dependencies(p, provides, requires)
+        # Schemas registered by the method itself are resolved in order
+        requires -= provides
+        for name in provides:
+            providers[name] = method
+        pending.append((method, requires))
+
+    dependents = {}
+    ready = []
+    remaining = {}
+    for method, requires in pending:
+        deps = set()
+        for name in requires:
+            if name not in providers:
+                raise ValueError('Schema {0} does not exist'.format(name))
+            deps.add(id(providers[name].accepts))
+        for dep in deps:
+            dependents.setdefault(dep, []).append(method)
+        remaining[id(method.accepts)] = len(deps)
+        if not deps:
+            ready.append(method)
+
+    resolved = 0
+    while ready:
+        method = ready.pop()
+        resolver(middleware, method)
+        compile_validators(method)
+        resolved += 1
+        for dependent in dependents.get(id(method.accepts), []):
+            remaining[id(dependent.accepts)] -= 1
+            if remaining[id(dependent.accepts)] == 0:
+                ready.append(dependent)
+
+    if resolved != len(pending):
+        raise ValueError('Not all could be resolved, circular schema references')
+
+
 def accepts(*schema):
     def wrap(f):
         # Make sure number of schemas is same as method argument
+        args_index = 1
         if hasattr(f, '_pass_app'):
-            args_index = 2
-        else:
-            args_index = 1
+            args_index += 1
+        if hasattr(f, '_job'):
+            args_index += 1
         assert len(schema) == f.__code__.co_argcount - args_index  # -1 for self
 
         def nf(*args, **kwargs):
             args = list(args)
+            # Use validators compiled at load time if available
+            validators = nf.validators or [i.clean for i in nf.accepts]
 
             # Iterate over positional args first, excluding self
             i = 0
             for arg in args[args_index:]:
-                args[i + args_index] = nf.accepts[i].clean(args[i + args_index])
+                args[i + args_index] = validators[i](args[i + args_index])
                 i += 1
 
             # Use i counter to map keyword argument to rpc positional
             for x in list(range(i + 1, f.__code__.co_argcount)):
                 kwarg = f.__code__.co_varnames[x]
                 if kwarg in kwargs:
-                    kwargs[kwarg] = nf.accepts[i].clean(kwargs[kwarg])
+                    kwargs[kwarg] = validators[i](kwargs[kwarg])
                 i += 1
             return f(*args, **kwargs)
         nf.__name__ = f.__name__
@@ -338,6 +510,7 @@ def accepts(*schema):
             if i.startswith('_'):
                 setattr(nf, i, getattr(f, i))
         nf.accepts = list(schema)
+        nf.validators = []
 
         return nf
     return wrap
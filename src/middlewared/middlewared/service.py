@@ -1,9 +1,16 @@
 from collections import defaultdict
+from gevent.pool import Pool
 
+import hashlib
 import inspect
+import itertools
+import json
 import re
+import sys
+import traceback
+import types
 
-from middlewared.schema import accepts, Str
+from middlewared.schema import accepts, Bool, Int, List, Str
 
 
 def item_method(fn):
@@ -14,6 +21,19 @@ def item_method(fn):
     return fn
 
 
+def job(lock=None, limit=None):
+    """Flag method as a long running job.
+    Calling it returns a job id right away, the method runs in background
+    receiving the `Job` object as first argument to report its progress.
+
+    Jobs sharing the same `lock` (default is the method name) run at most
+    `limit` at a time, others wait in a FIFO queue."""
+    def wrap(fn):
+        fn._job = {'lock': lock, 'limit': limit}
+        return fn
+    return wrap
+
+
 def no_auth_required(fn):
     """Authentication is not required to use the given method."""
     fn._no_auth_required = True
@@ -32,6 +52,16 @@ def private(fn):
     return fn
 
 
+def threaded(pool='default'):
+    """Run method in a thread of the worker pool `pool`.
+    Use it for methods that block, e.g. subprocesses or database access,
+    so they do not stall every other client of the event loop."""
+    def wrap(fn):
+        fn._thread_pool = pool
+        return fn
+    return wrap
+
+
 class ServiceBase(type):
 
     def __new__(cls, name, bases, attrs):
@@ -50,6 +80,7 @@ class ServiceBase(type):
         config_attrs = {
             'namespace': namespace,
             'private': False,
+            'thread_pool': None,
         }
         if config:
             config_attrs.update({
@@ -94,6 +125,12 @@ class CRUDService(Service):
 
 class CoreService(Service):
 
+    def __init__(self, *args, **kwargs):
+        super(CoreService, self).__init__(*args, **kwargs)
+        self.__methods = {}
+        self.__methods_all = {}
+        self.__methods_etag = None
+
     @accepts()
     def get_services(self):
         """Returns a list of all registered services."""
@@ -113,16 +150,110 @@ class CoreService(Service):
             }
         return services
 
-    @accepts(Str('service'))
-    def get_methods(self, service=None):
-        """Return methods metadata of every available service.
+    @accepts()
+    def get_pools(self):
+        """Returns usage and queue depth of every worker pool."""
+        return {
+            name: pool.stats()
+            for name, pool in self.middleware.get_pools().items()
+        }
 
-        `service` parameter is optional and filters the result for a single service."""
-        data = {}
+    @accepts()
+    def get_stats(self):
+        """Returns runtime statistics, e.g. per method call counts and latency
+        percentiles (in seconds) under `methods`, cache usage."""
+        return self.middleware.get_stats()
+
+    @accepts(Int('id'))
+    def get_jobs(self, id=None):
+        """Returns the list of jobs, running, waiting or recently finished.
+
+        `id` parameter is optional and filters the result for a single job."""
+        jobs = self.middleware.get_jobs()
+        return [
+            job.to_dict() for job in jobs.all()
+            if id is None or job.id == id
+        ]
+
+    @accepts(Int('id'))
+    def job_abort(self, id):
+        """Abort a waiting or running job."""
+        return self.middleware.get_jobs().abort(id)
+
+    @accepts(Str('method'), Int('count'))
+    def profile(self, method, count=1):
+        """Capture a cProfile of the next `count` invocations of `method`.
+
+        The report is retrieved with `core.get_profile`."""
+        self.middleware.get_profiler().start(method, count or 1)
+        return True
+
+    @accepts(Str('method'))
+    def get_profile(self, method):
+        """Returns the cProfile report gathered for `method` after calling `core.profile`."""
+        return self.middleware.get_profiler().report(method)
+
+    @accepts(List('calls'), Bool('parallel'))
+    def batch(self, calls, parallel=False):
+        """Execute many method calls in a single request.
+
+        `calls` is a list of `[method, params]` entries. Results are returned
+        in the same order, each one being either `{"result": value}` or
+        `{"error": {"error": message, "stacktrace": stacktrace}}`.
+        A failing call does not abort the others.
+
+        If `parallel` is true calls are executed concurrently.
+
+        .. examples(websocket)::
+
+          Query two collections in one round-trip:
+
+            :::javascript
+            {
+              "id": "6841f242-840a-11e6-a437-00e04d680384",
+              "msg": "method",
+              "method": "core.batch",
+              "params": [[
+                ["datastore.query", ["services.iSCSITargetPortal"]],
+                ["datastore.query", ["services.iSCSITargetExtent"]]
+              ], true]
+            }
+        """
+        def run(call):
+            try:
+                if not isinstance(call, (list, tuple)) or len(call) not in (1, 2):
+                    raise ValueError('Invalid call entry: {0}'.format(call))
+                method = call[0]
+                params = call[1] if len(call) == 2 else None
+                service, attr = method.rsplit('.', 1)
+                methodobj = getattr(self.middleware.get_service(service), attr)
+                if hasattr(methodobj, '_pass_app'):
+                    raise ValueError('Method {0} cannot be called in a batch'.format(method))
+                result = self.middleware.call(method, *(params or []))
+                if isinstance(result, types.GeneratorType):
+                    result = list(itertools.chain.from_iterable(result))
+                return {'result': result}
+            except Exception as e:
+                return {'error': {
+                    'error': str(e),
+                    'stacktrace': ''.join(traceback.format_exception(*sys.exc_info())),
+                }}
+
+        if parallel:
+            return Pool(self.middleware.concurrent_calls).map(run, calls)
+        return [run(call) for call in calls]
+
+    @private
+    def build_methods(self):
+        """
+        Build the metadata catalogue of every public method, json-schema
+        of params included, so `get_methods` does not have to introspect
+        every service on each call.
+
+        Called once all plugins are loaded (and should any be reloaded).
+        """
+        methods = defaultdict(dict)
         for name, svc in list(self.middleware.get_services().items()):
-            if service is not None and name != service:
-                continue
-
             for attr in dir(svc):
                 if attr.startswith('_'):
                     continue
@@ -164,10 +295,32 @@ class CoreService(Service):
                 if accepts:
                     accepts = [i.to_json_schema() for i in accepts]
 
-                data['{0}.{1}'.format(name, attr)] = {
+                methods[name]['{0}.{1}'.format(name, attr)] = {
                     'description': doc,
                     'examples': examples,
                     'accepts': accepts,
                     'item_method': hasattr(method, '_item_method'),
                 }
-        return data
+
+        self.__methods = dict(methods)
+        self.__methods_all = {}
+        for data in self.__methods.values():
+            self.__methods_all.update(data)
+        self.__methods_etag = hashlib.sha1(
+            json.dumps(self.__methods_all, sort_keys=True, default=str)
+        ).hexdigest()
+
+    @accepts()
+    def get_methods_etag(self):
+        """Returns a tag of the methods metadata which only changes when
+        `get_methods` result does, for clients to know their copy is current."""
+        return self.__methods_etag
+
+    @accepts(Str('service'))
+    def get_methods(self, service=None):
+        """Return methods metadata of every available service.
+
+        `service` parameter is optional and filters the result for a single service."""
+        if service is not None:
+            return self.__methods.get(service, {})
+        return self.__methods_all
@@ -0,0 +1,96 @@
+#!/usr/local/bin/python
+"""
+Compare the cost of encoding/decoding middlewared messages using each of
+the supported encodings.
+
+Payloads are recorded from a running middlewared first:
+
+    encoding.py record -o payloads.json notifier.zfs_list datastore.query:'["storage.volume"]'
+
+and then benchmarked:
+
+    encoding.py run payloads.json
+"""
+from __future__ import print_function
+
+from middlewared.client import Client
+from middlewared.client.protocol import ENCODINGS, decode, encode
+
+import argparse
+import json
+import sys
+import timeit
+
+
+def record(args):
+    payloads = []
+    with Client(uri=args.uri) as c:
+        if args.username and args.password:
+            if not c.call('auth.login', args.username, args.password):
+                raise ValueError('Invalid username or password')
+        for i in args.methods:
+            method, sep, params = i.partition(':')
+            params = json.loads(params) if sep else []
+            payloads.append({
+                'method': i,
+                # Benchmark the whole result message as sent over the wire
+                'message': {
+                    'msg': 'result',
+                    'id': '00000000-0000-0000-0000-000000000000',
+                    'result': c.call(method, *params),
+                },
+            })
+    with open(args.output, 'w') as f:
+        json.dump(payloads, f)
+
+
+def run(args):
+    with open(args.payloads) as f:
+        payloads = json.load(f)
+
+    print('{0:<40} {1:<8} {2:>10} {3:>12} {4:>12}'.format(
+        'method', 'encoding', 'size', 'encode (ms)', 'decode (ms)',
+    ))
+    for payload in payloads:
+        message = payload['message']
+        for encoding in ENCODINGS:
+            data = encode(message, encoding)
+            encode_time = min(timeit.repeat(
+                lambda: encode(message, encoding), repeat=3, number=args.number,
+            )) / args.number
+            decode_time = min(timeit.repeat(
+                lambda: decode(data, encoding), repeat=3, number=args.number,
+            )) / args.number
+            print('{0:<40} {1:<8} {2:>10} {3:>12.3f} {4:>12.3f}'.format(
+                payload['method'][:40], encoding, len(data), encode_time * 1000, decode_time * 1000,
+            ))
+    if 'msgpack' not in ENCODINGS:
+        print('msgpack is not installed, only json was benchmarked', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='name')
+
+    iparser = subparsers.add_parser('record', help='Record payloads from middlewared')
+    iparser.add_argument('-u', '--uri')
+    iparser.add_argument('-U', '--username')
+    iparser.add_argument('-P', '--password')
+    iparser.add_argument('-o', '--output', required=True)
+    iparser.add_argument('methods', nargs='+', help='method[:json list of params]')
+
+    iparser = subparsers.add_parser('run', help='Benchmark recorded payloads')
+    iparser.add_argument('-n', '--number', type=int, default=100)
+    iparser.add_argument('payloads')
+
+    args = parser.parse_args()
+    if args.name == 'record':
+        record(args)
+    elif args.name == 'run':
+        run(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
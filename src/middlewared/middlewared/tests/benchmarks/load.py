@@ -0,0 +1,267 @@
+#!/usr/local/bin/python
+"""
+Load test of middlewared.
+
+A middlewared with stubbed datastore and notifier backends (see plugins/)
+is started in a separate process and driven by concurrent websocket and
+REST clients through a mix of calls. Throughput and p50/p99 latency of
+every call are reported, and can be saved as a baseline to compare later
+runs against:
+
+    load.py run -w 20 -r 5 -d 30 --save before
+    load.py run -w 20 -r 5 -d 30 --compare before
+"""
+from __future__ import print_function
+
+from gevent import monkey
+monkey.patch_all()
+
+from collections import defaultdict
+
+import argparse
+import gevent
+import json
+import os
+import random
+import requests
+import socket
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, 'baselines')
+PLUGINS_DIR = os.path.join(BENCHMARKS_DIR, 'plugins')
+
+# Password of root in the stubbed datastore
+ROOT_PASSWORD = 'benchmark'
+
+# (weight, method, params) of the calls made by websocket clients
+WEBSOCKET_MIX = (
+    (60, 'datastore.query', ['storage.volume']),
+    (30, 'notifier.zfs_list', []),
+    (10, 'auth.login', ['root', ROOT_PASSWORD]),
+)
+# (weight, path) of the requests made by REST clients
+REST_MIX = (
+    (60, 'bench'),
+    (30, 'bench/zfs_list'),
+    (10, 'auth/generate_token'),
+)
+
+
+def choose(mix):
+    n = random.randint(1, sum(i[0] for i in mix))
+    for entry in mix:
+        n -= entry[0]
+        if n <= 0:
+            return entry[1:]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def serve(args):
+    from collections import OrderedDict
+    from geventwebsocket import Resource, WebSocketServer
+    from gevent.wsgi import WSGIServer
+    from middlewared.main import Application, Middleware
+    from middlewared.restful import RESTfulAPI
+
+    middleware = Middleware(
+        thread_pool_size=args.threads,
+        concurrent_calls=args.concurrent_calls,
+        plugins_dirs=[PLUGINS_DIR],
+    )
+    Application.middleware = middleware
+    Application.concurrent_calls = middleware.concurrent_calls
+    wsserver = WebSocketServer(('127.0.0.1', args.ws_port), Resource(OrderedDict([
+        ('/websocket', Application),
+    ])))
+    restserver = WSGIServer(('127.0.0.1', args.rest_port), RESTfulAPI(middleware).get_app(), log=None)
+    gevent.joinall([
+        gevent.spawn(wsserver.serve_forever),
+        gevent.spawn(restserver.serve_forever),
+    ])
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.2)
+    raise RuntimeError('Server did not start listening on port {0}'.format(port))
+
+
+def websocket_client(args, deadline, latencies, errors):
+    from middlewared.client import Client
+
+    with Client(uri='ws://127.0.0.1:{0}/websocket'.format(args.ws_port)) as c:
+        c.call('auth.login', 'root', ROOT_PASSWORD)
+        while time.time() < deadline:
+            method, params = choose(WEBSOCKET_MIX)
+            key = 'websocket {0}'.format(method)
+            start = time.time()
+            try:
+                c.call(method, *params)
+            except Exception:
+                errors[key] += 1
+            latencies[key].append(time.time() - start)
+
+
+def rest_client(args, deadline, latencies, errors):
+    session = requests.Session()
+    session.auth = ('root', ROOT_PASSWORD)
+    while time.time() < deadline:
+        path, = choose(REST_MIX)
+        key = 'rest {0}'.format(path)
+        start = time.time()
+        try:
+            r = session.get('http://127.0.0.1:{0}/api/v2.0/{1}'.format(args.rest_port, path))
+            r.raise_for_status()
+        except Exception:
+            errors[key] += 1
+        latencies[key].append(time.time() - start)
+
+
+def load(args):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    deadline = time.time() + args.duration
+    clients = [
+        gevent.spawn(websocket_client, args, deadline, latencies, errors)
+        for i in range(args.websocket)
+    ] + [
+        gevent.spawn(rest_client, args, deadline, latencies, errors)
+        for i in range(args.rest)
+    ]
+    gevent.joinall(clients)
+    for client in clients:
+        if client.exception is not None:
+            raise client.exception
+
+    results = {
+        'duration': args.duration,
+        'websocket': args.websocket,
+        'rest': args.rest,
+        'calls': {},
+    }
+    everything = []
+    for key, values in latencies.items():
+        values.sort()
+        everything.extend(values)
+        results['calls'][key] = {
+            'calls': len(values),
+            'errors': errors[key],
+            'throughput': len(values) / float(args.duration),
+            'p50': percentile(values, 0.5),
+            'p99': percentile(values, 0.99),
+        }
+    everything.sort()
+    results['calls']['total'] = {
+        'calls': len(everything),
+        'errors': sum(errors.values()),
+        'throughput': len(everything) / float(args.duration),
+        'p50': percentile(everything, 0.5),
+        'p99': percentile(everything, 0.99),
+    }
+    return results
+
+
+def report(results):
+    print('{0:<36} {1:>8} {2:>7} {3:>10} {4:>10} {5:>10}'.format(
+        'call', 'calls', 'errors', 'calls/s', 'p50 (ms)', 'p99 (ms)',
+    ))
+    for key in sorted(results['calls'], key=lambda k: (k == 'total', k)):
+        stats = results['calls'][key]
+        print('{0:<36} {1:>8} {2:>7} {3:>10.1f} {4:>10.2f} {5:>10.2f}'.format(
+            key, stats['calls'], stats['errors'], stats['throughput'],
+            (stats['p50'] or 0) * 1000, (stats['p99'] or 0) * 1000,
+        ))
+
+
+def compare(results, baseline, tolerance):
+    """Report changes against the baseline, returns whether any regressed."""
+    regressed = False
+    print('\n{0:<36} {1:>12} {2:>12}'.format('call', 'calls/s', 'p99'))
+    for key in sorted(baseline['calls'], key=lambda k: (k == 'total', k)):
+        old = baseline['calls'][key]
+        new = results['calls'].get(key)
+        if new is None or not old['throughput'] or not old['p99']:
+            continue
+        throughput = new['throughput'] / old['throughput'] - 1
+        p99 = new['p99'] / old['p99'] - 1
+        flag = ''
+        if throughput < -tolerance or p99 > tolerance:
+            flag = ' REGRESSED'
+            regressed = True
+        print('{0:<36} {1:>+11.1%} {2:>+11.1%}{3}'.format(key, throughput, p99, flag))
+    return regressed
+
+
+def run(args):
+    with open(os.devnull, 'w') as devnull:
+        server = subprocess.Popen([
+            sys.executable, os.path.realpath(__file__), 'serve',
+            '--ws-port', str(args.ws_port),
+            '--rest-port', str(args.rest_port),
+            '--threads', str(args.threads),
+            '--concurrent-calls', str(args.concurrent_calls),
+        ], stdout=devnull)
+    try:
+        wait_for_port(args.ws_port)
+        wait_for_port(args.rest_port)
+        results = load(args)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report(results)
+
+    if args.save:
+        if not os.path.exists(BASELINES_DIR):
+            os.makedirs(BASELINES_DIR)
+        with open(os.path.join(BASELINES_DIR, '{0}.json'.format(args.save)), 'w') as f:
+            json.dump(results, f, indent=True)
+
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, '{0}.json'.format(args.compare))) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='name')
+
+    for name in ('run', 'serve'):
+        iparser = subparsers.add_parser(name)
+        iparser.add_argument('--ws-port', type=int, default=16000)
+        iparser.add_argument('--rest-port', type=int, default=18002)
+        iparser.add_argument('--threads', type=int, default=10, help='Size of the default worker pool')
+        iparser.add_argument('--concurrent-calls', type=int, default=20)
+        if name == 'run':
+            iparser.add_argument('-w', '--websocket', type=int, default=10, help='Websocket clients')
+            iparser.add_argument('-r', '--rest', type=int, default=2, help='REST clients')
+            iparser.add_argument('-d', '--duration', type=int, default=30, help='Seconds')
+            iparser.add_argument('--save', metavar='NAME', help='Save results as baseline NAME')
+            iparser.add_argument('--compare', metavar='NAME', help='Compare results with baseline NAME')
+            iparser.add_argument('--tolerance', type=float, default=0.1,
+                                 help='Relative change considered a regression')
+
+    args = parser.parse_args()
+    if args.name == 'run':
+        run(args)
+    elif args.name == 'serve':
+        serve(args)
+
+
+if __name__ == '__main__':
+    main()
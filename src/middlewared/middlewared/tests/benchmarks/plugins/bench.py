@@ -0,0 +1,17 @@
+"""
+Exposes the stubbed backends through REST, which can only issue GET
+requests without params.
+"""
+from middlewared.schema import accepts
+from middlewared.service import CRUDService
+
+
+class BenchService(CRUDService):
+
+    @accepts()
+    def query(self):
+        return self.middleware.call('datastore.query', 'storage.task')
+
+    @accepts()
+    def zfs_list(self):
+        return self.middleware.call('notifier.zfs_list')
@@ -0,0 +1,81 @@
+"""
+In-memory stand-in of the datastore plugin for benchmarks, so no database
+(nor Django) is needed. Supports the equality filters and the query options
+the benchmark uses.
+"""
+from middlewared.service import Service
+
+import copy
+import crypt
+
+# Password of root in the fake account.bsdusers table
+ROOT_PASSWORD = 'benchmark'
+# Number of rows of every other fake table
+TABLE_ROWS = 200
+
+
+def fake_tables():
+    return {
+        'account.bsdusers': [{
+            'id': 1,
+            'bsdusr_uid': 0,
+            'bsdusr_username': 'root',
+            'bsdusr_unixhash': crypt.crypt(ROOT_PASSWORD, '$6$benchmark'),
+            'bsdusr_home': '/root',
+            'bsdusr_shell': '/bin/csh',
+            'bsdusr_full_name': 'root',
+        }],
+        'storage.volume': [{
+            'id': i,
+            'vol_name': 'tank{0}'.format(i),
+            'vol_fstype': 'ZFS',
+            'vol_guid': str(10000000000000000000 + i),
+            'vol_encrypt': 0,
+            'vol_encryptkey': '',
+        } for i in range(1, TABLE_ROWS + 1)],
+        'storage.task': [{
+            'id': i,
+            'task_filesystem': 'tank{0}/dataset{0}'.format(i),
+            'task_recursive': bool(i % 2),
+            'task_ret_count': 2,
+            'task_ret_unit': 'week',
+            'task_begin': '09:00:00',
+            'task_end': '18:00:00',
+            'task_interval': 60,
+            'task_byweekday': '1,2,3,4,5',
+            'task_enabled': True,
+        } for i in range(1, TABLE_ROWS + 1)],
+    }
+
+
+class DatastoreService(Service):
+
+    def __init__(self, *args, **kwargs):
+        super(DatastoreService, self).__init__(*args, **kwargs)
+        self.__tables = fake_tables()
+
+    def query(self, name, filters=None, options=None):
+        options = options or {}
+        rows = [
+            row for row in self.__tables[name]
+            if all(row.get(f[0]) == f[2] for f in filters or [] if f[1] == '=')
+        ]
+        if options.get('count'):
+            return len(rows)
+        rows = rows[options.get('offset', 0):]
+        if options.get('limit'):
+            rows = rows[:options['limit']]
+        # Serialized copies, as the real one builds new dicts every time
+        rows = copy.deepcopy(rows)
+        if options.get('get'):
+            return rows[0]
+        return rows
+
+    def signature(self):
+        # Fake tables are never written
+        return (0, 0, 0)
+
+    def config(self, name, options=None):
+        options = options.copy() if options else {}
+        options['get'] = True
+        return self.query(name, None, options)
@@ -0,0 +1,44 @@
+"""
+Stand-in of the notifier plugin for benchmarks returning a synthetic
+dataset tree instead of running zfs(8).
+"""
+from middlewared.service import Service
+
+# Number of pools and of datasets within each pool
+POOLS = 4
+DATASETS = 50
+
+
+def fake_dataset(name):
+    return {
+        'name': name,
+        'path': '/mnt/{0}'.format(name),
+        'mountpoint': '/mnt/{0}'.format(name),
+        'used': 1024 * 1024 * 1024,
+        'avail': 10 * 1024 * 1024 * 1024,
+        'refer': 512 * 1024 * 1024,
+        'children': [],
+    }
+
+
+class NotifierService(Service):
+
+    class Config:
+        private = True
+        thread_pool = 'default'
+
+    def __init__(self, *args, **kwargs):
+        super(NotifierService, self).__init__(*args, **kwargs)
+        self.__datasets = {}
+        for i in range(POOLS):
+            pool = fake_dataset('tank{0}'.format(i))
+            pool['children'] = [
+                fake_dataset('tank{0}/dataset{1}'.format(i, j)) for j in range(DATASETS)
+            ]
+            self.__datasets[pool['name']] = pool
+
+    def zfs_list(self, *args):
+        return self.__datasets
+
+    def common(self, name, method, *args, **kwargs):
+        return None
@@ -8,19 +8,22 @@ class Client(object):
         self.base_path = base_path or ''
         self.uri = uri
 
-    def request(self, method, path, params=None, data=None):
+    def request(self, method, path, params=None, data=None, headers=None):
+        _headers = {'Content-Type': "application/json"}
+        if headers:
+            _headers.update(headers)
         r = requests.request(
             method,
             self.uri + self.base_path + path,
             params=params,
             data=json.dumps(data) if data else None,
-            headers={'Content-Type': "application/json"},
+            headers=_headers,
             auth=self.auth,
         )
         return r
 
-    def get(self, path, params=None):
-        return self.request('GET', path, params=params)
+    def get(self, path, params=None, headers=None):
+        return self.request('GET', path, params=params, headers=headers)
 
     def post(self, path, data=None):
         return self.request('POST', path, data=data)
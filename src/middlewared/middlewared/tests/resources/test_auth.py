@@ -0,0 +1,36 @@
+from base import RESTTestCase
+
+import requests
+
+
+class AuthTestCase(RESTTestCase):
+
+    def test_051_generate_token(self):
+        r = self.client.get('auth/generate_token')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        token = r.json()
+        self.assertIsInstance(token, str)
+
+        r = requests.get(
+            self.client.uri + self.client.base_path + 'core/get_services',
+            headers={'Authorization': 'Token {0}'.format(token)},
+        )
+        self.assertEqual(r.status_code, 200, msg=r.text)
+
+    def test_052_invalid_token(self):
+        r = requests.get(
+            self.client.uri + self.client.base_path + 'core/get_services',
+            headers={'Authorization': 'Token invalid'},
+        )
+        self.assertEqual(r.status_code, 401, msg=r.text)
+
+    def test_053_credentials_cache(self):
+        # Every REST request authenticates, the second one is a cache hit
+        r = self.client.get('core/get_stats')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        before = r.json()['auth.cache']
+        r = self.client.get('core/get_stats')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        after = r.json()['auth.cache']
+        self.assertGreater(after['hits'], before['hits'])
+        self.assertGreater(after['hash_hits'], before['hash_hits'])
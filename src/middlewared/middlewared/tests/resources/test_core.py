@@ -14,3 +14,39 @@ class CoreTestCase(RESTTestCase):
         self.assertEqual(r.status_code, 200, msg=r.text)
         data = r.json()
         self.assertIsInstance(data, dict)
+
+    def test_043_get_pools(self):
+        r = self.client.get('core/get_pools')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        data = r.json()
+        self.assertIsInstance(data, dict)
+        self.assertIn('default', data)
+
+    def test_044_get_stats(self):
+        r = self.client.get('core/get_stats')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        data = r.json()
+        self.assertIsInstance(data, dict)
+        self.assertIn('datastore.cache', data)
+
+    def test_045_get_jobs(self):
+        r = self.client.get('core/get_jobs')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        data = r.json()
+        self.assertIsInstance(data, list)
+
+    def test_046_get_methods_etag(self):
+        r = self.client.get('core/get_methods_etag')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        etag = r.json()
+        self.assertIsInstance(etag, str)
+        r = self.client.get('core/get_methods_etag')
+        self.assertEqual(r.json(), etag)
+
+    def test_047_get_methods_conditional(self):
+        r = self.client.get('core/get_methods', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        self.assertEqual(r.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('ETag', r.headers)
+        r = self.client.get('core/get_methods', headers={'If-None-Match': r.headers['ETag']})
+        self.assertEqual(r.status_code, 304)
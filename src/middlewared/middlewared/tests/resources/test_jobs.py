@@ -0,0 +1,76 @@
+from base import RESTTestCase
+
+# Run on the box against the jobs queue alone, with jobs sleeping
+# so their scheduling can be observed.
+PRELUDE = '''
+import gevent
+from middlewared.job import Job, JobsQueue, JobState
+
+class Middleware(object):
+    def __init__(self):
+        self.events = []
+    def send_event(self, name, event_type, **kwargs):
+        self.events.append((kwargs['id'], kwargs.get('fields', {}).get('state')))
+
+def sleeper(job, seconds):
+    gevent.sleep(seconds)
+    return seconds
+
+middleware = Middleware()
+queue = JobsQueue(middleware)
+
+def add(lock, limit, seconds):
+    return queue.add(Job('test.sleeper', sleeper, [seconds], lock, limit))
+
+def states(*jobs):
+    return [job.state for job in jobs]
+'''
+
+
+class JobsTestCase(RESTTestCase):
+
+    def run_jobs(self, script):
+        exitcode, stdout, stderr = self.ssh_exec("python -c \"{0}\"".format(
+            (PRELUDE + script).replace('"', '\\"')
+        ))
+        self.assertEqual(exitcode, 0, msg=stderr)
+
+    def test_071_get_jobs(self):
+        r = self.client.get('core/get_jobs')
+        self.assertEqual(r.status_code, 200, msg=r.text)
+        self.assertIsInstance(r.json(), list)
+
+    def test_072_limit(self):
+        self.run_jobs('''
+jobs = [add('test', 2, 0.2) for i in range(3)]
+gevent.sleep(0.1)
+assert states(*jobs) == ['RUNNING', 'RUNNING', 'WAITING'], states(*jobs)
+gevent.sleep(0.2)
+assert states(*jobs) == ['SUCCESS', 'SUCCESS', 'RUNNING'], states(*jobs)
+jobs[2].wait(1)
+assert jobs[2].result == 0.2, jobs[2].result
+''')
+
+    def test_073_locks(self):
+        self.run_jobs('''
+a, b, c = add('a', 1, 0.2), add('a', 1, 0.2), add('c', 1, 0.2)
+gevent.sleep(0.1)
+assert states(a, b, c) == ['RUNNING', 'WAITING', 'RUNNING'], states(a, b, c)
+b.wait(1)
+assert states(a, b, c) == ['SUCCESS', 'SUCCESS', 'SUCCESS'], states(a, b, c)
+''')
+
+    def test_074_abort(self):
+        self.run_jobs('''
+a, b, c = add('test', 1, 10), add('test', 1, 10), add('test', 1, 0.1)
+gevent.sleep(0.1)
+assert queue.abort(b.id)
+assert queue.abort(a.id)
+c.wait(1)
+assert states(a, b, c) == ['ABORTED', 'ABORTED', 'SUCCESS'], states(a, b, c)
+assert a.time_finished is not None
+assert not queue.abort(a.id)
+# Sent once, by the abort itself
+aborted = [i for i in middleware.events if i[1] == 'ABORTED']
+assert sorted(aborted) == [(a.id, 'ABORTED'), (b.id, 'ABORTED')], aborted
+''')
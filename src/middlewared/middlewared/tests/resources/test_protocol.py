@@ -0,0 +1,24 @@
+from base import RESTTestCase
+
+ROUNDTRIP = '''
+from middlewared.client.protocol import ENCODINGS, decode, encode
+data = {'str': 'abc', 'unicode': u'\\u00e9t\\u00e9', 'nested': [{'a': ['x', u'y', 1]}]}
+expected = {u'str': u'abc', u'unicode': u'\\u00e9t\\u00e9', u'nested': [{u'a': [u'x', u'y', 1]}]}
+for enc in ENCODINGS:
+    # client -> server -> client
+    result = decode(encode(decode(encode(data, enc), enc), enc), enc)
+    assert result == expected, (enc, result)
+    assert isinstance(result['str'], unicode), (enc, result)
+    assert isinstance(result['nested'][0]['a'][0], unicode), (enc, result)
+print(' '.join(ENCODINGS))
+'''
+
+
+class ProtocolTestCase(RESTTestCase):
+
+    def test_061_encodings_roundtrip(self):
+        exitcode, stdout, stderr = self.ssh_exec("python -c \"{0}\"".format(
+            ROUNDTRIP.replace('"', '\\"')
+        ))
+        self.assertEqual(exitcode, 0, msg=stderr)
+        self.assertIn(b'json', stdout)
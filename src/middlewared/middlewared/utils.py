@@ -3,10 +3,52 @@ from freenasUI.contrib.IPAddressField import (
     IPAddressField, IP4AddressField, IP6AddressField
 )
 
+import importlib
+import types
 
-def django_modelobj_serialize(middleware, obj, extend=None):
+
+class LazyImport(object):
+    """
+    Stands for `module` (or its attribute `attr`) importing it on first use,
+    so plugins depending on heavy modules do not delay the startup.
+    Submodules of a module not imported yet are imported when accessed.
+    """
+
+    def __init__(self, module, attr=None):
+        self.__module = module
+        self.__attr = attr
+        self.__obj = None
+
+    def __load(self):
+        if self.__obj is None:
+            obj = importlib.import_module(self.__module)
+            if self.__attr is not None:
+                obj = getattr(obj, self.__attr)
+            self.__obj = obj
+        return self.__obj
+
+    def __getattr__(self, name):
+        obj = self.__load()
+        try:
+            return getattr(obj, name)
+        except AttributeError:
+            if not isinstance(obj, types.ModuleType):
+                raise
+            return importlib.import_module('{0}.{1}'.format(obj.__name__, name))
+
+    def __call__(self, *args, **kwargs):
+        return self.__load()(*args, **kwargs)
+
+
+def django_modelobj_serialize(middleware, obj, extend=None, fields=None):
+    """
+    Serialize a model instance into a dict.
+    `fields` restricts the serialized fields to the given names.
+    """
     data = {}
     for field in obj._meta.fields:
+        if fields is not None and field.name not in fields:
+            continue
         value = getattr(obj, field.name)
         if isinstance(field, (
             IPAddressField, IP4AddressField, IP6AddressField
@@ -0,0 +1,68 @@
+from gevent.monkey import get_original
+from gevent.threadpool import ThreadPool
+
+import threading
+
+# Shared by every pool so nested calls from any worker thread run inline
+_local = threading.local()
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of native threads used to run blocking methods
+    (subprocesses, sqlite, notifier) without stalling the gevent hub.
+
+    `apply` may be called from any thread, counters are guarded by a lock.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.pool = ThreadPool(size)
+        self.pending = 0
+        self.completed = 0
+        self.errors = 0
+        self._lock = get_original('thread', 'allocate_lock')()
+
+    def _run(self, method, args, kwargs):
+        _local.worker = True
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _local.worker = False
+
+    def in_worker(self):
+        return getattr(_local, 'worker', False)
+
+    def apply(self, method, args=None, kwargs=None):
+        """
+        Run `method` in a thread of the pool and wait for its result.
+        Calls made from within a worker thread run inline so nested
+        `middleware.call` do not deadlock waiting for a free slot.
+        """
+        args = args or []
+        kwargs = kwargs or {}
+        if self.in_worker():
+            return method(*args, **kwargs)
+        with self._lock:
+            self.pending += 1
+        try:
+            return self.pool.apply(self._run, (method, args, kwargs))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'running': min(self.pending, self.size),
+                'queued': max(self.pending - self.size, 0),
+                'completed': self.completed,
+                'errors': self.errors,
+            }